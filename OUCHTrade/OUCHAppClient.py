@@ -1,102 +1,111 @@
 #!/usr/bin/env python3
 
 import sys
+import collections
+import selectors
+import socket
 import threading
+import time
+from concurrent.futures import Future
 
 from OUCHTrade.OUCHSocketHandler import OUCHSocketHandler
 from OUCHTrade.OUCHParser import OUCHParser
+from OUCHTrade.OUCHTimerWheel import OUCHTimerWheel
+from OUCHTrade.OUCHEncoder import encoders
 
+login_request_encoder = encoders[('L', None)]
+client_heartbeat_encoder = encoders[('R', None)]
+new_order_encoder = encoders[('U', 'O')]
+replace_order_encoder = encoders[('U', 'U')]
+cancel_order_encoder = encoders[('U', 'X')]
 
-class OUCHAppClient:
 
-    def __init__(self, host, port, username, password, requested_sequence_number):
-        self.ouch_client_sock = OUCHSocketHandler()
+class OUCHAppClient:
+    # Callback called for each received message type, heartbeats and unknown messages go to on_message.
+    # Callbacks are called on the reader thread with (ouch_view, receive_time): the view is only valid during the
+    # call (use to_dict() to keep it) and receive_time is time.perf_counter_ns() when the message was read.
+    message_callbacks = {
+        ('A', None): "on_login",
+        ('J', None): "on_login_reject",
+        ('S', 'A'): "on_accept",
+        ('S', 'U'): "on_replace",
+        ('S', 'C'): "on_cancel",
+        ('S', 'E'): "on_execution",
+        ('S', 'J'): "on_reject"
+    }
+
+    def __init__(self, host, port, username, password, requested_sequence_number, window=1000,
+                 request_timeout=5.0):
+        self.ouch_client_sock = self.create_socket_handler()
         self.host = host
         self.port = port
         self.username = username
         self.password = password
         self.send_seq_num = requested_sequence_number
+        # Blank asks the server for a new session, a session name resumes that session
+        self.requested_session = " "
         self.current_seq_num = int(requested_sequence_number)
         self.group = "DAY "
         self.time_in_force = 99999
         self.firm_id = 0
         self.order_classification = "1"
         self.heartbeat_frequency = 1.0
-
-    def pad_bytes(self, message_tag):
-        if message_tag[3] == "alpha":
-            message_length = message_tag[2]
-            padded_message = message_tag[4].rjust(message_length)
-            return bytes(padded_message, encoding='utf-8')
-        elif message_tag[3] == "integer":
-            message_length = message_tag[2]
-            int_value: int
-            int_value = message_tag[4]
-            padded_message = int_value.to_bytes(message_length, byteorder='big')
-            return padded_message
+        # Driven by the reader thread's I/O loop, other threads schedule timers through call_in_loop
+        self.timer_wheel = OUCHTimerWheel()
+        # (callback, args) handed to the I/O loop by other threads
+        self._loop_calls = collections.deque()
+        self.reader_thread = None
+        self._stop_reader = threading.Event()
+        # Socket pair the sending threads write a byte to, so the reader thread wakes up to flush queued output
+        self._wake_receiver = None
+        self._wake_sender = None
+        # Requests submitted with submit_* waiting for their ack or reject: (kind, order token) -> (future, timer).
+        # kind is "order" for new and replace orders, keyed by the token they introduce, and "cancel" for cancels.
+        # timer is None until the I/O loop has scheduled the request's timeout
+        self.pending_requests = {}
+        # At most window requests are in flight, submit_* waits for a slot for up to request_timeout seconds
+        self.window = window
+        self.request_timeout = request_timeout
+        self._window_slots = threading.BoundedSemaphore(window)
+        # Keeps order tokens in the order their messages are sent when several threads submit
+        self._submit_lock = threading.Lock()
+        # Notified by the reader thread when a flush brings the outbound buffer back below its low watermark
+        self._backpressure_cleared = threading.Condition()
+
+    def create_socket_handler(self):
+        return OUCHSocketHandler()
 
     def create_login_request(self):
 
-        login_list = []
-
-        login_list.append(("packet_type", 2, 1, "alpha", "L"))
-        login_list.append(("username", 3, 6, "alpha", self.username))
-        login_list.append(("password", 9, 10, "alpha", self.password))
-        login_list.append(("requested_session", 19, 10, "alpha", " "))
-        login_list.append(("requested_sequence_number", 29, 20, "alpha", self.send_seq_num))
-
-        login_request = b''
-        for login_tag in login_list:
-            login_request = login_request + self.pad_bytes(login_tag)
-
-        packet_length = len(login_request)
-        login_request = packet_length.to_bytes(2, byteorder='big') + login_request
+        login_request = login_request_encoder.encode(
+            username=self.username,
+            password=self.password,
+            requested_session=self.requested_session,
+            requested_sequence_number=self.send_seq_num
+        )
 
         self.current_seq_num += 1
 
         return login_request
 
     def create_heartbeat_message(self):
-        message_list = []
-
-        message_list.append(("packet_type", 2, 1, "alpha", "R"))
-
-        message = b''
-        for message_tag in message_list:
-            message = message + self.pad_bytes(message_tag)
-
-        packet_length = len(message)
-        message = packet_length.to_bytes(2, byteorder='big') + message
-
-        return message
+        return client_heartbeat_encoder.template
 
     def create_new_order(self, symbol, side, quantity, price):
 
-        message_list = []
-
-        message_list.append(("packet_type", 2, 1, "alpha", "U"))
-        message_list.append(("message_type", 0, 1, "alpha", "O"))
-        message_list.append(("order_token", 1, 4, "integer", self.current_seq_num))
-        message_list.append(("client_reference", 5, 10, "alpha", " "))
-        message_list.append(("buy_sell_indicator", 15, 1, "alpha", side))
-        message_list.append(("quantity", 16, 4, "integer", int(quantity)))
-        message_list.append(("orderbook_id", 20, 4, "integer", int(symbol)))
-        message_list.append(("group", 24, 4, "alpha", self.group))
-        message_list.append(("price", 28, 4, "integer", int(float(price)*10)))
-        message_list.append(("time_in_force", 32, 4, "integer", self.time_in_force))
-        message_list.append(("firm_id", 36, 4, "integer", self.firm_id))
-        message_list.append(("display", 40, 1, "alpha", " "))
-        message_list.append(("capacity", 41, 1, "alpha", "A"))
-        message_list.append(("minimum_quantity", 42, 4, "integer", 0))
-        message_list.append(("order_classification", 46, 1, "alpha", self.order_classification))
-        message_list.append(("cash_margin_type", 47, 1, "alpha", "1"))
-
-        message = b''
-        for message_tag in message_list:
-            message = message + self.pad_bytes(message_tag)
-
-        packet_length = len(message)
-        message = packet_length.to_bytes(2, byteorder='big') + message
+        message = new_order_encoder.encode(
+            order_token=self.current_seq_num,
+            buy_sell_indicator=side,
+            quantity=int(quantity),
+            orderbook_id=int(symbol),
+            group=self.group,
+            price=int(float(price)*10),
+            time_in_force=self.time_in_force,
+            firm_id=self.firm_id,
+            capacity="A",
+            order_classification=self.order_classification,
+            cash_margin_type="1"
+        )
 
         self.current_seq_num += 1
 
@@ -104,24 +113,13 @@ class OUCHAppClient:
 
     def create_replace_order(self, existing_order_token, quantity, price):
 
-        message_list = []
-
-        message_list.append(("packet_type", 2, 1, "alpha", "U"))
-        message_list.append(("message_type", 0, 1, "alpha", "U"))
-        message_list.append(("existing_order_token", 1, 4, "integer", int(existing_order_token)))
-        message_list.append(("replacement_order_token", 5, 4, "integer", self.current_seq_num))
-        message_list.append(("quantity", 9, 4, "integer", int(quantity)))
-        message_list.append(("price", 13, 4, "integer", int(float(price)*10)))
-        message_list.append(("time_in_force", 17, 4, "integer", self.time_in_force))
-        message_list.append(("display", 21, 1, "alpha", " "))
-        message_list.append(("minimum_quantity", 22, 4, "integer", 0))
-
-        message = b''
-        for message_tag in message_list:
-            message = message + self.pad_bytes(message_tag)
-
-        packet_length = len(message)
-        message = packet_length.to_bytes(2, byteorder='big') + message
+        message = replace_order_encoder.encode(
+            existing_order_token=int(existing_order_token),
+            replacement_order_token=self.current_seq_num,
+            quantity=int(quantity),
+            price=int(float(price)*10),
+            time_in_force=self.time_in_force
+        )
 
         self.current_seq_num += 1
 
@@ -129,32 +127,290 @@ class OUCHAppClient:
 
     def create_cancel_order(self, order_token):
 
-        message_list = []
-
-        message_list.append(("packet_type", 2, 1, "alpha", "U"))
-        message_list.append(("message_type", 0, 1, "alpha", "X"))
-        message_list.append(("order_token", 1, 4, "integer", int(order_token)))
-        message_list.append(("quantity", 5, 4, "integer", 0))
-
-        message = b''
-        for message_tag in message_list:
-            message = message + self.pad_bytes(message_tag)
-
-        packet_length = len(message)
-        message = packet_length.to_bytes(2, byteorder='big') + message
+        message = cancel_order_encoder.encode(
+            order_token=int(order_token),
+            quantity=0
+        )
 
         self.current_seq_num += 1
 
         return message
 
+    def call_in_loop(self, callback, *args):
+        # Run callback(*args) on the thread that drives the I/O loop and the timer wheel, from any thread
+        self._loop_calls.append((callback, args))
+        self.wake_reader()
+
+    def run_loop_calls(self):
+        # Called by the I/O loop every iteration
+        loop_calls = self._loop_calls
+        while loop_calls:
+            callback, args = loop_calls.popleft()
+            callback(*args)
+
     def start_sending_heartbeats(self):
+        self.call_in_loop(self.timer_wheel.schedule, self.heartbeat_frequency, self.send_heartbeat)
+
+    def send_heartbeat(self):
+
+        if self.ouch_client_sock.connection_closed:
+            # Connection has been closed, stop sending heartbeats
+            return
 
-        heartbeat_thread = threading.Timer(self.heartbeat_frequency, self.start_sending_heartbeats, [])
-        heartbeat_thread.daemon = True
-        heartbeat_thread.start()
+        next_heartbeat_time = self.ouch_client_sock.last_send_time + self.heartbeat_frequency
+        now = time.monotonic()
+        if next_heartbeat_time > now:
+            # Other messages were sent during this interval, no heartbeat needed yet
+            self.timer_wheel.schedule(next_heartbeat_time - now, self.send_heartbeat)
+            return
+
+        self.timer_wheel.schedule(self.heartbeat_frequency, self.send_heartbeat)
 
         heartbeat = self.create_heartbeat_message()
-        self.ouch_client_sock.send(heartbeat)
+        self.send(heartbeat)
+
+    def send(self, message):
+        # Send from any thread. Output the socket does not take right away is written by the reader thread,
+        # which is woken up to wait for the socket to become writable
+        sent = self.ouch_client_sock.send(message)
+        if self.ouch_client_sock.has_pending_output:
+            self.wake_reader()
+        return sent
+
+    def wake_reader(self):
+        wake_sender = self._wake_sender
+        if wake_sender is not None:
+            try:
+                wake_sender.send(b"\0")
+            except OSError:
+                # Already woken up (the pair is full) or the reader has stopped
+                pass
+
+    def submit(self, kind, create_request, timeout=None):
+        # Send a request and return a Future resolved with its ack or reject as a dict.
+        # create_request returns (order token the response will carry, message)
+        timeout = self.request_timeout if timeout is None else timeout
+        if not self._window_slots.acquire(timeout=timeout):
+            raise TimeoutError(f"{self.window} requests already in flight")
+        if self.ouch_client_sock.backpressure and not self.wait_for_backpressure(timeout):
+            self._window_slots.release()
+            raise TimeoutError(f"outbound buffer still above its high watermark after {timeout} seconds")
+
+        future = Future()
+        deadline = time.monotonic() + timeout
+        with self._submit_lock:
+            order_token, message = create_request()
+            request_key = (kind, order_token)
+            # Registered before sending, the response can arrive before send() returns
+            self.pending_requests[request_key] = (future, None)
+            self.call_in_loop(self.schedule_request_timeout, request_key, deadline, timeout)
+            try:
+                # False only means the message was queued above the high watermark, it is still sent
+                self.send(message)
+                send_error = None
+            except ConnectionError as e:
+                send_error = e
+        if send_error is not None:
+            self.fail_request(request_key, send_error)
+        return future
+
+    def wait_for_backpressure(self, timeout):
+        # Returns False if the outbound buffer is still above its low watermark after timeout seconds
+        with self._backpressure_cleared:
+            return self._backpressure_cleared.wait_for(
+                lambda: not self.ouch_client_sock.backpressure or self.ouch_client_sock.connection_closed, timeout)
+
+    def schedule_request_timeout(self, request_key, deadline, timeout):
+        # Runs on the I/O loop, the request may already have finished
+        pending_request = self.pending_requests.get(request_key)
+        if pending_request is None:
+            return
+        timer = self.timer_wheel.schedule(max(0.0, deadline - time.monotonic()), self.fail_request, request_key,
+                                          TimeoutError(f"no response within {timeout} seconds"))
+        self.pending_requests[request_key] = (pending_request[0], timer)
+
+    def submit_new(self, symbol, side, quantity, price, timeout=None):
+        # Resolves with the Order Accepted or Order Rejected message
+        return self.submit("order", lambda: (self.current_seq_num,
+                                             self.create_new_order(symbol, side, quantity, price)), timeout)
+
+    def submit_replace(self, existing_order_token, quantity, price, timeout=None):
+        # Resolves with the Order Replaced or Order Rejected message
+        return self.submit("order", lambda: (self.current_seq_num,
+                                             self.create_replace_order(existing_order_token, quantity, price)),
+                           timeout)
+
+    def submit_cancel(self, order_token, timeout=None):
+        # Resolves with the Order Canceled or Order Rejected message
+        return self.submit("cancel", lambda: (int(order_token), self.create_cancel_order(order_token)), timeout)
+
+    def finish_request(self, request_key):
+        # Remove a pending request and free its window slot, None if it already finished
+        pending_request = self.pending_requests.pop(request_key, None)
+        if pending_request is None:
+            return None
+        future, timer = pending_request
+        if timer is not None:
+            timer.cancel()
+        self._window_slots.release()
+        return future
+
+    def fail_request(self, request_key, exception):
+        future = self.finish_request(request_key)
+        if future is not None:
+            future.set_exception(exception)
+
+    def fail_pending_requests(self, exception):
+        for request_key in list(self.pending_requests):
+            self.fail_request(request_key, exception)
+
+    @staticmethod
+    def request_keys(message_type, ouch_view):
+        # Keys of the pending requests a response can answer
+        if message_type == "A":
+            return ("order", ouch_view.order_token),
+        elif message_type == "U":
+            return ("order", ouch_view.replacement_order_token),
+        elif message_type == "C":
+            return ("cancel", ouch_view.order_token),
+        elif message_type == "J":
+            return ("order", ouch_view.order_token), ("cancel", ouch_view.order_token)
+        return ()
+
+    def complete_request(self, message_type, ouch_view):
+        for request_key in self.request_keys(message_type, ouch_view):
+            future = self.finish_request(request_key)
+            if future is not None:
+                future.set_result(ouch_view.to_dict())
+                return
+
+    def on_login(self, ouch_view, receive_time):
+        print("Login Accepted: " + str(ouch_view.to_dict()))
+
+    def on_login_reject(self, ouch_view, receive_time):
+        print("Login Rejected: " + str(ouch_view.to_dict()))
+
+    def on_accept(self, ouch_view, receive_time):
+        print(f"Order Accepted - Order Token: {ouch_view.order_token} {ouch_view.to_dict()}")
+
+    def on_replace(self, ouch_view, receive_time):
+        print(f"Order Replaced - Order Token: {ouch_view.replacement_order_token} {ouch_view.to_dict()}")
+
+    def on_cancel(self, ouch_view, receive_time):
+        print(f"Order Canceled - Order Token: {ouch_view.order_token} {ouch_view.to_dict()}")
+
+    def on_execution(self, ouch_view, receive_time):
+        print(f"Filled - Order Token: {ouch_view.order_token} " +
+              f"Executed Quantity: {ouch_view.executed_quantity} Execution Price: {ouch_view.execution_price} "
+              f"{ouch_view.to_dict()}")
+
+    def on_reject(self, ouch_view, receive_time):
+        print(f"Order Rejected - Order Token: {ouch_view.order_token} {ouch_view.to_dict()}")
+
+    def on_message(self, ouch_view, receive_time):
+        if ouch_view.packet_type != "H":
+            print(str(ouch_view.to_dict()))
+
+    def on_disconnect(self):
+        print("Connection closed by server")
+
+    def dispatch(self, ouch_view, receive_time):
+        packet_type = ouch_view.packet_type
+        if packet_type == "H":
+            # Heartbeats only keep the connection alive
+            return
+        message_type = ouch_view.message_type if packet_type == "S" else None
+        if message_type is not None and self.pending_requests:
+            self.complete_request(message_type, ouch_view)
+        callback_name = self.message_callbacks.get((packet_type, message_type), "on_message")
+        getattr(self, callback_name)(ouch_view, receive_time)
+
+    def dispatch_failed(self, ouch_view, exception):
+        # A message that cannot be decoded, or a callback that raises, fails only the request the message answers
+        # (if it is still pending) and the reader goes on with the next message
+        print(f"Error handling message {bytes(ouch_view.buffer)}: {exception!r}")
+        try:
+            request_keys = self.request_keys(ouch_view.get("message_type"), ouch_view) \
+                if ouch_view.packet_type == "S" else ()
+        except AttributeError:
+            # Too short to tell which request it answers, that request times out
+            return
+        for request_key in request_keys:
+            self.fail_request(request_key, exception)
+
+    def receive_loop(self):
+        # Reads and dispatches every message as soon as it arrives, until the connection closes or stop_reader().
+        # Also runs the calls handed over by call_in_loop and the timers: heartbeats and request timeouts
+        ouch_client_sock = self.ouch_client_sock
+        timer_wheel = self.timer_wheel
+        selector = selectors.DefaultSelector()
+        selector.register(ouch_client_sock.sock, selectors.EVENT_READ, ouch_client_sock)
+        selector.register(self._wake_receiver, selectors.EVENT_READ, None)
+        registered_events = selectors.EVENT_READ
+        try:
+            while not self._stop_reader.is_set() and not ouch_client_sock.connection_closed:
+                self.run_loop_calls()
+
+                # Also wait for the socket to become writable while sends are queued behind a full socket buffer
+                events = selectors.EVENT_READ
+                if ouch_client_sock.has_pending_output:
+                    events |= selectors.EVENT_WRITE
+                if events != registered_events:
+                    selector.modify(ouch_client_sock.sock, events, ouch_client_sock)
+                    registered_events = events
+
+                # Wake up in time for the next timer tick, sending threads wake the loop through the socket pair
+                for key, ready_events in selector.select(timer_wheel.time_until_next_tick()):
+                    if key.data is None:
+                        # Woken up by a sending thread, the loop picks up the queued output
+                        self._wake_receiver.recv(4096)
+                        continue
+                    if ready_events & selectors.EVENT_WRITE:
+                        ouch_client_sock.flush()
+                        if not ouch_client_sock.backpressure:
+                            with self._backpressure_cleared:
+                                self._backpressure_cleared.notify_all()
+                    if ready_events & selectors.EVENT_READ:
+                        for received_message in ouch_client_sock.receive_frames(readable=True):
+                            receive_time = time.perf_counter_ns()
+                            ouch_view = OUCHParser.parse_ouch_view(received_message)
+                            try:
+                                self.dispatch(ouch_view, receive_time)
+                            except Exception as e:
+                                self.dispatch_failed(ouch_view, e)
+                        if ouch_client_sock.connection_closed and not self._stop_reader.is_set():
+                            self.on_disconnect()
+
+                timer_wheel.advance()
+        except (OSError, ValueError):
+            # Socket was closed by another thread
+            pass
+        finally:
+            selector.close()
+            wake_receiver, wake_sender = self._wake_receiver, self._wake_sender
+            self._wake_receiver = self._wake_sender = None
+            wake_receiver.close()
+            wake_sender.close()
+            self.fail_pending_requests(ConnectionError("connection closed"))
+            with self._backpressure_cleared:
+                self._backpressure_cleared.notify_all()
+
+    def start_reader(self):
+        # Receive on a dedicated thread so sending never waits for reading and vice versa
+        self._stop_reader.clear()
+        self._wake_receiver, self._wake_sender = socket.socketpair()
+        self._wake_receiver.setblocking(False)
+        self._wake_sender.setblocking(False)
+        self.reader_thread = threading.Thread(target=self.receive_loop)
+        self.reader_thread.daemon = True
+        self.reader_thread.start()
+
+    def stop_reader(self):
+        self._stop_reader.set()
+        self.wake_reader()
+        if self.reader_thread is not None and self.reader_thread is not threading.current_thread():
+            self.reader_thread.join()
+        self.reader_thread = None
 
     def start(self):
 
@@ -166,50 +422,25 @@ class OUCHAppClient:
         print("Sending Login Request:" + str(OUCHParser.parse_ouch_bytes(request)))
         self.ouch_client_sock.send(request)
 
+        # Received messages are printed as they arrive
+        self.start_reader()
+
         # Start sending Heartbeats
         self.start_sending_heartbeats()
 
         try:
             while True:
-                input_text = input("new / replace / cancel / get / close : ")
+                input_text = input("new / replace / cancel / close : ")
                 input_list = input_text.split(" ")
                 if input_list:
-                    if input_list[0] == "get":
-                        received_messages = self.ouch_client_sock.receive()
-                        if not received_messages:
-                            print("No received messages")
-                        else:
-                            for message in received_messages:
-                                ouch_dict = OUCHParser.parse_ouch_bytes(message)
-                                if ouch_dict["packet_type"] == "A":
-                                    print("Login Accepted: " + str(ouch_dict))
-                                elif ouch_dict["packet_type"] == "H":
-                                    # print("Heartbeat: " + str(ouch_dict))
-                                    continue
-                                elif ouch_dict["packet_type"] == "S":
-                                    if ouch_dict["message_type"] == "A":
-                                        print(f"Order Accepted - Order Token: {ouch_dict['order_token']} {ouch_dict}")
-                                    elif ouch_dict["message_type"] == "U":
-                                        print(f"Order Replaced - Order Token: {ouch_dict['replacement_order_token']} {ouch_dict}")
-                                    elif ouch_dict["message_type"] == "C":
-                                        print(f"Order Canceled - Order Token: {ouch_dict['order_token']} {ouch_dict}")
-                                    elif ouch_dict["message_type"] == "E":
-                                        print(f"Filled - Order Token: {ouch_dict['order_token']} " +
-                                              f"Executed Quantity: {ouch_dict['executed_quantity']} Execution Price: {ouch_dict['execution_price']} {ouch_dict}")
-                                    elif ouch_dict["message_type"] == "J":
-                                        print(f"Order Rejected - Order Token: {ouch_dict['order_token']} {ouch_dict}")
-                                    else:
-                                        print(str(ouch_dict))
-                                else:
-                                    print(str(ouch_dict))
-                    elif input_list[0] == "new":
+                    if input_list[0] == "new":
                         if len(input_list) == 5:
                             symbol = input_list[1]
                             side = input_list[2]
                             quantity = input_list[3]
                             price = input_list[4]
                             new_order = self.create_new_order(symbol, side, quantity, price)
-                            self.ouch_client_sock.send(new_order)
+                            self.send(new_order)
                         else:
                             print("Usage: new <symbol> <side> <quantity> <price>")
                     elif input_list[0] == "replace":
@@ -218,22 +449,26 @@ class OUCHAppClient:
                             quantity = input_list[2]
                             price = input_list[3]
                             amend_order = self.create_replace_order(existing_order_token, quantity, price)
-                            self.ouch_client_sock.send(amend_order)
+                            self.send(amend_order)
                         else:
                             print("Usage: replace <existing order token> <quantity> <price>")
                     elif input_list[0] == "cancel":
                         if len(input_list) == 2:
                             order_token = input_list[1]
                             cancel_order = self.create_cancel_order(order_token)
-                            self.ouch_client_sock.send(cancel_order)
+                            self.send(cancel_order)
                         else:
                             print("Usage: cancel <order token>")
                     elif input_list[0] == "close":
+                        self.stop_reader()
                         self.ouch_client_sock.close()
                         sys.exit(1)
         except KeyboardInterrupt:
             print("caught keyboard interrupt, exiting")
+        except ConnectionError as e:
+            print(f"Connection error: {e}")
         finally:
+            self.stop_reader()
             self.ouch_client_sock.close()
 
 
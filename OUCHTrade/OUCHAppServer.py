@@ -1,260 +1,665 @@
 #!/usr/bin/env python3
 
 import sys
-from datetime import datetime
-import select
-import threading
+import os
+import selectors
+import time
+from time import perf_counter_ns
 
 from OUCHTrade.OUCHSocketHandler import OUCHSocketHandler
-from OUCHTrade.OUCHParser import OUCHParser
+from OUCHTrade.OUCHParser import OUCHParser, OUCHMessagePool
+from OUCHTrade.OUCHTimerWheel import OUCHTimerWheel
+from OUCHTrade.OUCHSessionTable import OUCHSession, OUCHSessionTable, OUCHDropCopySubscriber
+from OUCHTrade.OUCHMatchingEngine import OUCHMatchingEngine
+from OUCHTrade.OUCHJournal import OUCHJournal
+from OUCHTrade.OUCHTokenIndex import OUCHTokenIndex
+from OUCHTrade.OUCHEncoder import encoders
+from OUCHTrade.OUCHInstrumentation import OUCHInstrumentation
+from OUCHTrade.OUCHClock import OUCHClock
+from OUCHTrade.OUCHGCScheduler import OUCHGCScheduler
+from OUCHTrade.OUCHBinaryLogger import OUCHBinaryLogger, INBOUND, OUTBOUND
+
+login_response_encoder = encoders[('A', None)]
+login_reject_encoder = encoders[('J', None)]
+server_heartbeat_encoder = encoders[('H', None)]
+new_order_ack_encoder = encoders[('S', 'A')].with_defaults(order_state="L")
+replace_ack_encoder = encoders[('S', 'U')].with_defaults(order_state="L")
+cancel_ack_encoder = encoders[('S', 'C')]
+execution_encoder = encoders[('S', 'E')]
+order_rejected_encoder = encoders[('S', 'J')]
+
+# Order rejected reasons for order tokens
+duplicate_order_token_reason = "D"
+unknown_order_token_reason = "U"
+# Order canceled reason for the resting orders of a session that disconnects
+disconnect_canceled_reason = "Z"
 
 
 class OUCHAppServer:
 
-    def __init__(self, host, port):
+    def __init__(self, host, port, reuse_port=False, journal_directory=None, instrument=False,
+                 log_path=None, low_gc=False, monotonic_clock=False, session_prefix=""):
         self.ouch_server_sock = OUCHSocketHandler()
         self.host = host
         self.port = port
-        self.socket_list = []
-        self.clients_dict = {}
+        self.reuse_port = reuse_port
+        self.selector = selectors.DefaultSelector()
+        self.select_timeout = 1.0
+        self.sessions = OUCHSessionTable(session_prefix)
+        # Low GC mode: pooled message dicts, orders and fills, and collections only between bursts (from start())
+        self.matching_engine = OUCHMatchingEngine(pooled=low_gc)
+        self.parse_message = OUCHMessagePool().parse if low_gc else OUCHParser.parse_ouch_bytes
+        self.gc_scheduler = OUCHGCScheduler() if low_gc else None
+        # Sequenced messages are journaled per session name when a journal directory is given
+        self.journal_directory = journal_directory
+        self.journals = {}
+        # Order tokens used per session name, kept across reconnects of sessions that can resume (journaled ones).
+        # Each holds at most token_window tokens, and only the most recently used max_token_indexes are kept
+        self.token_window = 1 << 18
+        self.max_token_indexes = 1024
+        self.token_indexes = {}
+        # Drop copy usernames -> session names they may follow (None for all), and the logged in subscribers by fileno
+        self.drop_copy_users = {}
+        self.drop_copy_subscribers = {}
+        # A drop copy subscriber with more than this many bytes queued is disconnected rather than slowing anyone
+        self.drop_copy_max_queued = 4 << 20
         self.heartbeat_frequency = 1.0
+        # Close a session when nothing, not even a heartbeat, has been received for this many seconds
+        self.idle_timeout = 15.0
+        self.timer_wheel = OUCHTimerWheel()
+        # Connections with queued output, or broken while sending, to flush or close at the end of the loop iteration
+        self.pending_flush = set()
+        # Timestamps of outbound messages, nanoseconds since midnight. A monotonic clock never goes backwards when the
+        # wall clock is stepped
+        self.clock = OUCHClock(monotonic=monotonic_clock)
+        self.messages_received = 0
+        self.messages_sent = 0
+        # Stage timings and traffic counters, None when instrumentation is off so the hot path only checks for None
+        self.instrumentation = OUCHInstrumentation() if instrument else None
+        # With a log path every frame is logged raw by a background writer instead of being decoded and printed
+        self.message_logger = OUCHBinaryLogger(log_path) if log_path is not None else None
+
+    def create_login_response(self, session, sequence_number=None):
+        # sequence_number is the sequence number of the next sequenced message the client will receive
+
+        if sequence_number is None:
+            sequence_number = session.current_seq_num
+
+        return login_response_encoder.encode(
+            session=session.session_name,
+            sequence_number=str(sequence_number)
+        )
+
+    def create_login_reject(self, reject_reason_code):
+        return login_reject_encoder.encode(reject_reason_code=reject_reason_code)
+
+    def create_heartbeat_message(self, session):
+        return server_heartbeat_encoder.template
+
+    def create_new_order_ack(self, session, new_order_dict):
+
+        message = new_order_ack_encoder.encode(
+            timestamp=self.clock.now(),
+            order_token=new_order_dict["order_token"],
+            client_reference=new_order_dict["client_reference"],
+            buy_sell_indicator=new_order_dict["buy_sell_indicator"],
+            quantity=new_order_dict["quantity"],
+            orderbook_id=new_order_dict["orderbook_id"],
+            group=new_order_dict["group"],
+            price=new_order_dict["price"],
+            time_in_force=new_order_dict["time_in_force"],
+            firm_id=new_order_dict["firm_id"],
+            display=new_order_dict["display"],
+            capacity=new_order_dict["capacity"],
+            order_number=session.current_seq_num,
+            minimum_quantity=new_order_dict["minimum_quantity"],
+            order_classification=new_order_dict["order_classification"],
+            cash_margin_type=new_order_dict["cash_margin_type"]
+        )
+
+        session.current_seq_num += 1
 
-    def pad_bytes(self, message_tag):
-        if message_tag[3] == "alpha":
-            message_length = message_tag[2]
-            padded_message = message_tag[4].rjust(message_length)
-            return bytes(padded_message, encoding='utf-8')
-        elif message_tag[3] == "integer":
-            message_length = message_tag[2]
-            int_value: int
-            int_value = message_tag[4]
-            padded_message = int_value.to_bytes(message_length, byteorder='big')
-            return padded_message
-
-    def create_login_response(self, client_dict):
-
-        login_list = []
-
-        login_list.append(("packet_type", 2, 1, "alpha", "A"))
-        login_list.append(("session", 3, 10, "alpha", client_dict["requested_session"]))
-        login_list.append(("sequence_number", 13, 20, "alpha", str(client_dict["current_seq_num"]).rjust(20)))
-
-        login_response = b''
-        for login_tag in login_list:
-            login_response = login_response + self.pad_bytes(login_tag)
-
-        packet_length = len(login_response)
-        login_response = packet_length.to_bytes(2, byteorder='big') + login_response
-
-        client_dict["current_seq_num"] += 1
-
-        return login_response
+        return message
 
-    def create_heartbeat_message(self, client_dict):
-        message_list = []
+    def create_replace_ack(self, session, replace_request_dict):
+
+        message = replace_ack_encoder.encode(
+            timestamp=self.clock.now(),
+            replacement_order_token=replace_request_dict["replacement_order_token"],
+            buy_sell_indicator=replace_request_dict.get("buy_sell_indicator", " "),
+            quantity=replace_request_dict["quantity"],
+            orderbook_id=replace_request_dict.get("orderbook_id", 0),
+            group=replace_request_dict.get("group", " "),
+            price=replace_request_dict["price"],
+            time_in_force=replace_request_dict["time_in_force"],
+            display=replace_request_dict["display"],
+            order_number=session.current_seq_num,
+            minimum_quantity=replace_request_dict["minimum_quantity"],
+            previous_order_token=replace_request_dict["existing_order_token"]
+        )
+
+        session.current_seq_num += 1
 
-        message_list.append(("packet_type", 2, 1, "alpha", "H"))
+        return message
 
-        message = b''
-        for message_tag in message_list:
-            message = message + self.pad_bytes(message_tag)
+    def create_cancel_ack(self, session, cancel_request_dict):
 
-        packet_length = len(message)
-        message = packet_length.to_bytes(2, byteorder='big') + message
+        message = cancel_ack_encoder.encode(
+            timestamp=self.clock.now(),
+            order_token=cancel_request_dict["order_token"],
+            decrement_quantity=cancel_request_dict.get("decrement_quantity", cancel_request_dict["quantity"]),
+            order_canceled_reason=cancel_request_dict.get("order_canceled_reason", "U")
+        )
 
-        client_dict["current_seq_num"] += 1
+        session.current_seq_num += 1
 
         return message
 
-    def create_new_order_ack(self, client_dict, new_order_dict):
-        message_list = []
-
-        message_list.append(("packet_type", 2, 1, "alpha", "S"))
-        message_list.append(("message_type", 0, 1, "alpha", "A"))
-        message_list.append(("timestamp", 1, 8, "integer", self.getSendingTime()))
-        message_list.append(("order_token", 9, 4, "integer", new_order_dict["order_token"]))
-        message_list.append(("client_reference", 13, 10, "alpha", new_order_dict["client_reference"]))
-        message_list.append(("buy_sell_indicator", 23, 1, "alpha", new_order_dict["buy_sell_indicator"]))
-        message_list.append(("quantity", 24, 4, "integer", new_order_dict["quantity"]))
-        message_list.append(("orderbook_id", 28, 4, "integer", new_order_dict["orderbook_id"]))
-        message_list.append(("group", 32, 4, "alpha", new_order_dict["group"]))
-        message_list.append(("price", 36, 4, "integer", new_order_dict["price"]))
-        message_list.append(("time_in_force", 40, 4, "integer", new_order_dict["time_in_force"]))
-        message_list.append(("firm_id", 44, 4, "integer", new_order_dict["firm_id"]))
-        message_list.append(("display", 48, 1, "alpha", new_order_dict["display"]))
-        message_list.append(("capacity", 49, 1, "alpha", new_order_dict["capacity"]))
-        message_list.append(("order_number", 50, 8, "integer", client_dict["current_seq_num"]))
-        message_list.append(("minimum_quantity", 58, 4, "integer", new_order_dict["minimum_quantity"]))
-        message_list.append(("order_state", 62, 1, "alpha", "L"))
-        message_list.append(("order_classification", 63, 1, "alpha", new_order_dict["order_classification"]))
-        message_list.append(("cash_margin_type", 61, 1, "alpha", new_order_dict["cash_margin_type"]))
-
-        message = b''
-        for message_tag in message_list:
-            message = message + self.pad_bytes(message_tag)
-
-        packet_length = len(message)
-        message = packet_length.to_bytes(2, byteorder='big') + message
-
-        client_dict["current_seq_num"] += 1
+    def create_order_rejected(self, session, order_token, order_rejected_reason):
 
-        return message
+        message = order_rejected_encoder.encode(
+            timestamp=self.clock.now(),
+            order_token=order_token,
+            order_rejected_reason=order_rejected_reason
+        )
 
-    def create_replace_ack(self, client_dict, replace_request_dict):
-        message_list = []
-
-        message_list.append(("packet_type", 2, 1, "alpha", "S"))
-        message_list.append(("message_type", 0, 1, "alpha", "U"))
-        message_list.append(("timestamp", 1, 8, "integer", self.getSendingTime()))
-        message_list.append(
-            ("replacement_order_token", 9, 4, "integer", replace_request_dict["replacement_order_token"]))
-        message_list.append(("buy_sell_indicator", 13, 1, "alpha", " "))
-        message_list.append(("quantity", 14, 4, "integer", replace_request_dict["quantity"]))
-        message_list.append(("orderbook_id", 18, 4, "integer", 0))
-        message_list.append(("group", 22, 4, "alpha", " "))
-        message_list.append(("price", 26, 4, "integer", replace_request_dict["price"]))
-        message_list.append(("time_in_force", 30, 4, "integer", replace_request_dict["time_in_force"]))
-        message_list.append(("display", 34, 1, "alpha", replace_request_dict["display"]))
-        message_list.append(("order_number", 35, 8, "integer", client_dict["current_seq_num"]))
-        message_list.append(("minimum_quantity", 43, 4, "integer", replace_request_dict["minimum_quantity"]))
-        message_list.append(("order_state", 47, 1, "alpha", "L"))
-        message_list.append(("previous_order_token", 48, 4, "integer", replace_request_dict["existing_order_token"]))
-
-        message = b''
-        for message_tag in message_list:
-            message = message + self.pad_bytes(message_tag)
-
-        packet_length = len(message)
-        message = packet_length.to_bytes(2, byteorder='big') + message
-
-        client_dict["current_seq_num"] += 1
+        session.current_seq_num += 1
 
         return message
 
-    def create_cancel_ack(self, client_dict, cancel_request_dict):
-        message_list = []
-
-        message_list.append(("packet_type", 2, 1, "alpha", "S"))
-        message_list.append(("message_type", 0, 1, "alpha", "C"))
-        message_list.append(("timestamp", 1, 8, "integer", self.getSendingTime()))
-        message_list.append(("order_token", 9, 4, "integer", cancel_request_dict["order_token"]))
-        message_list.append(("decrement_quantity", 13, 4, "integer", cancel_request_dict["quantity"]))
-        message_list.append(("order_canceled_reason", 17, 1, "alpha", "U"))
+    def reject_order(self, session, order_token, order_rejected_reason):
+        order_rejected = self.create_order_rejected(session, order_token, order_rejected_reason)
+        self.send_sequenced_message(session, order_rejected)
+        self.log_sent_message("Order Rejected", session.ouch_client_sock, order_rejected)
 
-        message = b''
-        for message_tag in message_list:
-            message = message + self.pad_bytes(message_tag)
+    def create_execution_message(self, session, order_token, executed_quantity, execution_price, liquidity_indicator,
+                                 match_number):
 
-        packet_length = len(message)
-        message = packet_length.to_bytes(2, byteorder='big') + message
+        message = execution_encoder.encode(
+            timestamp=self.clock.now(),
+            order_token=order_token,
+            executed_quantity=executed_quantity,
+            execution_price=execution_price,
+            liquidity_indicator=liquidity_indicator,
+            match_number=match_number
+        )
 
-        client_dict["current_seq_num"] += 1
+        session.current_seq_num += 1
 
         return message
 
-    def getSendingTime(self):
-        now = datetime.now()
-        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        nanoseconds = (now - midnight).microseconds * 1000
-        return nanoseconds
-
-    def start_sending_heartbeats(self, ouch_client_sock, client_dict):
-
-        heartbeat_thread = threading.Timer(self.heartbeat_frequency, self.start_sending_heartbeats,
-                                           [ouch_client_sock, client_dict])
-        heartbeat_thread.daemon = True
-        heartbeat_thread.start()
-
-        heartbeat = self.create_heartbeat_message(client_dict)
-        ouch_client_sock.send(heartbeat)
-        print(f"Sending Heartbeat to {ouch_client_sock.sock.getpeername()}: {OUCHParser.parse_ouch_bytes(heartbeat)} ")
+    def send_message(self, ouch_client_sock, message):
+        # Messages are queued on the connection and written by flush_connections at the end of the loop iteration.
+        # Returns False when the connection is broken or its outbound buffer is above the high watermark.
+        self.messages_sent += 1
+        start_time = self.instrumentation and perf_counter_ns()
+        try:
+            sent = ouch_client_sock.send(message)
+        except ConnectionError as e:
+            print(f"Unable to send: {e}")
+            sent = False
+        if self.instrumentation is not None:
+            self.instrumentation.record_send(start_time, len(message), sent)
+        if ouch_client_sock.has_pending_output or not sent:
+            self.pending_flush.add(ouch_client_sock)
+        return sent
+
+    def send_file(self, ouch_client_sock, file_descriptor, offset, count):
+        # Like send_message for a part of a file, which is written with sendfile when the connection is flushed
+        try:
+            sent = ouch_client_sock.send_file(file_descriptor, offset, count)
+        except ConnectionError as e:
+            print(f"Unable to send: {e}")
+            sent = False
+        if ouch_client_sock.has_pending_output or not sent:
+            self.pending_flush.add(ouch_client_sock)
+        return sent
+
+    def send_sequenced_message(self, session, message):
+        # Sequenced messages are journaled so they can be replayed when the session logs in again
+        if session.journal is not None:
+            session.journal.append(message)
+        sent = self.send_message(session.ouch_client_sock, message)
+        if self.drop_copy_subscribers:
+            self.send_drop_copy(session, message)
+        return sent
+
+    def add_drop_copy_user(self, username, session_names=None):
+        # Logins with this username get the sequenced messages of the given sessions (all if None) instead of a session
+        self.drop_copy_users[username.strip()] = \
+            None if session_names is None else {session_name.strip() for session_name in session_names}
+
+    def send_drop_copy(self, session, message):
+        # The message bytes are shared by every subscriber, only the queue entries are per subscriber.
+        # A Login Accepted packet with the session name and the message's sequence number marks each change of session
+        session_name = session.session_name.strip()
+        session_marker = None
+        for subscriber in list(self.drop_copy_subscribers.values()):
+            if subscriber.session_names is not None and session_name not in subscriber.session_names:
+                continue
+            ouch_client_sock = subscriber.ouch_client_sock
+            if ouch_client_sock.outbound_bytes > self.drop_copy_max_queued:
+                print(f"Disconnecting drop copy {subscriber.username}: {ouch_client_sock.outbound_bytes} bytes queued")
+                self.close_connection(ouch_client_sock)
+                continue
+            if subscriber.last_session_name != session_name:
+                if session_marker is None:
+                    session_marker = self.create_login_response(session, session.current_seq_num - 1)
+                self.send_message(ouch_client_sock, session_marker)
+                subscriber.last_session_name = session_name
+            self.send_message(ouch_client_sock, message)
+
+    def handle_drop_copy_login(self, ouch_client_sock, username):
+        print(f"Drop copy login from {username}")
+        fileno = ouch_client_sock.sock.fileno()
+        if fileno in self.drop_copy_subscribers:
+            self.send_message(ouch_client_sock, self.create_login_reject("S"))
+            return
+        self.drop_copy_subscribers[fileno] = OUCHDropCopySubscriber(username, ouch_client_sock,
+                                                                    self.drop_copy_users[username])
+        self.send_message(ouch_client_sock, login_response_encoder.encode(session="DROPCOPY", sequence_number="1"))
+        self.start_sending_heartbeats(ouch_client_sock, None)
+
+    def journal_path(self, session_name):
+        return os.path.join(self.journal_directory, session_name.strip() + ".journal")
+
+    def journal_exists(self, session_name):
+        # A journal from this or an earlier run belongs to that session, a new session must not take over its name
+        if self.journal_directory is None:
+            return False
+        return session_name in self.journals or os.path.exists(self.journal_path(session_name))
+
+    def open_journal(self, session_name):
+        if self.journal_directory is None:
+            return None
+        journal = self.journals.get(session_name)
+        if journal is None:
+            journal = self.journals[session_name] = OUCHJournal(self.journal_path(session_name))
+        return journal
+
+    def open_token_index(self, session_name):
+        # Most recently used last, so the first entries are the ones to evict
+        token_index = self.token_indexes.pop(session_name, None)
+        if token_index is None:
+            token_index = OUCHTokenIndex(self.token_window)
+        self.token_indexes[session_name] = token_index
+        for stale_session_name in list(self.token_indexes):
+            if len(self.token_indexes) <= self.max_token_indexes:
+                break
+            if self.sessions.get_by_name(stale_session_name) is None:
+                del self.token_indexes[stale_session_name]
+        return token_index
+
+    def stats(self):
+        stats = {
+            "sessions": len(self.sessions),
+            "drop_copy_subscribers": len(self.drop_copy_subscribers),
+            "messages_received": self.messages_received,
+            "messages_sent": self.messages_sent
+        }
+        if self.instrumentation is not None:
+            stats["instrumentation"] = self.instrumentation.snapshot()
+        if self.gc_scheduler is not None:
+            stats["gc"] = self.gc_scheduler.stats()
+        return stats
+
+    def log_received_frame(self, ouch_client_sock, received_message):
+        if self.message_logger is not None:
+            self.message_logger.log(INBOUND, ouch_client_sock.sock.fileno(), received_message)
+
+    def log_received_message(self, description, ouch_dict):
+        if self.message_logger is not None:
+            # Already logged as a raw frame when it was received
+            return
+        start_time = self.instrumentation and perf_counter_ns()
+        print(f"Received {description}:{ouch_dict}")
+        if self.instrumentation is not None:
+            self.instrumentation.record("log", start_time)
+
+    def log_sent_message(self, description, ouch_client_sock, message):
+        start_time = self.instrumentation and perf_counter_ns()
+        if self.message_logger is not None:
+            self.message_logger.log(OUTBOUND, ouch_client_sock.sock.fileno(), message)
+        else:
+            # Decoding the message for the console is part of the logging cost
+            print(f"Sending {description} to {ouch_client_sock.sock.getpeername()}: {OUCHParser.parse_ouch_bytes(message)} ")
+        if self.instrumentation is not None:
+            self.instrumentation.record("log", start_time)
+
+    def start_sending_heartbeats(self, ouch_client_sock, session):
+        self.timer_wheel.schedule(self.heartbeat_frequency, self.send_heartbeat, ouch_client_sock, session)
+
+    def send_heartbeat(self, ouch_client_sock, session):
+
+        if ouch_client_sock.connection_closed or ouch_client_sock.sock.fileno() == -1:
+            # Connection has been closed, stop sending heartbeats
+            return
+
+        now = time.monotonic()
+        if now - ouch_client_sock.last_receive_time > self.idle_timeout:
+            print(f"No messages received for {self.idle_timeout} seconds")
+            self.close_connection(ouch_client_sock)
+            return
+
+        next_heartbeat_time = ouch_client_sock.last_send_time + self.heartbeat_frequency
+        if next_heartbeat_time > now:
+            # Other messages were sent during this interval, no heartbeat needed yet
+            self.timer_wheel.schedule(next_heartbeat_time - now, self.send_heartbeat, ouch_client_sock, session)
+            return
+
+        self.timer_wheel.schedule(self.heartbeat_frequency, self.send_heartbeat, ouch_client_sock, session)
+
+        heartbeat = self.create_heartbeat_message(session)
+        self.send_message(ouch_client_sock, heartbeat)
+        self.log_sent_message("Heartbeat", ouch_client_sock, heartbeat)
+
+    def handle_login(self, ouch_client_sock, ouch_dict):
+        # Found a login request, send a login response
+        print("Received Login Request")
+        requested_session = ouch_dict["requested_session"]
+
+        if ouch_dict["username"].strip() in self.drop_copy_users:
+            self.handle_drop_copy_login(ouch_client_sock, ouch_dict["username"].strip())
+            return
+
+        if self.sessions.get_by_fileno(ouch_client_sock.sock.fileno()) is not None:
+            print("Rejecting Login Request: connection is already logged in")
+            self.send_message(ouch_client_sock, self.create_login_reject("S"))
+            return
+        elif requested_session.strip() == "":
+            session_name = self.sessions.new_session_name(self.journal_exists)
+        elif self.sessions.get_by_name(requested_session) is not None:
+            print(f"Rejecting Login Request: session {requested_session} is already in use")
+            self.send_message(ouch_client_sock, self.create_login_reject("S"))
+            return
+        else:
+            session_name = requested_session
+
+        session = OUCHSession(session_name, ouch_dict["username"], ouch_client_sock)
+        session.journal = self.open_journal(session_name)
+        session.order_tokens = self.open_token_index(session_name)
+        self.sessions.add(session)
+
+        replay_sequence_number = session.current_seq_num
+        if session.journal is not None:
+            # Continue the session's sequence, replaying from the requested sequence number
+            session.current_seq_num = session.journal.next_sequence_number
+            requested_sequence_number = ouch_dict["requested_sequence_number"].strip()
+            replay_sequence_number = session.current_seq_num
+            if requested_sequence_number.isdigit() and 0 < int(requested_sequence_number) < session.current_seq_num:
+                replay_sequence_number = int(requested_sequence_number)
+
+        login_response = self.create_login_response(session, replay_sequence_number)
+        self.send_message(ouch_client_sock, login_response)
+        print("Sent Login Response")
+
+        if replay_sequence_number < session.current_seq_num:
+            # Send every journaled message from the requested sequence number straight from the journal file
+            replay_offset, replay_length = session.journal.replay_range(replay_sequence_number)
+            self.send_file(ouch_client_sock, session.journal.file.fileno(), replay_offset, replay_length)
+            print(f"Replayed messages {replay_sequence_number} to {session.current_seq_num - 1}")
+        # Start sending Heartbeats
+        self.start_sending_heartbeats(ouch_client_sock, session)
+
+    def handle_message(self, ouch_client_sock, ouch_dict):
+
+        if ouch_dict["packet_type"] == "L":
+            self.handle_login(ouch_client_sock, ouch_dict)
+            return
+
+        session = self.sessions.get_by_fileno(ouch_client_sock.sock.fileno())
+        if session is None:
+            print("Ignoring message received before login:" + str(ouch_dict))
+            return
+
+        # Stage timings are only taken when instrumentation is on
+        instrumentation = self.instrumentation
+        start_time = instrumentation and perf_counter_ns()
+
+        if ouch_dict["packet_type"] == "U":
+            if "message_type" in ouch_dict:
+                if ouch_dict["message_type"] == "O":
+                    # Found a new order, send a new order ack and any executions
+                    self.log_received_message("New Order", ouch_dict)
+                    if not session.order_tokens.add(ouch_dict["order_token"]):
+                        self.reject_order(session, ouch_dict["order_token"], duplicate_order_token_reason)
+                        return
+                    if instrumentation is not None:
+                        start_time = perf_counter_ns()
+                    order, fills = self.matching_engine.new_order(session, ouch_dict, session.current_seq_num)
+                    if instrumentation is not None:
+                        start_time = instrumentation.record("match", start_time)
+                    new_order_ack = self.create_new_order_ack(session, ouch_dict)
+                    if instrumentation is not None:
+                        instrumentation.record("build", start_time)
+                    self.send_sequenced_message(session, new_order_ack)
+                    self.log_sent_message("New Order Ack", ouch_client_sock, new_order_ack)
+                    self.send_executions(fills)
+                    if order.quantity > 0 and ouch_dict["time_in_force"] == 0:
+                        # Immediate or cancel, the remaining quantity does not rest in the book
+                        cancel_result = self.create_cancel_ack(session, {"order_token": order.order_token,
+                                                                         "quantity": order.quantity,
+                                                                         "order_canceled_reason": "I"})
+                        self.send_sequenced_message(session, cancel_result)
+                        self.log_sent_message("Order Canceled", ouch_client_sock, cancel_result)
+                elif ouch_dict["message_type"] == "U":
+                    # Found a replace order, send a replace result and any executions
+                    self.log_received_message("Replace Order", ouch_dict)
+                    if not session.order_tokens.add(ouch_dict["replacement_order_token"]):
+                        self.reject_order(session, ouch_dict["replacement_order_token"], duplicate_order_token_reason)
+                        return
+                    if ouch_dict["existing_order_token"] not in session.live_orders:
+                        self.reject_order(session, ouch_dict["replacement_order_token"], unknown_order_token_reason)
+                        return
+                    if instrumentation is not None:
+                        start_time = perf_counter_ns()
+                    order, fills = self.matching_engine.replace_order(session, ouch_dict, session.current_seq_num)
+                    if instrumentation is not None:
+                        start_time = instrumentation.record("match", start_time)
+                    if order is not None:
+                        ouch_dict["buy_sell_indicator"] = order.buy_sell_indicator
+                        ouch_dict["orderbook_id"] = order.orderbook_id
+                    replace_result = self.create_replace_ack(session, ouch_dict)
+                    if instrumentation is not None:
+                        instrumentation.record("build", start_time)
+                    self.send_sequenced_message(session, replace_result)
+                    self.log_sent_message("Order Replaced", ouch_client_sock, replace_result)
+                    self.send_executions(fills)
+                elif ouch_dict["message_type"] == "X":
+                    # Found a cancel order, send a cancel result
+                    self.log_received_message("Cancel Order", ouch_dict)
+                    if ouch_dict["order_token"] not in session.live_orders:
+                        self.reject_order(session, ouch_dict["order_token"], unknown_order_token_reason)
+                        return
+                    if instrumentation is not None:
+                        start_time = perf_counter_ns()
+                    ouch_dict["decrement_quantity"] = self.matching_engine.cancel_order(session, ouch_dict["order_token"],
+                                                                                       ouch_dict["quantity"])
+                    if instrumentation is not None:
+                        start_time = instrumentation.record("match", start_time)
+                    cancel_result = self.create_cancel_ack(session, ouch_dict)
+                    if instrumentation is not None:
+                        instrumentation.record("build", start_time)
+                    self.send_sequenced_message(session, cancel_result)
+                    self.log_sent_message("Order Canceled", ouch_client_sock, cancel_result)
+
+    def send_executions(self, fills):
+        # Each fill is reported to both sides, the incoming order removed liquidity and the resting order added it
+        instrumentation = self.instrumentation
+        for fill in fills:
+            for order, liquidity_indicator in ((fill.aggressor, "R"), (fill.resting, "A")):
+                session = order.session
+                start_time = instrumentation and perf_counter_ns()
+                execution = self.create_execution_message(session, order.order_token, fill.executed_quantity,
+                                                          fill.execution_price, liquidity_indicator, fill.match_number)
+                if instrumentation is not None:
+                    instrumentation.record("build", start_time)
+                self.send_sequenced_message(session, execution)
+                self.log_sent_message("Order Executed", session.ouch_client_sock, execution)
+
+    def remove_session(self, session):
+        # Resting orders are canceled. The cancels are journaled, so a replay after the session logs in again shows
+        # the orders as canceled, and go to drop copy; the connection itself is gone
+        for order in self.matching_engine.cancel_session(session):
+            cancel_result = self.create_cancel_ack(session, {"order_token": order.order_token, "quantity": 0,
+                                                             "decrement_quantity": order.quantity,
+                                                             "order_canceled_reason": disconnect_canceled_reason})
+            if session.journal is not None:
+                session.journal.append(cancel_result)
+            if self.drop_copy_subscribers:
+                self.send_drop_copy(session, cancel_result)
+        self.sessions.remove(session)
+        if session.journal is None:
+            # Without a journal the session cannot resume, a later login with its name starts over
+            self.token_indexes.pop(session.session_name, None)
+
+    def accept_connections(self):
+        # Accept every pending connection, the listening socket is non-blocking
+        while True:
+            try:
+                client_socket, client_address = self.ouch_server_sock.sock.accept()
+            except BlockingIOError:
+                return
+            print(f"Accepting new connection from {client_address}")
+            # One long-lived handler per connection, kept as the selector key data
+            ouch_client_sock = OUCHSocketHandler(client_socket, auto_flush=False)
+            self.selector.register(client_socket, selectors.EVENT_READ, ouch_client_sock)
+
+    def close_connection(self, ouch_client_sock):
+        if ouch_client_sock.sock.fileno() == -1:
+            # Already closed
+            return
+        print("Closing connection")
+        session = self.sessions.get_by_fileno(ouch_client_sock.sock.fileno())
+        if session is not None:
+            self.remove_session(session)
+        self.drop_copy_subscribers.pop(ouch_client_sock.sock.fileno(), None)
+        self.selector.unregister(ouch_client_sock.sock)
+        self.pending_flush.discard(ouch_client_sock)
+        ouch_client_sock.close()
+
+    def flush_connections(self):
+        # Write everything queued during this loop iteration, coalesced into one sendmsg per connection
+        pending_flush = self.pending_flush
+        self.pending_flush = set()
+        for ouch_client_sock in pending_flush:
+            if not ouch_client_sock.connection_closed:
+                try:
+                    ouch_client_sock.flush()
+                except ConnectionError as e:
+                    print(f"Unable to send: {e}")
+            if ouch_client_sock.connection_closed:
+                self.close_connection(ouch_client_sock)
+                continue
+
+            # Wait for the socket to become writable while output is left. A connection above its high watermark
+            # is not read from until it drains, so a slow reader cannot make the server queue without bound
+            events = 0 if ouch_client_sock.backpressure else selectors.EVENT_READ
+            if ouch_client_sock.has_pending_output:
+                events |= selectors.EVENT_WRITE
+            if self.selector.get_key(ouch_client_sock.sock).events != events:
+                self.selector.modify(ouch_client_sock.sock, events, ouch_client_sock)
+
+    def receive_messages_instrumented(self, ouch_client_sock):
+        # Same as the receive loop in process_events, with the time spent in each stage recorded
+        instrumentation = self.instrumentation
+        start_time = perf_counter_ns()
+        for received_message in ouch_client_sock.receive_frames(readable=True):
+            start_time = instrumentation.record_receive(start_time, len(received_message))
+            self.messages_received += 1
+            self.log_received_frame(ouch_client_sock, received_message)
+            start_time = instrumentation.record("log", start_time)
+            ouch_dict = self.parse_message(received_message)
+            start_time = instrumentation.record("parse", start_time)
+            self.handle_message(ouch_client_sock, ouch_dict)
+            start_time = instrumentation.record("handle", start_time)
+
+    def process_events(self, timeout):
+        # Wake up in time for the next timer tick
+        time_until_next_tick = self.timer_wheel.time_until_next_tick()
+        if time_until_next_tick is not None:
+            timeout = min(timeout, time_until_next_tick)
+
+        # Wait for activity on any socket, only the ready sockets are returned
+        ready = self.selector.select(timeout)
+        for key, events in ready:
+            if key.data is None:
+                # Listening socket is readable - new connection, accept it
+                self.accept_connections()
+                continue
+
+            ouch_client_sock = key.data
+            if events & selectors.EVENT_WRITE:
+                # Room in the socket for the queued output
+                self.pending_flush.add(ouch_client_sock)
+            if events & selectors.EVENT_READ:
+                # Receive messages from client
+                if self.instrumentation is None:
+                    for received_message in ouch_client_sock.receive_frames(readable=True):
+                        self.messages_received += 1
+                        self.log_received_frame(ouch_client_sock, received_message)
+                        ouch_dict = self.parse_message(received_message)
+                        self.handle_message(ouch_client_sock, ouch_dict)
+                else:
+                    self.receive_messages_instrumented(ouch_client_sock)
+
+                if ouch_client_sock.connection_closed:
+                    self.close_connection(ouch_client_sock)
+
+        # Heartbeats and idle checks for every session
+        self.timer_wheel.advance()
+
+        self.flush_connections()
+
+        if self.gc_scheduler is not None:
+            # Nothing was ready this iteration, a good time to collect
+            self.gc_scheduler.maybe_collect(idle=not ready)
 
     def start(self):
 
         # Listen for connections from OUCH Client
-        self.ouch_server_sock.listen(self.host, self.port)
-        self.socket_list.append(self.ouch_server_sock.sock)
+        self.ouch_server_sock.listen(self.host, self.port, self.reuse_port)
+        self.ouch_server_sock.sock.setblocking(False)
+        self.selector.register(self.ouch_server_sock.sock, selectors.EVENT_READ, None)
+        if self.gc_scheduler is not None:
+            self.gc_scheduler.start()
 
         try:
             # Check for incoming messages
             while True:
-
-                read_sockets, _, exception_sockets = select.select(self.socket_list, [], self.socket_list, 0)
-
-                for notified_socket in read_sockets:
-                    # If notified socket is a server socket - new connection, accept it
-                    if notified_socket == self.ouch_server_sock.sock:
-                        # Accept new connection
-                        client_socket, client_address = self.ouch_server_sock.sock.accept()
-                        print(f"Accepting new connection from {client_address}")
-                        self.socket_list.append(client_socket)
-                    else:
-                        # Receive messages from client
-                        ouch_client_sock = OUCHSocketHandler(notified_socket)
-                        received_messages = ouch_client_sock.receive()
-
-                        for received_message in received_messages:
-
-                            ouch_dict = OUCHParser.parse_ouch_bytes(received_message)
-
-                            if ouch_dict["packet_type"] == "L":
-                                # Found a login request, send a login response
-                                print("Received Login Request")
-                                requested_session = ouch_dict["requested_session"]
-
-                                self.clients_dict = {
-                                                    notified_socket:
-                                                    {
-                                                        "requested_session": requested_session,
-                                                        "current_seq_num": 1
-                                                    }
-                                }
-
-                                login_response = self.create_login_response(self.clients_dict[notified_socket])
-                                ouch_client_sock.send(login_response)
-                                print("Sent Login Response")
-                                # Start sending Heartbeats
-                                self.start_sending_heartbeats(ouch_client_sock, self.clients_dict[notified_socket])
-                            elif ouch_dict["packet_type"] == "U":
-                                if "message_type" in ouch_dict:
-                                    if ouch_dict["message_type"] == "O":
-                                        # Found a new order, send a new order ack
-                                        print("Received New Order:" + str(ouch_dict))
-                                        client_dict = self.clients_dict[notified_socket]
-                                        new_order_ack = self.create_new_order_ack(client_dict, ouch_dict)
-                                        ouch_client_sock.send(new_order_ack)
-                                        print(f"Sending New Order Ack to {ouch_client_sock.sock.getpeername()}: {OUCHParser.parse_ouch_bytes(new_order_ack)} ")
-                                    elif ouch_dict["message_type"] == "U":
-                                        # Found a replace order, send a replace result
-                                        print("Received Replace Order:" + str(ouch_dict))
-                                        client_dict = self.clients_dict[notified_socket]
-                                        replace_result = self.create_replace_ack(client_dict, ouch_dict)
-                                        ouch_client_sock.send(replace_result)
-                                        print(f"Sending Order Replaced to {ouch_client_sock.sock.getpeername()}: {OUCHParser.parse_ouch_bytes(replace_result)} ")
-                                    elif ouch_dict["message_type"] == "X":
-                                        # Found a cancel order, send a cancel result
-                                        print("Received Cancel Order:" + str(ouch_dict))
-                                        client_dict = self.clients_dict[notified_socket]
-                                        cancel_result = self.create_cancel_ack(client_dict, ouch_dict)
-                                        ouch_client_sock.send(cancel_result)
-                                        print(f"Sending Order Canceled to {ouch_client_sock.sock.getpeername()}: {OUCHParser.parse_ouch_bytes(cancel_result)} ")
+                self.process_events(self.select_timeout)
 
         except KeyboardInterrupt:
             print("caught keyboard interrupt, exiting")
         finally:
-            for sock in self.socket_list:
-                sock.close()
+            for key in list(self.selector.get_map().values()):
+                key.fileobj.close()
+            self.selector.close()
+            for journal in self.journals.values():
+                journal.close()
+            if self.message_logger is not None:
+                self.message_logger.close()
+            if self.gc_scheduler is not None:
+                self.gc_scheduler.stop()
 
 
 if __name__ == "__main__":
 
-    if len(sys.argv) != 3:
-        print("usage:", sys.argv[0], "<host> <port>")
+    main_low_gc = "--low-gc" in sys.argv
+    main_monotonic_clock = "--monotonic-clock" in sys.argv
+    main_arguments = [argument for argument in sys.argv if argument not in ("--low-gc", "--monotonic-clock")]
+    if len(main_arguments) not in (3, 4, 5):
+        print("usage:", sys.argv[0],
+              "<host> <port> [journal directory|-] [binary log file] [--low-gc] [--monotonic-clock]")
         sys.exit(1)
 
-    main_host, main_port = sys.argv[1], int(sys.argv[2])
+    main_host, main_port = main_arguments[1], int(main_arguments[2])
+    main_journal_directory = main_arguments[3] if len(main_arguments) >= 4 and main_arguments[3] != "-" else None
+    main_log_path = main_arguments[4] if len(main_arguments) == 5 else None
 
-    ouch_app_server = OUCHAppServer(main_host, main_port)
+    ouch_app_server = OUCHAppServer(main_host, main_port, journal_directory=main_journal_directory,
+                                    log_path=main_log_path, low_gc=main_low_gc,
+                                    monotonic_clock=main_monotonic_clock)
 
     # Start the OUCH Server
     ouch_app_server.start()
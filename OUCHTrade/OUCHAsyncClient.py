@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import sys
+import asyncio
+
+from OUCHTrade.OUCHAppClient import OUCHAppClient
+from OUCHTrade.OUCHFrameDecoder import OUCHFrameDecoder
+from OUCHTrade.OUCHParser import OUCHParser
+
+
+class OUCHClientProtocol(asyncio.Protocol):
+
+    def __init__(self, ouch_async_client):
+        self.ouch_async_client = ouch_async_client
+        self.frame_decoder = OUCHFrameDecoder(buffer_size=4096)
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.ouch_async_client.connection_lost()
+
+    def data_received(self, data):
+        self.frame_decoder.feed(data)
+        for received_message in self.frame_decoder.frames():
+            ouch_view = OUCHParser.parse_ouch_view(received_message)
+            if ouch_view.packet_type == "H":
+                continue
+            self.ouch_async_client.received_messages.put_nowait(ouch_view.to_dict())
+
+
+class OUCHAsyncClient(OUCHAppClient):
+
+    def __init__(self, host, port, username, password, requested_sequence_number):
+        super().__init__(host, port, username, password, requested_sequence_number)
+        self.loop = None
+        self.transport = None
+        self.heartbeat_handle = None
+        self.received_messages = asyncio.Queue()
+
+    def create_socket_handler(self):
+        # The event loop's transport owns the connection, no socket of its own
+        return None
+
+    def send(self, message):
+        if self.transport is None or self.transport.is_closing():
+            return False
+        self.transport.write(message)
+        return True
+
+    def start_sending_heartbeats(self):
+        # Scheduled on the event loop instead of a timer thread
+        self.heartbeat_handle = self.loop.call_later(self.heartbeat_frequency, self.start_sending_heartbeats)
+        self.send(self.create_heartbeat_message())
+
+    def connection_lost(self):
+        if self.heartbeat_handle is not None:
+            self.heartbeat_handle.cancel()
+            self.heartbeat_handle = None
+
+    async def connect(self):
+        # Open connection to OUCH Server, log in and start sending heartbeats
+        self.loop = asyncio.get_running_loop()
+        self.transport, _ = await self.loop.create_connection(lambda: OUCHClientProtocol(self), self.host, self.port)
+        self.send(self.create_login_request())
+        self.start_sending_heartbeats()
+
+    async def receive(self, timeout=None):
+        # Wait for the next message other than a heartbeat
+        return await asyncio.wait_for(self.received_messages.get(), timeout)
+
+    async def new_order(self, symbol, side, quantity, price):
+        order_token = self.current_seq_num
+        self.send(self.create_new_order(symbol, side, quantity, price))
+        return order_token
+
+    async def replace_order(self, existing_order_token, quantity, price):
+        replacement_order_token = self.current_seq_num
+        self.send(self.create_replace_order(existing_order_token, quantity, price))
+        return replacement_order_token
+
+    async def cancel_order(self, order_token):
+        self.send(self.create_cancel_order(order_token))
+
+    async def close(self):
+        self.connection_lost()
+        if self.transport is not None:
+            self.transport.close()
+
+
+async def run_sessions(host, port, username, password, requested_sequence_number, sessions):
+    # Log in a number of sessions from one event loop and send one order on each
+    clients = [OUCHAsyncClient(host, port, username, password, requested_sequence_number) for _ in range(sessions)]
+    await asyncio.gather(*(client.connect() for client in clients))
+
+    for client in clients:
+        login_response = await client.receive(timeout=5)
+        print("Login Accepted: " + str(login_response))
+        await client.new_order("1", "B", "100", "10")
+        print("Order Accepted: " + str(await client.receive(timeout=5)))
+
+    await asyncio.gather(*(client.close() for client in clients))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (6, 7):
+        print("usage:", sys.argv[0], "<host> <port> <username> <password> <requested sequence number> [sessions]")
+        sys.exit(1)
+
+    main_host, main_port = sys.argv[1], int(sys.argv[2])
+    main_username = sys.argv[3]
+    main_password = sys.argv[4]
+    main_requested_sequence_number = sys.argv[5]
+    main_sessions = int(sys.argv[6]) if len(sys.argv) == 7 else 1
+
+    asyncio.run(run_sessions(main_host, main_port, main_username, main_password, main_requested_sequence_number,
+                             main_sessions))
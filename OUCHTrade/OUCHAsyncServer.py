@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import time
+import asyncio
+
+from OUCHTrade.OUCHAppServer import OUCHAppServer
+from OUCHTrade.OUCHFrameDecoder import OUCHFrameDecoder
+
+
+class OUCHServerProtocol(asyncio.Protocol):
+    # One protocol per connection, it stands in for OUCHSocketHandler in OUCHAppServer.handle_message
+    # The transport buffers and writes the output itself
+    has_pending_output = False
+    backpressure = False
+
+    def __init__(self, ouch_app_server):
+        self.ouch_app_server = ouch_app_server
+        self.frame_decoder = OUCHFrameDecoder(buffer_size=4096)
+        self.transport = None
+        self.sock = None
+        self.connection_closed = False
+        # Monotonic times of the last outbound and inbound traffic, used for heartbeat suppression and idle detection
+        self.last_send_time = time.monotonic()
+        self.last_receive_time = self.last_send_time
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.sock = transport.get_extra_info("socket")
+        print(f"Accepting new connection from {transport.get_extra_info('peername')}")
+
+    def connection_lost(self, exc):
+        print("Closing connection")
+        self.connection_closed = True
+        session = self.ouch_app_server.sessions.get_by_fileno(self.sock.fileno())
+        if session is not None:
+            self.ouch_app_server.remove_session(session)
+        self.ouch_app_server.drop_copy_subscribers.pop(self.sock.fileno(), None)
+
+    def data_received(self, data):
+        self.last_receive_time = time.monotonic()
+        self.frame_decoder.feed(data)
+        for received_message in self.frame_decoder.frames():
+            self.ouch_app_server.messages_received += 1
+            self.ouch_app_server.log_received_frame(self, received_message)
+            ouch_dict = self.ouch_app_server.parse_message(received_message)
+            self.ouch_app_server.handle_message(self, ouch_dict)
+
+    @property
+    def outbound_bytes(self):
+        return self.transport.get_write_buffer_size()
+
+    def send(self, message):
+        if self.connection_closed:
+            return False
+        if isinstance(message, memoryview):
+            # The transport may hold on to unsent data, do not let it keep a view of a journal
+            message = bytes(message)
+        self.transport.write(message)
+        self.last_send_time = time.monotonic()
+        return True
+
+    def send_file(self, file_descriptor, offset, count):
+        # The transport only writes from memory
+        if self.connection_closed:
+            return False
+        self.transport.write(os.pread(file_descriptor, count, offset))
+        self.last_send_time = time.monotonic()
+        return True
+
+    def close(self):
+        self.transport.close()
+
+
+class OUCHAsyncServer(OUCHAppServer):
+
+    def __init__(self, host, port, reuse_port=False):
+        super().__init__(host, port, reuse_port)
+        self.loop = None
+
+    def send_message(self, ouch_client_sock, message):
+        # The transport buffers and writes the output itself, nothing is left for a flush at the end of a loop
+        # iteration, so connections are not added to pending_flush
+        self.messages_sent += 1
+        return ouch_client_sock.send(message)
+
+    def send_file(self, ouch_client_sock, file_descriptor, offset, count):
+        return ouch_client_sock.send_file(file_descriptor, offset, count)
+
+    def close_connection(self, ouch_client_sock):
+        # connection_lost removes the session
+        ouch_client_sock.close()
+
+    def advance_timers(self):
+        # Heartbeats and idle checks run on the same timer wheel as OUCHAppServer, driven by the event loop
+        self.timer_wheel.advance()
+        time_until_next_tick = self.timer_wheel.time_until_next_tick()
+        if time_until_next_tick is None:
+            # Nothing scheduled, check again next tick for timers added by new logins
+            time_until_next_tick = self.timer_wheel.tick_interval
+        self.loop.call_later(time_until_next_tick, self.advance_timers)
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.advance_timers()
+        server = await self.loop.create_server(lambda: OUCHServerProtocol(self), self.host, self.port,
+                                               reuse_address=True, reuse_port=self.reuse_port)
+        print(f'Listening for connection on {self.host}:{self.port}...')
+        async with server:
+            await server.serve_forever()
+
+    def start(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print("caught keyboard interrupt, exiting")
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) != 3:
+        print("usage:", sys.argv[0], "<host> <port>")
+        sys.exit(1)
+
+    main_host, main_port = sys.argv[1], int(sys.argv[2])
+
+    ouch_async_server = OUCHAsyncServer(main_host, main_port)
+
+    # Start the OUCH Server
+    ouch_async_server.start()
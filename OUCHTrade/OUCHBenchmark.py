@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import argparse
+import gc
+import json
+import multiprocessing
+import random
+import selectors
+import socket
+import time
+import timeit
+import tracemalloc
+from time import perf_counter_ns
+
+from OUCHTrade.OUCHAppClient import OUCHAppClient
+from OUCHTrade.OUCHAppServer import OUCHAppServer
+from OUCHTrade.OUCHSessionTable import OUCHSession
+from OUCHTrade.OUCHSocketHandler import OUCHSocketHandler
+from OUCHTrade.OUCHLatencyHistogram import OUCHLatencyHistogram
+from OUCHTrade.OUCHMatchingEngine import OUCHMatchingEngine
+from OUCHTrade.OUCHEncoder import encoders
+from OUCHTrade.OUCHParser import OUCHParser
+from OUCHTrade.OUCHSchema import message_dicts, unsequenced_message_dicts, sequenced_message_dicts
+
+# Results compared against when no other baseline is given, regenerate with --save after an intended change
+default_baseline_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "OUCHBenchmarkBaseline.json")
+
+
+class OUCHBenchmark:
+    # Codec micro-benchmarks: ns/op and memory per message for encoding and decoding every message type,
+    # the app create_* builders and the matching engine. Results can be saved as JSON and compared to a baseline.
+
+    def __init__(self, iterations, repeat=3):
+        self.iterations = iterations
+        self.repeat = repeat
+
+    @staticmethod
+    def sample_messages():
+        client = OUCHAppClient("localhost", 0, "user01", "pass", "1")
+        server = OUCHAppServer("localhost", 0)
+        session = OUCHSession("SESSION", "user01")
+
+        new_order = client.create_new_order("1234", "B", "100", "10.5")
+        replace_order = client.create_replace_order("1", "50", "11")
+        cancel_order = client.create_cancel_order("1")
+
+        return {
+            "login_request": client.create_login_request(),
+            "client_heartbeat": client.create_heartbeat_message(),
+            "new_order": new_order,
+            "replace_order": replace_order,
+            "cancel_order": cancel_order,
+            "login_response": server.create_login_response(session),
+            "server_heartbeat": server.create_heartbeat_message(session),
+            "new_order_ack": server.create_new_order_ack(session, OUCHParser.parse_ouch_bytes(new_order)),
+            "replace_ack": server.create_replace_ack(session, OUCHParser.parse_ouch_bytes(replace_order)),
+            "cancel_ack": server.create_cancel_ack(session, OUCHParser.parse_ouch_bytes(cancel_order)),
+        }
+
+    @staticmethod
+    def sample_field_values(encoder):
+        # A value for every field of the message, so no field is left at its default
+        field_values = {}
+        for name, _, length, field_type in encoder.message_list:
+            if name == "message_type":
+                continue
+            field_values[name] = min(12345, (1 << (8 * length)) - 1) if field_type == "integer" else "X"
+        return field_values
+
+    @staticmethod
+    def parse_field_by_field(ouch_bytes):
+        # Reference decode: walk the field list one field at a time
+        packet_type_chr = chr(ouch_bytes[2])
+        ouch_dict = {"packet_type": packet_type_chr}
+        if packet_type_chr == 'S':
+            return OUCHParser.parse_message(ouch_bytes[3:], sequenced_message_dicts[chr(ouch_bytes[3])], ouch_dict)
+        elif packet_type_chr == 'U':
+            return OUCHParser.parse_message(ouch_bytes[3:], unsequenced_message_dicts[chr(ouch_bytes[3])], ouch_dict)
+        elif packet_type_chr in message_dicts:
+            return OUCHParser.parse_message(ouch_bytes, message_dicts[packet_type_chr], ouch_dict)
+        return ouch_dict
+
+    @staticmethod
+    def read_packet_type_view(ouch_bytes):
+        return OUCHParser.parse_ouch_view(ouch_bytes).packet_type
+
+    def cases(self):
+        # Case name -> function without arguments
+        cases = {}
+
+        # Every packet and message type in the schema
+        for (packet_type, message_type), encoder in encoders.items():
+            key = packet_type if message_type is None else packet_type + "/" + message_type
+            field_values = self.sample_field_values(encoder)
+            message = encoder.encode(**field_values)
+            cases["encode " + key] = lambda encode=encoder.encode, field_values=field_values: encode(**field_values)
+            cases["decode " + key] = lambda message=message: OUCHParser.parse_ouch_bytes(message)
+            cases["decode field-by-field " + key] = lambda message=message: self.parse_field_by_field(message)
+            cases["view packet_type " + key] = lambda message=message: self.read_packet_type_view(message)
+
+        # The builders the client and server call on the hot path
+        client = OUCHAppClient("localhost", 0, "user01", "pass", "1")
+        server = OUCHAppServer("localhost", 0)
+        session = OUCHSession("SESSION", "user01")
+        samples = self.sample_messages()
+        new_order_dict = OUCHParser.parse_ouch_bytes(samples["new_order"])
+        replace_order_dict = OUCHParser.parse_ouch_bytes(samples["replace_order"])
+        cancel_order_dict = OUCHParser.parse_ouch_bytes(samples["cancel_order"])
+        cases["client create_new_order"] = lambda: client.create_new_order("1234", "B", "100", "10.5")
+        cases["client create_replace_order"] = lambda: client.create_replace_order("1", "50", "11")
+        cases["client create_cancel_order"] = lambda: client.create_cancel_order("1")
+        cases["server create_new_order_ack"] = lambda: server.create_new_order_ack(session, new_order_dict)
+        cases["server create_replace_ack"] = lambda: server.create_replace_ack(session, replace_order_dict)
+        cases["server create_cancel_ack"] = lambda: server.create_cancel_ack(session, cancel_order_dict)
+        cases["server create_execution_message"] = \
+            lambda: server.create_execution_message(session, 1, 100, 105, "A", 1)
+
+        return cases
+
+    def time_ns_per_op(self, function):
+        total_seconds = min(timeit.repeat(function, number=self.iterations, repeat=self.repeat))
+        return total_seconds * 1e9 / self.iterations
+
+    @staticmethod
+    def peak_bytes_per_op(function):
+        # Most memory allocated at any point during one call, temporaries included, averaged over a batch of calls
+        batch_size = 1000
+        total_bytes = 0
+        result = None
+        tracemalloc.start()
+        for _ in range(batch_size):
+            result = None
+            current_bytes = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            result = function()
+            total_bytes += tracemalloc.get_traced_memory()[1] - current_bytes
+        tracemalloc.stop()
+        return total_bytes / batch_size
+
+    @staticmethod
+    def retained_blocks_per_op(function):
+        # Number of memory blocks still referenced after each call (its result), averaged over a batch of calls.
+        # Temporaries freed before the call returns are not counted, peak_bytes_per_op covers those
+        batch_size = 1000
+        results = [None] * batch_size
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        for index in range(batch_size):
+            results[index] = function()
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        allocated_blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+        return allocated_blocks / batch_size
+
+    @staticmethod
+    def apply_operation(matching_engine, session, message_type, operation):
+        if message_type == "O":
+            matching_engine.new_order(session, operation, 0)
+        elif message_type == "U":
+            matching_engine.replace_order(session, operation, 0)
+        else:
+            matching_engine.cancel_order(session, operation, 0)
+
+    def run_matching_engine(self, seed=1):
+        # Random new / replace / cancel mix around a mid price, returns ns per operation.
+        # The mix is generated against a scratch engine, so replaces and cancels always target an order that is
+        # still live; the engine is deterministic, so it is live in the timed run too
+        random_generator = random.Random(seed)
+        scratch_engine = OUCHMatchingEngine()
+        scratch_session = OUCHSession("BENCH", "user01")
+        operations = []
+        order_token = 1
+        for _ in range(self.iterations):
+            action = random_generator.random()
+            if action < 0.6 or not scratch_session.live_orders:
+                operation = ("O", {"order_token": order_token, "buy_sell_indicator": random_generator.choice("BS"),
+                                   "quantity": random_generator.randint(1, 10) * 100,
+                                   "price": 1000 + random_generator.randint(-20, 20),
+                                   "orderbook_id": random_generator.randint(1, 10), "time_in_force": 99999})
+            elif action < 0.8:
+                operation = ("U", {"existing_order_token": random_generator.choice(list(scratch_session.live_orders)),
+                                   "replacement_order_token": order_token,
+                                   "quantity": random_generator.randint(1, 10) * 100,
+                                   "price": 1000 + random_generator.randint(-20, 20)})
+            else:
+                operation = ("X", random_generator.choice(list(scratch_session.live_orders)))
+            self.apply_operation(scratch_engine, scratch_session, *operation)
+            operations.append(operation)
+            order_token += 1
+
+        matching_engine = OUCHMatchingEngine()
+        session = OUCHSession("BENCH", "user01")
+        start_time = time.perf_counter()
+        # Same as apply_operation, inlined so the call is not part of the time
+        for message_type, operation in operations:
+            if message_type == "O":
+                matching_engine.new_order(session, operation, 0)
+            elif message_type == "U":
+                matching_engine.replace_order(session, operation, 0)
+            else:
+                matching_engine.cancel_order(session, operation, 0)
+        elapsed = time.perf_counter() - start_time
+
+        return elapsed * 1e9 / len(operations)
+
+    def tail_latency_messages(self, client, count, random_generator):
+        # Resting buys, immediate or cancel sells that execute against them and cancels of earlier buys
+        messages = []
+        buy_tokens = []
+        for _ in range(count):
+            action = random_generator.random()
+            if action < 0.1 and buy_tokens:
+                client.time_in_force = 0
+                messages.append(client.create_new_order("1", "S", 100, 90))
+                client.time_in_force = 99999
+            elif action < 0.3 and buy_tokens:
+                messages.append(client.create_cancel_order(buy_tokens.pop(random_generator.randrange(len(buy_tokens)))))
+            else:
+                buy_tokens.append(client.current_seq_num)
+                messages.append(client.create_new_order("1", "B", 100, 90 + random_generator.randint(0, 9) / 10))
+        return messages
+
+    def run_tail_latency(self, low_gc, resting_orders=200000, burst_size=500, seed=1):
+        # Latency of each message through the server's parse and handle path, in bursts of burst_size messages with
+        # the loop idle in between, on top of a book of resting orders that every full collection has to walk.
+        # Returns the latency summary in nanoseconds (with p99.99) and, for the collections that ran inside the
+        # bursts, their number per generation and their total and longest pause in nanoseconds. Collections run by
+        # the low GC scheduler between bursts are not part of any message's latency.
+        server = OUCHAppServer("localhost", 0, low_gc=low_gc)
+        server.log_received_message = server.log_sent_message = lambda *arguments: None
+        server_socket, client_socket = socket.socketpair()
+        client_socket.setblocking(False)
+        ouch_client_sock = OUCHSocketHandler(server_socket, auto_flush=False)
+        server.selector.register(server_socket, selectors.EVENT_READ, ouch_client_sock)
+        client = OUCHAppClient("localhost", 0, "user01", "pass", "1")
+        server.handle_message(ouch_client_sock, OUCHParser.parse_ouch_bytes(client.create_login_request()))
+
+        random_generator = random.Random(seed)
+        resting = [client.create_new_order("1", "B", 100, 80 + random_generator.randint(0, 9) / 10)
+                   for _ in range(resting_orders)]
+        messages = self.tail_latency_messages(client, self.iterations, random_generator)
+        latencies = [0] * len(messages)
+
+        # [measuring, collection start time, collections per generation, total pause, longest pause]
+        burst_collections = [False, 0, [0, 0, 0], 0, 0]
+
+        def on_collection(phase, info):
+            if not burst_collections[0]:
+                return
+            if phase == "start":
+                burst_collections[1] = perf_counter_ns()
+                return
+            pause = perf_counter_ns() - burst_collections[1]
+            burst_collections[2][info["generation"]] += 1
+            burst_collections[3] += pause
+            burst_collections[4] = max(burst_collections[4], pause)
+
+        def end_of_burst():
+            burst_collections[0] = False
+            server.flush_connections()
+            try:
+                while client_socket.recv(1 << 20):
+                    pass
+            except BlockingIOError:
+                pass
+            if server.gc_scheduler is not None:
+                server.gc_scheduler.maybe_collect(idle=True)
+
+        if server.gc_scheduler is not None:
+            server.gc_scheduler.start()
+        gc.callbacks.append(on_collection)
+        try:
+            for index, message in enumerate(resting):
+                server.handle_message(ouch_client_sock, server.parse_message(message))
+                if index % burst_size == burst_size - 1:
+                    end_of_burst()
+            end_of_burst()
+
+            parse_message = server.parse_message
+            handle_message = server.handle_message
+            burst_collections[0] = True
+            for index, message in enumerate(messages):
+                start_time = perf_counter_ns()
+                handle_message(ouch_client_sock, parse_message(message))
+                latencies[index] = perf_counter_ns() - start_time
+                if index % burst_size == burst_size - 1:
+                    end_of_burst()
+                    burst_collections[0] = True
+            burst_collections[0] = False
+        finally:
+            gc.callbacks.remove(on_collection)
+            if server.gc_scheduler is not None:
+                server.gc_scheduler.stop()
+            server_socket.close()
+            client_socket.close()
+
+        histogram = OUCHLatencyHistogram()
+        for latency in latencies:
+            histogram.record(latency)
+        summary = histogram.summary()
+        summary["p99.99"] = histogram.percentile(99.99)
+        return summary, {"collections": burst_collections[2], "total_pause": burst_collections[3],
+                         "max_pause": burst_collections[4]}
+
+    def run_tail_latency_in_process(self, low_gc, resting_orders=200000):
+        # Each mode runs in a fresh interpreter, so neither inherits the other's heap, garbage or frozen objects
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            return pool.apply(self.run_tail_latency, (low_gc, resting_orders))
+
+    @staticmethod
+    def print_tail_latency(results):
+        print(f"{'mode':<10}{'p50':>10}{'p99':>10}{'p99.9':>10}{'p99.99':>10}{'max':>12}  "
+              f"in burst collections (gen 0/1/2), total and longest pause (ns)")
+        for mode, (summary, burst_collections) in results.items():
+            print(f"{mode:<10}{summary['p50']:>10}{summary['p99']:>10}{summary['p99.9']:>10}{summary['p99.99']:>10}"
+                  f"{summary['max']:>12}  {'/'.join(str(count) for count in burst_collections['collections'])}"
+                  f"  {burst_collections['total_pause']}  {burst_collections['max_pause']}")
+
+    def run(self, case_filter=None):
+        # Case name -> {"ns_per_op", "peak_bytes_per_op", "retained_blocks_per_op"}, only cases whose name contains
+        # case_filter if given
+        results = {}
+        for name, function in self.cases().items():
+            if case_filter and case_filter not in name:
+                continue
+            results[name] = {"ns_per_op": self.time_ns_per_op(function),
+                             "peak_bytes_per_op": self.peak_bytes_per_op(function),
+                             "retained_blocks_per_op": self.retained_blocks_per_op(function)}
+        if not case_filter or case_filter in "matching engine":
+            results["matching engine"] = {"ns_per_op": self.run_matching_engine(), "peak_bytes_per_op": None,
+                                          "retained_blocks_per_op": None}
+        return results
+
+    # Result keys checked against the baseline and their units
+    compared_metrics = (("ns_per_op", "ns/op"), ("peak_bytes_per_op", "peak B/op"))
+
+    @classmethod
+    def compare(cls, results, baseline, tolerance):
+        # Cases more than tolerance (0.2 = 20%) slower than the baseline, or allocating that much more memory per
+        # call, name -> [(unit, baseline value, value)]
+        regressions = {}
+        for name, result in results.items():
+            baseline_result = baseline.get(name)
+            if not baseline_result:
+                continue
+            for metric, unit in cls.compared_metrics:
+                value, baseline_value = result.get(metric), baseline_result.get(metric)
+                if value is None or baseline_value is None:
+                    continue
+                if value > baseline_value * (1 + tolerance):
+                    regressions.setdefault(name, []).append((unit, baseline_value, value))
+        return regressions
+
+    @staticmethod
+    def print_results(results, baseline=None):
+        print(f"{'case':<32}{'ns/op':>10}{'peak B/op':>11}{'retained/op':>13}{'baseline':>10}{'change':>9}")
+        for name, result in results.items():
+            peak_bytes = "" if result["peak_bytes_per_op"] is None else f"{result['peak_bytes_per_op']:.0f}"
+            retained_blocks = "" if result["retained_blocks_per_op"] is None else \
+                f"{result['retained_blocks_per_op']:.1f}"
+            line = f"{name:<32}{result['ns_per_op']:>10.0f}{peak_bytes:>11}{retained_blocks:>13}"
+            if baseline and name in baseline:
+                baseline_ns = baseline[name]["ns_per_op"]
+                line += f"{baseline_ns:>10.0f}{(result['ns_per_op'] / baseline_ns - 1) * 100:>+8.1f}%"
+            print(line)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="OUCH codec benchmarks")
+    parser.add_argument("--iterations", type=int,
+                        help="calls per case, or messages for --tail-latency (default: 100000, 400000)")
+    parser.add_argument("--filter", help="only run the cases whose name contains this text")
+    parser.add_argument("--baseline", default=default_baseline_path,
+                        help="JSON results of an earlier run to compare against, '' for none "
+                             "(default: the committed OUCHBenchmarkBaseline.json)")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown, 0.2 = 20%%")
+    parser.add_argument("--save", help="write the results as JSON to this file, e.g. as the next baseline")
+    parser.add_argument("--tail-latency", action="store_true",
+                        help="compare per message server latency (ns) with and without low GC mode instead")
+    parser.add_argument("--resting-orders", type=int, default=200000, help="book size for --tail-latency")
+    arguments = parser.parse_args()
+
+    if arguments.iterations is None:
+        # Enough messages for the default mode to run full collections inside the bursts
+        arguments.iterations = 400000 if arguments.tail_latency else 100000
+
+    ouch_benchmark = OUCHBenchmark(arguments.iterations)
+
+    if arguments.tail_latency:
+        ouch_benchmark.print_tail_latency({
+            "default": ouch_benchmark.run_tail_latency_in_process(False, arguments.resting_orders),
+            "low gc": ouch_benchmark.run_tail_latency_in_process(True, arguments.resting_orders)
+        })
+        sys.exit(0)
+
+    # Run the benchmarks
+    main_results = ouch_benchmark.run(arguments.filter)
+
+    main_baseline = None
+    if arguments.baseline:
+        with open(arguments.baseline) as baseline_file:
+            main_baseline = json.load(baseline_file)
+
+    ouch_benchmark.print_results(main_results, main_baseline)
+
+    if arguments.save:
+        with open(arguments.save, "w") as save_file:
+            json.dump(main_results, save_file, indent=2)
+
+    # Exit status 1 on a regression so the benchmark can gate a change
+    if main_baseline:
+        main_regressions = ouch_benchmark.compare(main_results, main_baseline, arguments.tolerance)
+        for regression_name, regression_metrics in main_regressions.items():
+            for regression_unit, regression_baseline_value, regression_value in regression_metrics:
+                print(f"Regression {regression_name}: {regression_baseline_value:.0f} -> {regression_value:.0f} "
+                      f"{regression_unit}")
+        if main_regressions:
+            sys.exit(1)
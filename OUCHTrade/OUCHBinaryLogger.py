@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import collections
+import struct
+import threading
+import time
+
+INBOUND = b"I"
+OUTBOUND = b"O"
+
+
+class OUCHBinaryLogger:
+    # Logs raw OUCH frames without formatting them on the caller's thread.
+    # log() appends to a deque (append and popleft are atomic, no lock is taken) and a background writer thread
+    # writes the queued records to the file in batches. Use OUCHLogDecoder to turn the file into text.
+    #
+    # File format: the magic below, then one record per frame:
+    #   8 byte wall clock time in ns, 1 byte direction (I or O), 4 byte connection id, the frame as sent on the
+    #   wire (its 2 byte length prefix tells the record length). All integers are big-endian.
+
+    magic = b"OUCHLOG1"
+    record_header = struct.Struct(">Q1sI")
+
+    def __init__(self, path, batch_size=1024, flush_interval=0.1, max_queued=1 << 20):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queued = max_queued
+        self._queue = collections.deque()
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self.records_logged = 0
+        self.records_dropped = 0
+
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(self.magic)
+
+        self._writer_thread = threading.Thread(target=self._run)
+        self._writer_thread.daemon = True
+        self._writer_thread.start()
+
+    def log(self, direction, connection_id, frame):
+        # frame may be a memoryview of a receive buffer, it is copied before the buffer is reused
+        queue = self._queue
+        queued = len(queue)
+        if queued >= self.max_queued:
+            # The writer cannot keep up, drop rather than grow without bound
+            self.records_dropped += 1
+            return
+        queue.append((time.time_ns(), direction, connection_id, bytes(frame)))
+        if queued + 1 == self.batch_size:
+            self._wake_event.set()
+
+    def _write_batch(self):
+        queue = self._queue
+        pack = self.record_header.pack
+        parts = []
+        while queue:
+            timestamp, direction, connection_id, frame = queue.popleft()
+            parts.append(pack(timestamp, direction, connection_id))
+            parts.append(frame)
+        if parts:
+            self.file.write(b"".join(parts))
+            self.records_logged += len(parts) // 2
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._wake_event.wait(self.flush_interval)
+            self._wake_event.clear()
+            self._write_batch()
+        self._write_batch()
+        self.file.flush()
+
+    def close(self):
+        # Writes everything still queued and closes the file
+        self._stop_event.set()
+        self._wake_event.set()
+        self._writer_thread.join()
+        self.file.close()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import sys
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    # Optional, only needed for bulk decoding
+    np = None
+
+from OUCHTrade.OUCHBinaryLogger import OUCHBinaryLogger
+from OUCHTrade.OUCHSchema import message_dicts, unsequenced_message_dicts, sequenced_message_dicts, \
+    empty_packet_types, message_packet_types
+
+
+def message_dtype(message_list, base_offset):
+    # Big-endian structured dtype of a whole frame (length prefix included) from a schema field list
+    names = ["length", "packet_type"]
+    formats = [">u2", "S1"]
+    offsets = [0, 2]
+    for name, offset, length, field_type in message_list:
+        names.append(name)
+        formats.append(f">u{length}" if field_type == "integer" else f"S{length}")
+        offsets.append(base_offset + offset)
+    itemsize = max([base_offset + item[1] + item[2] for item in message_list], default=3)
+    return np.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": itemsize})
+
+
+def compile_dtypes():
+    # Keyed by (packet_type, message_type) like the parser's decoders
+    dtypes = {}
+    for packet_type in empty_packet_types:
+        dtypes[(packet_type, None)] = message_dtype([], 0)
+    for packet_type, message_list in message_dicts.items():
+        dtypes[(packet_type, None)] = message_dtype(message_list, 0)
+    for message_type, message_list in unsequenced_message_dicts.items():
+        dtypes[('U', message_type)] = message_dtype(message_list, 3)
+    for message_type, message_list in sequenced_message_dicts.items():
+        dtypes[('S', message_type)] = message_dtype(message_list, 3)
+    return dtypes
+
+
+class OUCHBulkDecoder:
+    # Decodes a whole capture at once: frame boundaries are indexed in one pass, then the frames of each
+    # message type are copied into a NumPy structured array, so fields can be filtered and aggregated in
+    # vectorized form, e.g. groups[('S', 'E')]["executed_quantity"].sum()
+    # A capture is either raw frames back to back or a log written by OUCHBinaryLogger.
+
+    _packet_length = 2
+    _chunk_size = 1 << 16
+
+    def __init__(self, buffer, record_header_size=0, start=0):
+        if np is None:
+            raise ImportError("OUCHBulkDecoder requires numpy")
+        self.data = np.frombuffer(buffer, dtype=np.uint8)
+        self.record_header_size = record_header_size
+        self.dtypes = compile_dtypes()
+        self.frame_offsets = np.frombuffer(self.index_frames(buffer, start, record_header_size), dtype=np.uint64) \
+            .astype(np.intp)
+
+    @classmethod
+    def from_log(cls, path):
+        with open(path, "rb") as log_file:
+            buffer = log_file.read()
+        if not buffer.startswith(OUCHBinaryLogger.magic):
+            raise ValueError(f"{path} is not an OUCH binary log")
+        return cls(buffer, OUCHBinaryLogger.record_header.size, len(OUCHBinaryLogger.magic))
+
+    @classmethod
+    def index_frames(cls, buffer, start=0, record_header_size=0):
+        # Offset of every complete frame, record_header_size bytes precede each frame.
+        # Frame lengths chain, so this is the one pass that cannot be vectorized
+        buffer = memoryview(buffer).cast("B")
+        frame_offsets = array("Q")
+        buffer_length = len(buffer)
+        offset = start
+        while offset + record_header_size + cls._packet_length <= buffer_length:
+            frame_offset = offset + record_header_size
+            offset = frame_offset + cls._packet_length + (buffer[frame_offset] << 8 | buffer[frame_offset + 1])
+            if offset > buffer_length:
+                # Last frame was cut short
+                break
+            frame_offsets.append(frame_offset)
+        return frame_offsets
+
+    def _gather(self, frame_offsets, itemsize):
+        # Copy itemsize bytes from each offset into one contiguous (frames, itemsize) array, a chunk at a time
+        # so the fancy-indexing temporaries stay small
+        rows = np.empty((len(frame_offsets), itemsize), dtype=np.uint8)
+        columns = np.arange(itemsize)
+        for start in range(0, len(frame_offsets), self._chunk_size):
+            chunk_offsets = frame_offsets[start:start + self._chunk_size]
+            rows[start:start + len(chunk_offsets)] = self.data[chunk_offsets[:, None] + columns]
+        return rows
+
+    def group_offsets(self):
+        # (packet_type, message_type) -> offsets of the frames of that type
+        data = self.data
+        frame_offsets = self.frame_offsets
+        frame_lengths = (data[frame_offsets].astype(np.intp) << 8 | data[frame_offsets + 1]) + self._packet_length
+        packet_types = data[frame_offsets + 2]
+        # Message type of S and U packets, frames too short to hold one are left with 0
+        has_message_type = np.isin(packet_types, np.frombuffer("".join(message_packet_types).encode(), np.uint8)) \
+            & (frame_lengths > 3)
+        message_types = np.where(has_message_type, data[np.minimum(frame_offsets + 3, len(data) - 1)], 0)
+
+        groups = {}
+        type_codes = packet_types.astype(np.uint16) << 8 | message_types
+        for type_code in np.unique(type_codes):
+            packet_type, message_type = chr(type_code >> 8), chr(type_code & 0xFF) if type_code & 0xFF else None
+            groups[(packet_type, message_type)] = (frame_offsets[type_codes == type_code],
+                                                   frame_lengths[type_codes == type_code])
+        return groups
+
+    def decode(self):
+        # (packet_type, message_type) -> structured array of every frame of that type.
+        # Frames of an unknown type, or shorter than their layout, are left out.
+        decoded = {}
+        for key, (frame_offsets, frame_lengths) in self.group_offsets().items():
+            dtype = self.dtypes.get(key)
+            if dtype is None:
+                continue
+            frame_offsets = frame_offsets[frame_lengths >= dtype.itemsize]
+            decoded[key] = self._gather(frame_offsets, dtype.itemsize).view(dtype).reshape(len(frame_offsets))
+        return decoded
+
+    def record_headers(self, key):
+        # Timestamp, direction and connection id of each frame decode() returns for key, for OUCHBinaryLogger logs
+        if self.record_header_size == 0:
+            raise ValueError("capture has no record headers")
+        record_dtype = np.dtype({"names": ["timestamp", "direction", "connection_id"],
+                                 "formats": [">u8", "S1", ">u4"], "offsets": [0, 8, 9],
+                                 "itemsize": self.record_header_size})
+        frame_offsets, frame_lengths = self.group_offsets()[key]
+        frame_offsets = frame_offsets[frame_lengths >= self.dtypes[key].itemsize]
+        record_offsets = frame_offsets - self.record_header_size
+        return self._gather(record_offsets, record_dtype.itemsize).view(record_dtype).reshape(len(record_offsets))
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) != 2:
+        print("usage:", sys.argv[0], "<binary log file>")
+        sys.exit(1)
+
+    ouch_bulk_decoder = OUCHBulkDecoder.from_log(sys.argv[1])
+
+    # Summarize the log by message type
+    for main_key, main_messages in sorted(ouch_bulk_decoder.decode().items(), key=lambda item: str(item[0])):
+        print(f"{main_key}: {len(main_messages)} messages")
+        if main_key == ('S', 'E'):
+            print(f"    executed quantity: {main_messages['executed_quantity'].sum()}")
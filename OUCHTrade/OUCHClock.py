@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+import time
+
+
+class OUCHClock:
+    # Nanoseconds since local midnight for OUCH timestamps.
+    # The midnight epoch is cached, so each call is one clock read, a comparison and a subtraction; it is recomputed
+    # when the clock passes the next midnight.
+    # monotonic=True reads time.monotonic_ns() plus an offset taken once at start, so timestamps never go backwards
+    # when the wall clock is stepped, at the cost of drifting from the wall clock by any later adjustment.
+    __slots__ = ("monotonic", "_offset", "_midnight", "_next_midnight")
+
+    def __init__(self, monotonic=False):
+        self.monotonic = monotonic
+        self._offset = time.time_ns() - time.monotonic_ns() if monotonic else 0
+        self._midnight = 0
+        self._next_midnight = 0
+        self._set_day(self._read())
+
+    def _read(self):
+        if self.monotonic:
+            return time.monotonic_ns() + self._offset
+        return time.time_ns()
+
+    def _set_day(self, now):
+        # mktime normalizes day + 1 across month and year ends and takes daylight saving changes into account
+        local_time = time.localtime(now // 1_000_000_000)
+        day = (local_time.tm_year, local_time.tm_mon, local_time.tm_mday)
+        self._midnight = int(time.mktime(day + (0, 0, 0, 0, 0, -1))) * 1_000_000_000
+        self._next_midnight = int(time.mktime((day[0], day[1], day[2] + 1, 0, 0, 0, 0, 0, -1))) * 1_000_000_000
+
+    def now(self):
+        now = self._read()
+        if now >= self._next_midnight:
+            self._set_day(now)
+        return now - self._midnight
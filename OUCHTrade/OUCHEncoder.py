@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import struct
+
+from OUCHTrade.OUCHSchema import message_dicts, unsequenced_message_dicts, sequenced_message_dicts, \
+    empty_packet_types
+
+length_struct = struct.Struct(">H")
+
+
+class OUCHMessageEncoder:
+    # Compiles a schema entry into a prebuilt template of the whole packet (length prefix included) with every field
+    # at its default, and a precompiled struct.Struct per field. encode(**fields) copies the template into a new
+    # bytearray and writes each given field in place with pack_into, so every message is one allocation.
+    # Fields that are not given keep their default: blank for alpha fields, 0 for integers.
+    # Alpha values are right justified like the original pad_bytes and truncated to the field length; the padded
+    # bytes of the values seen are kept per field (up to max_padded_values), so repeated values are not re-encoded.
+    __slots__ = ("packet_type", "message_type", "message_list", "base_offset", "defaults", "fields", "template")
+
+    max_padded_values = 256
+
+    def __init__(self, packet_type, message_type, message_list, base_offset, defaults=None):
+        self.packet_type = packet_type
+        self.message_type = message_type
+        self.message_list = message_list
+        self.base_offset = base_offset
+        self.defaults = dict(defaults or {})
+
+        message_end = max([base_offset + item[2] + item[1] for item in message_list], default=3)
+        template = bytearray(message_end)
+        length_struct.pack_into(template, 0, message_end - 2)
+        template[2] = ord(packet_type)
+
+        # Field name -> (pack_into, offset, length, padded values), padded values is None for integer fields
+        self.fields = {}
+        for name, offset, length, field_type in message_list:
+            offset += base_offset
+            if name == "message_type":
+                template[offset] = ord(message_type)
+            elif field_type == "integer":
+                field_struct = struct.Struct(">" + {1: "B", 2: "H", 4: "I", 8: "Q"}[length])
+                self.fields[name] = (field_struct.pack_into, offset, length, None)
+                field_struct.pack_into(template, offset, self.defaults.get(name, 0))
+            else:
+                field_struct = struct.Struct(f"{length}s")
+                self.fields[name] = (field_struct.pack_into, offset, length, {})
+                field_struct.pack_into(template, offset, self.defaults.get(name, " ").encode("utf-8").rjust(length))
+
+        # Message with every field at its default, e.g. heartbeats are sent as is
+        self.template = bytes(template)
+
+    def encode(self, **field_values):
+        message = bytearray(self.template)
+        fields = self.fields
+        for name, value in field_values.items():
+            pack_into, offset, length, padded_values = fields[name]
+            if padded_values is not None:
+                padded_value = padded_values.get(value)
+                if padded_value is None:
+                    padded_value = value.encode("utf-8").rjust(length)
+                    if len(padded_values) < self.max_padded_values:
+                        padded_values[value] = padded_value
+                value = padded_value
+            pack_into(message, offset, value)
+        return message
+
+    def with_defaults(self, **values):
+        # New encoder whose fields default to these values, for fields that are constant for a given use
+        defaults = dict(self.defaults)
+        defaults.update(values)
+        return OUCHMessageEncoder(self.packet_type, self.message_type, self.message_list, self.base_offset, defaults)
+
+
+def compile_encoders():
+    encoders = {}
+    for packet_type in empty_packet_types:
+        encoders[(packet_type, None)] = OUCHMessageEncoder(packet_type, None, [], 0)
+    for packet_type, message_list in message_dicts.items():
+        encoders[(packet_type, None)] = OUCHMessageEncoder(packet_type, None, message_list, 0)
+    for message_type, message_list in unsequenced_message_dicts.items():
+        encoders[('U', message_type)] = OUCHMessageEncoder('U', message_type, message_list, 3)
+    for message_type, message_list in sequenced_message_dicts.items():
+        encoders[('S', message_type)] = OUCHMessageEncoder('S', message_type, message_list, 3)
+    return encoders
+
+
+# Compiled once at import, keyed by (packet_type, message_type)
+encoders = compile_encoders()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+
+class OUCHFrameDecoder:
+    # Splits a byte stream into 2 byte length prefixed OUCH frames using one preallocated receive buffer.
+    # Frames are returned as memoryview slices of the buffer and are only valid until the next read.
+    buffer: bytearray
+    view: memoryview
+    start: int
+    end: int
+
+    _packet_length = 2
+    _min_read_size = 4096
+
+    def __init__(self, buffer_size=65536):
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+    def pending_bytes(self):
+        return self.end - self.start
+
+    def _make_room(self, required):
+        if self.start == self.end:
+            # Nothing carried over, start again from the beginning of the buffer
+            self.start = 0
+            self.end = 0
+        elif len(self.buffer) - self.end < required:
+            # Move the partial frame to the front of the buffer
+            pending = self.end - self.start
+            self.view[0:pending] = self.view[self.start:self.end]
+            self.start = 0
+            self.end = pending
+
+        if len(self.buffer) - self.end < required:
+            # Replace the buffer with a larger one, frames handed out earlier keep the old buffer alive
+            pending = self.end - self.start
+            buffer = bytearray(max(2 * len(self.buffer), pending + required))
+            buffer[0:pending] = self.view[self.start:self.end]
+            self.buffer = buffer
+            self.view = memoryview(buffer)
+            self.start = 0
+            self.end = pending
+
+    def _required_space(self):
+        # Room needed for the next read: a useful chunk, or at least the rest of a partially received frame
+        pending = self.end - self.start
+        if pending >= self._packet_length:
+            frame_length = self._packet_length + ((self.buffer[self.start] << 8) | self.buffer[self.start + 1])
+            return max(self._min_read_size, frame_length - pending)
+        return self._min_read_size
+
+    def read_space(self):
+        # Number of bytes the next recv_into can read
+        self._make_room(self._required_space())
+        return len(self.buffer) - self.end
+
+    def recv_into(self, sock):
+        # Read as much as fits into the buffer with a single syscall, returns the number of bytes read
+        self._make_room(self._required_space())
+        received = sock.recv_into(self.view[self.end:])
+        self.end += received
+        return received
+
+    def feed(self, data):
+        # Append bytes received elsewhere (e.g. asyncio data_received) to the buffer
+        data_length = len(data)
+        self._make_room(data_length)
+        self.view[self.end:self.end + data_length] = data
+        self.end += data_length
+
+    def frames(self):
+        # Yield every complete frame in the buffer, a partial frame is carried over to the next read
+        buffer = self.buffer
+        while self.end - self.start >= self._packet_length:
+            frame_length = self._packet_length + ((buffer[self.start] << 8) | buffer[self.start + 1])
+            if self.end - self.start < frame_length:
+                return
+            frame_start = self.start
+            self.start += frame_length
+            yield self.view[frame_start:frame_start + frame_length]
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import gc
+import time
+from time import perf_counter_ns
+
+from OUCHTrade.OUCHLatencyHistogram import OUCHLatencyHistogram
+
+
+class OUCHGCScheduler:
+    # Takes over from the automatic garbage collector so collections run between bursts instead of inside them.
+    # start() collects once, freezes everything allocated so far (sessions, encoders, code) so no later collection
+    # walks it, and disables the automatic collector. The owner's event loop then calls maybe_collect() every
+    # iteration: young generations are collected when the loop is idle, or mid burst only once max_young
+    # allocations are pending so memory stays bounded, and a full collection runs at most every full_interval
+    # seconds, when idle.
+
+    def __init__(self, young_threshold=700, max_young=100000, full_interval=60.0):
+        self.young_threshold = young_threshold
+        self.max_young = max_young
+        self.full_interval = full_interval
+        self.running = False
+        self.last_full_collection = time.monotonic()
+        self.young_collections = 0
+        self.forced_collections = 0
+        self.full_collections = 0
+        # Collection pauses in nanoseconds
+        self.pauses = OUCHLatencyHistogram()
+
+    def start(self):
+        gc.collect()
+        gc.freeze()
+        gc.disable()
+        self.running = True
+        self.last_full_collection = time.monotonic()
+
+    def stop(self):
+        gc.unfreeze()
+        gc.enable()
+        self.running = False
+
+    def collect(self, generation):
+        start_time = perf_counter_ns()
+        gc.collect(generation)
+        self.pauses.record(perf_counter_ns() - start_time)
+
+    def maybe_collect(self, idle):
+        # Returns the generation collected, None if nothing was
+        if not self.running:
+            return None
+        pending = gc.get_count()[0]
+
+        if idle:
+            if time.monotonic() - self.last_full_collection >= self.full_interval:
+                self.collect(2)
+                self.full_collections += 1
+                self.last_full_collection = time.monotonic()
+                return 2
+            if pending >= self.young_threshold:
+                # Every tenth young collection also collects the middle generation, like the automatic collector
+                self.young_collections += 1
+                generation = 1 if self.young_collections % 10 == 0 else 0
+                self.collect(generation)
+                return generation
+        elif pending >= self.max_young:
+            self.collect(0)
+            self.forced_collections += 1
+            return 0
+        return None
+
+    def stats(self):
+        return {
+            "young_collections": self.young_collections,
+            "forced_collections": self.forced_collections,
+            "full_collections": self.full_collections,
+            "pauses": self.pauses.summary()
+        }
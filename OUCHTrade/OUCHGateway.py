@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+
+import sys
+import collections
+import struct
+import threading
+import time
+
+from OUCHTrade.OUCHAppClient import OUCHAppClient, new_order_encoder, replace_order_encoder, cancel_order_encoder
+from OUCHTrade.OUCHParser import OUCHParser
+from OUCHTrade.OUCHSharedRing import OUCHSharedRing
+from OUCHTrade.OUCHSchema import unsequenced_message_dicts, sequenced_message_dicts
+
+token_struct = struct.Struct(">I")
+
+
+def token_offsets(message_list, names):
+    # Offsets of the order token fields from the start of the packet
+    offsets = {item[0]: 3 + item[1] for item in message_list}
+    return [offsets[name] for name in names]
+
+
+# Order token fields of each message type, the first one identifies the order the message belongs to
+request_token_offsets = {
+    'O': token_offsets(unsequenced_message_dicts['O'], ["order_token"]),
+    'U': token_offsets(unsequenced_message_dicts['U'], ["replacement_order_token", "existing_order_token"]),
+    'X': token_offsets(unsequenced_message_dicts['X'], ["order_token"])
+}
+response_token_offsets = {
+    'A': token_offsets(sequenced_message_dicts['A'], ["order_token"]),
+    'U': token_offsets(sequenced_message_dicts['U'], ["replacement_order_token", "previous_order_token"]),
+    'C': token_offsets(sequenced_message_dicts['C'], ["order_token"]),
+    'D': token_offsets(sequenced_message_dicts['D'], ["order_token"]),
+    'E': token_offsets(sequenced_message_dicts['E'], ["order_token"]),
+    'J': token_offsets(sequenced_message_dicts['J'], ["order_token"])
+}
+
+
+def request_ring_name(name, producer_id):
+    return f"{name}-request-{producer_id}"
+
+
+def response_ring_name(name, producer_id):
+    return f"{name}-response-{producer_id}"
+
+
+class OUCHGateway(OUCHAppClient):
+    # Owns the OUCH session on behalf of several local producer processes.
+    # Each producer writes order messages, numbered with its own order tokens, to its request ring. The gateway
+    # gives every order a session order token, patches the token fields in place and sends the message as is.
+    # Acks, executions and rejects go back on the producer's response ring with the producer's tokens restored.
+    # The reader thread only copies order responses into a queue. The forwarding loop does all the token
+    # bookkeeping, so the mappings are only ever changed on one thread, and moves the responses into the response
+    # rings through a queue per producer, so a producer that does not read its responses cannot hold up the others.
+
+    def __init__(self, host, port, username, password, requested_sequence_number, name="ouch-gateway", producers=4,
+                 ring_capacity=1 << 20):
+        super().__init__(host, port, username, password, requested_sequence_number)
+        self.name = name
+        self.request_rings = [OUCHSharedRing.create(request_ring_name(name, producer_id), ring_capacity)
+                              for producer_id in range(producers)]
+        self.response_rings = [OUCHSharedRing.create(response_ring_name(name, producer_id), ring_capacity)
+                               for producer_id in range(producers)]
+        # (producer_id, producer order token) <-> session order token
+        self.session_tokens = {}
+        self.producer_tokens = {}
+        # Session order token -> open quantity, the token mappings are dropped once the order is done
+        self.open_quantities = {}
+        # Order responses received by the reader thread, waiting for the forwarding loop
+        self.received_responses = collections.deque()
+        # Responses waiting for room in each producer's response ring
+        self.response_queues = [collections.deque() for _ in range(producers)]
+        self.max_queued_responses = 65536
+        # Requests forwarded per pass over a ring, so one busy producer cannot starve the others
+        self.batch_size = 64
+        # Sleep when no ring had a request, the producers cannot wake the gateway without a system call
+        self.idle_sleep = 0.0002
+        self.requests_forwarded = 0
+        self.responses_routed = 0
+        self.responses_dropped = 0
+
+    def assign_token(self, producer_id, producer_token):
+        session_token = self.current_seq_num
+        self.current_seq_num += 1
+        self.session_tokens[(producer_id, producer_token)] = session_token
+        self.producer_tokens[session_token] = (producer_id, producer_token)
+        return session_token
+
+    def release_token(self, session_token):
+        self.open_quantities.pop(session_token, None)
+        owner = self.producer_tokens.pop(session_token, None)
+        if owner is not None:
+            self.session_tokens.pop(owner, None)
+
+    def update_open_quantity(self, message_type, ouch_view):
+        # Track the open quantity of each order and release its tokens on the message that finishes it
+        if message_type == "A":
+            self.open_quantities[ouch_view.order_token] = ouch_view.quantity
+        elif message_type == "U":
+            self.release_token(ouch_view.previous_order_token)
+            if ouch_view.quantity > 0:
+                self.open_quantities[ouch_view.replacement_order_token] = ouch_view.quantity
+            else:
+                self.release_token(ouch_view.replacement_order_token)
+        elif message_type in ("C", "D", "E"):
+            order_token = ouch_view.order_token
+            open_quantity = self.open_quantities.get(order_token)
+            if open_quantity is None:
+                return
+            open_quantity -= ouch_view.executed_quantity if message_type == "E" else ouch_view.decrement_quantity
+            if open_quantity > 0:
+                self.open_quantities[order_token] = open_quantity
+            else:
+                self.release_token(order_token)
+        elif message_type == "J":
+            self.release_token(ouch_view.order_token)
+
+    def forward_request(self, producer_id, frame):
+        message = bytearray(frame)
+        message_type = chr(message[3])
+        offsets = request_token_offsets.get(message_type)
+        if message[2] != ord("U") or offsets is None:
+            print(f"Ignoring request from producer {producer_id}: {OUCHParser.parse_ouch_bytes(frame)}")
+            return
+
+        if message_type == "X":
+            # Unknown tokens become 0, which the exchange does not know either
+            token_struct.pack_into(message, offsets[0], self.session_tokens.get(
+                (producer_id, token_struct.unpack_from(message, offsets[0])[0]), 0))
+        else:
+            # New orders and replacements introduce a token, a replace also refers to the existing order
+            token_struct.pack_into(message, offsets[0], self.assign_token(
+                producer_id, token_struct.unpack_from(message, offsets[0])[0]))
+            for offset in offsets[1:]:
+                token_struct.pack_into(message, offset, self.session_tokens.get(
+                    (producer_id, token_struct.unpack_from(message, offset)[0]), 0))
+
+        self.ouch_client_sock.send(message)
+        self.requests_forwarded += 1
+
+    def route_response(self, frame):
+        # Runs on the forwarding loop, like every other change to the token mappings
+        ouch_view = OUCHParser.parse_ouch_view(frame)
+        message_type = ouch_view.message_type
+        message = bytearray(frame)
+        offsets = response_token_offsets[message_type]
+        owner = self.producer_tokens.get(token_struct.unpack_from(message, offsets[0])[0])
+        if owner is None:
+            print(f"Response for an order no producer sent: {ouch_view.to_dict()}")
+            return
+        producer_id = owner[0]
+        for offset in offsets:
+            producer_token = self.producer_tokens.get(token_struct.unpack_from(message, offset)[0])
+            if producer_token is not None:
+                token_struct.pack_into(message, offset, producer_token[1])
+
+        self.update_open_quantity(message_type, ouch_view)
+
+        response_queue = self.response_queues[producer_id]
+        if len(response_queue) >= self.max_queued_responses:
+            # The producer is not reading its responses
+            self.responses_dropped += 1
+            return
+        response_queue.append(message)
+
+    def route_responses(self):
+        received_responses = self.received_responses
+        while received_responses:
+            self.route_response(received_responses.popleft())
+
+    def push_responses(self):
+        # Move queued responses into the response rings, as many as fit. Returns the number moved
+        self.route_responses()
+        pushed = 0
+        for response_queue, response_ring in zip(self.response_queues, self.response_rings):
+            while response_queue and response_ring.push(response_queue[0]):
+                response_queue.popleft()
+                pushed += 1
+        self.responses_routed += pushed
+        return pushed
+
+    def dispatch(self, ouch_view, receive_time):
+        # Order responses go to the producer of the order, everything else is handled like any client.
+        # The view is only valid during the call, the forwarding loop gets a copy
+        if ouch_view.packet_type == "S" and ouch_view.message_type in response_token_offsets:
+            self.received_responses.append(bytes(ouch_view.buffer))
+        else:
+            super().dispatch(ouch_view, receive_time)
+
+    def run(self, stop_event):
+        # Forward requests from every producer until stop_event is set
+        ouch_client_sock = self.ouch_client_sock
+        while not stop_event.is_set() and not ouch_client_sock.connection_closed:
+            forwarded = 0
+            for producer_id, request_ring in enumerate(self.request_rings):
+                for _ in range(self.batch_size):
+                    frame = request_ring.pop()
+                    if frame is None:
+                        break
+                    self.forward_request(producer_id, frame)
+                    forwarded += 1
+            if ouch_client_sock.has_pending_output:
+                ouch_client_sock.flush()
+            if not self.push_responses() and not forwarded:
+                time.sleep(self.idle_sleep)
+
+    def close(self):
+        for ring in self.request_rings + self.response_rings:
+            ring.close()
+            ring.unlink()
+
+    def start(self):
+
+        # Open Connection to OUCH Server, log in and start receiving
+        self.ouch_client_sock.connect(self.host, self.port)
+        self.ouch_client_sock.send(self.create_login_request())
+        self.start_reader()
+        self.start_sending_heartbeats()
+        print(f"Gateway {self.name} ready for {len(self.request_rings)} producers")
+
+        try:
+            self.run(threading.Event())
+        except KeyboardInterrupt:
+            print("caught keyboard interrupt, exiting")
+        finally:
+            self.stop_reader()
+            self.ouch_client_sock.close()
+            self.close()
+
+
+class OUCHGatewayProducer:
+    # Sends orders through an OUCHGateway from another process. Order tokens are local to the producer,
+    # the same way OUCHAppClient numbers them from current_seq_num.
+
+    def __init__(self, name, producer_id, first_order_token=1):
+        self.request_ring = OUCHSharedRing.attach(request_ring_name(name, producer_id))
+        self.response_ring = OUCHSharedRing.attach(response_ring_name(name, producer_id))
+        self.current_seq_num = first_order_token
+        self.group = "DAY "
+        self.time_in_force = 99999
+        self.firm_id = 0
+        self.order_classification = "1"
+
+    def submit(self, message):
+        # Returns the order token of the message, None if the request ring is full
+        if not self.request_ring.push(message):
+            return None
+        order_token = self.current_seq_num
+        self.current_seq_num += 1
+        return order_token
+
+    def new_order(self, symbol, side, quantity, price):
+        return self.submit(new_order_encoder.encode(
+            order_token=self.current_seq_num,
+            buy_sell_indicator=side,
+            quantity=int(quantity),
+            orderbook_id=int(symbol),
+            group=self.group,
+            price=int(float(price)*10),
+            time_in_force=self.time_in_force,
+            firm_id=self.firm_id,
+            capacity="A",
+            order_classification=self.order_classification,
+            cash_margin_type="1"
+        ))
+
+    def replace_order(self, existing_order_token, quantity, price):
+        return self.submit(replace_order_encoder.encode(
+            existing_order_token=int(existing_order_token),
+            replacement_order_token=self.current_seq_num,
+            quantity=int(quantity),
+            price=int(float(price)*10),
+            time_in_force=self.time_in_force
+        ))
+
+    def cancel_order(self, order_token):
+        # Returns the token of the canceled order, None if the request ring is full
+        if not self.request_ring.push(cancel_order_encoder.encode(order_token=int(order_token), quantity=0)):
+            return None
+        return int(order_token)
+
+    def responses(self):
+        # Every response waiting in the response ring, as lazy views
+        while True:
+            frame = self.response_ring.pop()
+            if frame is None:
+                return
+            yield OUCHParser.parse_ouch_view(frame)
+
+    def close(self):
+        self.request_ring.close()
+        self.response_ring.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (6, 7):
+        print("usage:", sys.argv[0], "<host> <port> <username> <password> <requested sequence number> [producers]")
+        sys.exit(1)
+
+    main_host, main_port = sys.argv[1], int(sys.argv[2])
+    main_producers = int(sys.argv[6]) if len(sys.argv) == 7 else 4
+
+    ouch_gateway = OUCHGateway(main_host, main_port, sys.argv[3], sys.argv[4], sys.argv[5], producers=main_producers)
+
+    # Start forwarding orders from the producers
+    ouch_gateway.start()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+from time import perf_counter_ns
+
+from OUCHTrade.OUCHLatencyHistogram import OUCHLatencyHistogram
+
+
+class OUCHInstrumentation:
+    # Per-stage latency histograms (nanoseconds, time.perf_counter_ns) and traffic counters of the server pipeline.
+    # Stages: receive (reading a frame off the socket), parse, handle (all of handle_message), match, build (ack
+    # and execution messages), send and log (console output).
+
+    stages = ("receive", "parse", "handle", "match", "build", "send", "log")
+
+    def __init__(self):
+        self.histograms = {stage: OUCHLatencyHistogram() for stage in self.stages}
+        self.messages_received = 0
+        self.bytes_received = 0
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.failed_sends = 0
+
+    def record(self, stage, start_time):
+        # Records the time since start_time and returns the current time, so consecutive stages can be chained
+        now = perf_counter_ns()
+        self.histograms[stage].record(now - start_time)
+        return now
+
+    def record_receive(self, start_time, message_length):
+        self.messages_received += 1
+        self.bytes_received += message_length
+        return self.record("receive", start_time)
+
+    def record_send(self, start_time, message_length, sent):
+        if sent:
+            self.messages_sent += 1
+            self.bytes_sent += message_length
+        else:
+            self.failed_sends += 1
+        return self.record("send", start_time)
+
+    def snapshot(self):
+        # Safe to call from another thread or a timer while the server keeps running, the histograms are copied
+        return {
+            "counters": {
+                "messages_received": self.messages_received,
+                "bytes_received": self.bytes_received,
+                "messages_sent": self.messages_sent,
+                "bytes_sent": self.bytes_sent,
+                "failed_sends": self.failed_sends
+            },
+            "stages_ns": {stage: histogram.copy().summary() for stage, histogram in self.histograms.items()}
+        }
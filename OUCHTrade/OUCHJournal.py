@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import os
+import mmap
+from array import array
+
+
+class OUCHJournal:
+    # Append-only, memory-mapped file of the sequenced messages sent on one session.
+    # Messages are stored as sent (2 byte length prefix included), the file is zero filled past the last message.
+    # offsets[n - 1] is the file offset of sequence number n.
+
+    _packet_length = 2
+
+    def __init__(self, path, initial_size=1 << 20):
+        self.path = path
+        if not os.path.exists(path):
+            open(path, "wb").close()
+        self.file = open(path, "r+b")
+        size = os.fstat(self.file.fileno()).st_size
+        if size < initial_size:
+            self.file.truncate(initial_size)
+            size = initial_size
+        self.mmap = mmap.mmap(self.file.fileno(), size)
+        self.offsets = array("Q")
+        self.write_offset = 0
+        self._recover()
+
+    def _recover(self):
+        # Rebuild the sequence number index from an existing journal file
+        size = len(self.mmap)
+        while self.write_offset + self._packet_length <= size:
+            packet_length = int.from_bytes(self.mmap[self.write_offset:self.write_offset + self._packet_length],
+                                           byteorder='big')
+            if packet_length == 0:
+                break
+            self.offsets.append(self.write_offset)
+            self.write_offset += self._packet_length + packet_length
+
+    @property
+    def next_sequence_number(self):
+        return len(self.offsets) + 1
+
+    def _grow(self, required_size):
+        size = len(self.mmap)
+        while size < required_size:
+            size *= 2
+        self.file.truncate(size)
+        self.mmap.resize(size)
+
+    def append(self, message):
+        message_length = len(message)
+        if self.write_offset + message_length + self._packet_length > len(self.mmap):
+            self._grow(self.write_offset + message_length + self._packet_length)
+        self.mmap[self.write_offset:self.write_offset + message_length] = message
+        self.offsets.append(self.write_offset)
+        self.write_offset += message_length
+
+    def replay_range(self, sequence_number):
+        # (file offset, length) of every message from sequence_number onwards, None if there are none.
+        # Appends go through the shared mapping, so the file already holds them for sendfile.
+        if sequence_number < 1 or sequence_number >= self.next_sequence_number:
+            return None
+        offset = self.offsets[sequence_number - 1]
+        return offset, self.write_offset - offset
+
+    def replay_view(self, sequence_number):
+        # Every message from sequence_number onwards as one memoryview of the mapped file, None if there are none.
+        # The view must be released before the next append so the mapping can grow.
+        if sequence_number < 1 or sequence_number >= self.next_sequence_number:
+            return None
+        return memoryview(self.mmap)[self.offsets[sequence_number - 1]:self.write_offset]
+
+    def close(self):
+        self.mmap.flush()
+        self.mmap.close()
+        self.file.close()
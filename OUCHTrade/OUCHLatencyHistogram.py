@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+
+class OUCHLatencyHistogram:
+    # HDR style log-linear histogram of integer values (e.g. nanoseconds).
+    # Values are grouped by power of two and each group is split into linear sub buckets, so the relative
+    # error stays below 1 / 2^(sub_bucket_bits - 1) across the whole range.
+    __slots__ = ("sub_bucket_bits", "counts", "count", "total", "min", "max")
+
+    def __init__(self, sub_bucket_bits=7):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def _index(self, value):
+        shift = max(0, value.bit_length() - self.sub_bucket_bits)
+        return shift, value >> shift
+
+    def record(self, value):
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def copy(self):
+        # Consistent copy that can be taken while another thread keeps recording
+        histogram = OUCHLatencyHistogram(self.sub_bucket_bits)
+        histogram.counts = self.counts.copy()
+        histogram.count = sum(histogram.counts.values())
+        histogram.total = self.total
+        histogram.min = self.min
+        histogram.max = self.max
+        return histogram
+
+    def percentile(self, percentile):
+        # Upper bound of the bucket holding the value at the given percentile (0-100)
+        if self.count == 0:
+            return 0
+        target = max(1, int(round(self.count * percentile / 100.0)))
+        seen = 0
+        for shift, sub_bucket in sorted(self.counts, key=lambda index: index[1] << index[0]):
+            seen += self.counts[(shift, sub_bucket)]
+            if seen >= target:
+                return min(self.max, ((sub_bucket + 1) << shift) - 1)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "min": self.min or 0,
+            "mean": self.total / self.count if self.count else 0,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "p99.9": self.percentile(99.9),
+            "max": self.max
+        }
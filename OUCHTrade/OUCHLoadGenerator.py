@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+import sys
+import argparse
+import json
+import random
+import selectors
+import time
+
+from OUCHTrade.OUCHAppClient import OUCHAppClient
+from OUCHTrade.OUCHParser import OUCHParser
+from OUCHTrade.OUCHLatencyHistogram import OUCHLatencyHistogram
+
+
+class OUCHLoadGenerator:
+    # Non-interactive driver for OUCHAppClient: sends a seeded new / replace / cancel mix at a fixed rate and
+    # measures the round trip from sending each order to receiving the ack with the same order token.
+
+    def __init__(self, ouch_app_client, rate, duration, symbols, mix, seed=1, base_price=100.0, drain_timeout=2.0):
+        self.ouch_app_client = ouch_app_client
+        self.rate = rate
+        self.duration = duration
+        self.symbols = symbols
+        # (new, replace, cancel) weights
+        self.mix = mix
+        self.random = random.Random(seed)
+        self.seed = seed
+        self.base_price = base_price
+        self.drain_timeout = drain_timeout
+
+        # order_token -> (message type, send time in ns) of every request waiting for its ack
+        self.pending = {}
+        # order_token -> open quantity of every accepted order
+        self.live_orders = {}
+        self.sent = {"new": 0, "replace": 0, "cancel": 0}
+        self.received = {"accepted": 0, "replaced": 0, "canceled": 0, "executed": 0, "rejected": 0}
+        self.histograms = {"new": OUCHLatencyHistogram(), "replace": OUCHLatencyHistogram(),
+                           "cancel": OUCHLatencyHistogram()}
+        self.elapsed = 0.0
+
+    def send_next_order(self):
+        client = self.ouch_app_client
+        action = self.random.choices(("new", "replace", "cancel"), weights=self.mix)[0]
+        if action != "new" and not self.live_orders:
+            action = "new"
+
+        if action == "new":
+            order_token = client.current_seq_num
+            symbol = self.random.choice(self.symbols)
+            side = self.random.choice("BS")
+            quantity = self.random.randint(1, 10) * 100
+            price = round(self.base_price + self.random.randint(-10, 10) / 10, 1)
+            message = client.create_new_order(symbol, side, quantity, price)
+        elif action == "replace":
+            existing_order_token = self.random.choice(list(self.live_orders))
+            order_token = client.current_seq_num
+            quantity = self.random.randint(1, 10) * 100
+            price = round(self.base_price + self.random.randint(-10, 10) / 10, 1)
+            message = client.create_replace_order(existing_order_token, quantity, price)
+            # The existing order can no longer be replaced or canceled by the generator
+            del self.live_orders[existing_order_token]
+        else:
+            order_token = self.random.choice(list(self.live_orders))
+            message = client.create_cancel_order(order_token)
+            del self.live_orders[order_token]
+
+        self.pending[order_token] = (action, time.perf_counter_ns())
+        self.sent[action] += 1
+        client.ouch_client_sock.send(message)
+
+    def record_ack(self, order_token, receive_time):
+        pending = self.pending.pop(order_token, None)
+        if pending is not None:
+            action, send_time = pending
+            self.histograms[action].record(receive_time - send_time)
+
+    def process_messages(self):
+        for message in self.ouch_app_client.ouch_client_sock.receive_frames():
+            receive_time = time.perf_counter_ns()
+            ouch_view = OUCHParser.parse_ouch_view(message)
+            if ouch_view.packet_type != "S":
+                continue
+
+            message_type = ouch_view.message_type
+            if message_type == "A":
+                self.received["accepted"] += 1
+                self.live_orders[ouch_view.order_token] = ouch_view.quantity
+                self.record_ack(ouch_view.order_token, receive_time)
+            elif message_type == "U":
+                self.received["replaced"] += 1
+                if ouch_view.quantity > 0:
+                    self.live_orders[ouch_view.replacement_order_token] = ouch_view.quantity
+                self.record_ack(ouch_view.replacement_order_token, receive_time)
+            elif message_type == "C":
+                self.received["canceled"] += 1
+                self.record_ack(ouch_view.order_token, receive_time)
+            elif message_type == "E":
+                self.received["executed"] += 1
+                order_token = ouch_view.order_token
+                if order_token in self.live_orders:
+                    self.live_orders[order_token] -= ouch_view.executed_quantity
+                    if self.live_orders[order_token] <= 0:
+                        del self.live_orders[order_token]
+            elif message_type == "J":
+                self.received["rejected"] += 1
+                self.live_orders.pop(ouch_view.order_token, None)
+                self.record_ack(ouch_view.order_token, receive_time)
+
+    def run(self):
+        client = self.ouch_app_client
+
+        # Open Connection to OUCH Server and log in
+        client.ouch_client_sock.connect(client.host, client.port)
+        client.ouch_client_sock.send(client.create_login_request())
+        client.start_sending_heartbeats()
+
+        selector = selectors.DefaultSelector()
+        selector.register(client.ouch_client_sock.sock, selectors.EVENT_READ)
+        # This loop stands in for the client's reader thread and drives its timer wheel for the heartbeats
+        timer_wheel = client.timer_wheel
+
+        interval = 1.0 / self.rate
+        start_time = time.perf_counter()
+        end_time = start_time + self.duration
+        next_send_time = start_time
+        try:
+            while True:
+                now = time.perf_counter()
+                if now >= end_time:
+                    break
+                while next_send_time <= now and next_send_time < end_time:
+                    self.send_next_order()
+                    next_send_time += interval
+                if client.ouch_client_sock.has_pending_output:
+                    # Orders queued behind a full socket buffer
+                    client.ouch_client_sock.flush()
+                client.run_loop_calls()
+                timeout = max(0.0, min(next_send_time, end_time) - time.perf_counter())
+                time_until_next_tick = timer_wheel.time_until_next_tick()
+                if time_until_next_tick is not None:
+                    timeout = min(timeout, time_until_next_tick)
+                if selector.select(timeout):
+                    self.process_messages()
+                timer_wheel.advance()
+
+            # Wait for the acks still in flight
+            drain_end_time = time.perf_counter() + self.drain_timeout
+            while self.pending and time.perf_counter() < drain_end_time:
+                if selector.select(max(0.0, drain_end_time - time.perf_counter())):
+                    self.process_messages()
+        finally:
+            self.elapsed = time.perf_counter() - start_time
+            selector.close()
+            client.ouch_client_sock.close()
+
+        return self.results()
+
+    def results(self):
+        overall = OUCHLatencyHistogram()
+        for histogram in self.histograms.values():
+            overall.merge(histogram)
+
+        return {
+            "config": {
+                "rate": self.rate,
+                "duration": self.duration,
+                "symbols": self.symbols,
+                "mix": self.mix,
+                "seed": self.seed
+            },
+            "elapsed_seconds": self.elapsed,
+            "sent": self.sent,
+            "received": self.received,
+            "unacknowledged": len(self.pending),
+            "latency_ns": {
+                "all": overall.summary(),
+                "new": self.histograms["new"].summary(),
+                "replace": self.histograms["replace"].summary(),
+                "cancel": self.histograms["cancel"].summary()
+            }
+        }
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="OUCH load generator")
+    parser.add_argument("host")
+    parser.add_argument("port", type=int)
+    parser.add_argument("username")
+    parser.add_argument("password")
+    parser.add_argument("--rate", type=float, default=1000.0, help="orders per second")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--symbols", default="1", help="comma separated orderbook ids")
+    parser.add_argument("--mix", default="60,20,20", help="new,replace,cancel weights")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    arguments = parser.parse_args()
+
+    main_client = OUCHAppClient(arguments.host, arguments.port, arguments.username, arguments.password, "1")
+    ouch_load_generator = OUCHLoadGenerator(main_client, arguments.rate, arguments.duration,
+                                            arguments.symbols.split(","),
+                                            [float(weight) for weight in arguments.mix.split(",")], arguments.seed)
+
+    # Run the load and report the results
+    main_results = ouch_load_generator.run()
+    if arguments.output:
+        with open(arguments.output, "w") as output_file:
+            json.dump(main_results, output_file, indent=2)
+    json.dump(main_results, sys.stdout, indent=2)
+    print()
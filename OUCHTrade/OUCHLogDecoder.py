@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import sys
+from datetime import datetime
+
+from OUCHTrade.OUCHBinaryLogger import OUCHBinaryLogger
+from OUCHTrade.OUCHParser import OUCHParser
+
+
+class OUCHLogDecoder:
+    # Reads a log written by OUCHBinaryLogger and turns the frames back into text
+
+    _packet_length = 2
+
+    def __init__(self, path):
+        self.path = path
+
+    def records(self):
+        # Yield (timestamp ns, direction, connection id, frame) for every complete record
+        with open(self.path, "rb") as log_file:
+            data = log_file.read()
+
+        if not data.startswith(OUCHBinaryLogger.magic):
+            raise ValueError(f"{self.path} is not an OUCH binary log")
+
+        record_header = OUCHBinaryLogger.record_header
+        offset = len(OUCHBinaryLogger.magic)
+        while offset + record_header.size + self._packet_length <= len(data):
+            timestamp, direction, connection_id = record_header.unpack_from(data, offset)
+            frame_offset = offset + record_header.size
+            frame_end = frame_offset + self._packet_length + \
+                int.from_bytes(data[frame_offset:frame_offset + self._packet_length], byteorder='big')
+            if frame_end > len(data):
+                # Last record was cut short, e.g. the process was killed during a write
+                return
+            yield timestamp, direction.decode(), connection_id, data[frame_offset:frame_end]
+            offset = frame_end
+
+    @staticmethod
+    def format_record(timestamp, direction, connection_id, frame):
+        sending_time = datetime.fromtimestamp(timestamp / 1e9).isoformat(timespec="microseconds")
+        arrow = "<-" if direction == "I" else "->"
+        return f"{sending_time} {arrow} {connection_id}: {OUCHParser.parse_ouch_bytes(frame)}"
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) != 2:
+        print("usage:", sys.argv[0], "<log file>")
+        sys.exit(1)
+
+    ouch_log_decoder = OUCHLogDecoder(sys.argv[1])
+
+    # Print every logged frame
+    for record in ouch_log_decoder.records():
+        print(ouch_log_decoder.format_record(*record))
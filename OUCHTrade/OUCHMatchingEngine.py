@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+import bisect
+
+
+class OUCHOrder:
+    __slots__ = ("session", "order_token", "buy_sell_indicator", "quantity", "price", "orderbook_id", "order_number")
+
+    def __init__(self, session, order_token, buy_sell_indicator, quantity, price, orderbook_id, order_number):
+        self.session = session
+        self.order_token = order_token
+        self.buy_sell_indicator = buy_sell_indicator
+        self.quantity = quantity
+        self.price = price
+        self.orderbook_id = orderbook_id
+        self.order_number = order_number
+
+
+class OUCHFill:
+    # One execution between an incoming order and a resting order
+    __slots__ = ("aggressor", "resting", "executed_quantity", "execution_price", "match_number")
+
+    def __init__(self, aggressor, resting, executed_quantity, execution_price, match_number):
+        self.aggressor = aggressor
+        self.resting = resting
+        self.executed_quantity = executed_quantity
+        self.execution_price = execution_price
+        self.match_number = match_number
+
+
+class OUCHOrderBook:
+    # Price levels are kept in sorted price lists, each level is an insertion ordered dict used as a FIFO queue
+
+    def __init__(self, orderbook_id, free_orders=None):
+        self.orderbook_id = orderbook_id
+        # Orders that leave the book are put here for reuse when the engine pools orders
+        self.free_orders = free_orders
+        # Bid prices are stored negated so both sides are sorted best price first
+        self.bid_prices = []
+        self.ask_prices = []
+        self.bid_levels = {}
+        self.ask_levels = {}
+
+    def _side(self, buy_sell_indicator):
+        if buy_sell_indicator == "B":
+            return self.bid_prices, self.bid_levels, -1
+        return self.ask_prices, self.ask_levels, 1
+
+    def add(self, order):
+        prices, levels, sign = self._side(order.buy_sell_indicator)
+        level = levels.get(order.price)
+        if level is None:
+            level = levels[order.price] = {}
+            bisect.insort(prices, sign * order.price)
+        level[id(order)] = order
+
+    def remove(self, order):
+        prices, levels, sign = self._side(order.buy_sell_indicator)
+        level = levels[order.price]
+        del level[id(order)]
+        if not level:
+            del levels[order.price]
+            del prices[bisect.bisect_left(prices, sign * order.price)]
+
+    def match(self, order, next_match_number, fills=None, new_fill=OUCHFill):
+        # Match an incoming order against the opposite side, returns the fills in execution order
+        # fills and new_fill let a pooling engine reuse the fill list and fill objects
+        if order.buy_sell_indicator == "B":
+            prices, levels, sign = self.ask_prices, self.ask_levels, 1
+        else:
+            prices, levels, sign = self.bid_prices, self.bid_levels, -1
+
+        if fills is None:
+            fills = []
+        while order.quantity > 0 and prices:
+            best_price = sign * prices[0]
+            if (order.buy_sell_indicator == "B" and best_price > order.price) or \
+                    (order.buy_sell_indicator != "B" and best_price < order.price):
+                break
+
+            level = levels[best_price]
+            while order.quantity > 0 and level:
+                resting = level[next(iter(level))]
+                executed_quantity = min(order.quantity, resting.quantity)
+                order.quantity -= executed_quantity
+                resting.quantity -= executed_quantity
+                fills.append(new_fill(order, resting, executed_quantity, best_price, next_match_number()))
+                if resting.quantity == 0:
+                    del level[id(resting)]
+                    del resting.session.live_orders[resting.order_token]
+                    if self.free_orders is not None:
+                        self.free_orders.append(resting)
+
+            if not level:
+                del levels[best_price]
+                del prices[0]
+
+        return fills
+
+
+class OUCHMatchingEngine:
+    # Price-time priority matching with one order book per orderbook_id.
+    # Live orders are indexed by order token in each session's live_orders dict.
+    # With pooled=True orders and fills are reused instead of allocated, so steady order flow creates almost no
+    # garbage. An order or fill list returned by a call is then only valid until the next call.
+
+    def __init__(self, pooled=False):
+        self.order_books = {}
+        self.match_number = 0
+        self.free_orders = [] if pooled else None
+        self.fills = []
+        self.fill_pool = []
+        self.fills_used = 0
+
+    def next_match_number(self):
+        self.match_number += 1
+        return self.match_number
+
+    def order_book(self, orderbook_id):
+        order_book = self.order_books.get(orderbook_id)
+        if order_book is None:
+            order_book = self.order_books[orderbook_id] = OUCHOrderBook(orderbook_id, self.free_orders)
+        return order_book
+
+    def create_order(self, session, order_token, buy_sell_indicator, quantity, price, orderbook_id, order_number):
+        if self.free_orders:
+            order = self.free_orders.pop()
+            order.__init__(session, order_token, buy_sell_indicator, quantity, price, orderbook_id, order_number)
+            return order
+        return OUCHOrder(session, order_token, buy_sell_indicator, quantity, price, orderbook_id, order_number)
+
+    def release_order(self, order):
+        if self.free_orders is not None:
+            self.free_orders.append(order)
+
+    def reuse_fill(self, aggressor, resting, executed_quantity, execution_price, match_number):
+        if self.fills_used < len(self.fill_pool):
+            fill = self.fill_pool[self.fills_used]
+            fill.__init__(aggressor, resting, executed_quantity, execution_price, match_number)
+        else:
+            fill = OUCHFill(aggressor, resting, executed_quantity, execution_price, match_number)
+            self.fill_pool.append(fill)
+        self.fills_used += 1
+        return fill
+
+    def match(self, order_book, order):
+        if self.free_orders is None:
+            return order_book.match(order, self.next_match_number)
+        self.fills.clear()
+        self.fills_used = 0
+        return order_book.match(order, self.next_match_number, self.fills, self.reuse_fill)
+
+    def new_order(self, session, new_order_dict, order_number):
+        # Returns the order and its fills, any remaining quantity rests in the book unless it is immediate or cancel
+        order = self.create_order(session, new_order_dict["order_token"], new_order_dict["buy_sell_indicator"],
+                                  new_order_dict["quantity"], new_order_dict["price"], new_order_dict["orderbook_id"],
+                                  order_number)
+        order_book = self.order_book(order.orderbook_id)
+        fills = self.match(order_book, order)
+        if order.quantity > 0 and new_order_dict["time_in_force"] != 0:
+            order_book.add(order)
+            session.live_orders[order.order_token] = order
+        else:
+            self.release_order(order)
+        return order, fills
+
+    def replace_order(self, session, replace_request_dict, order_number):
+        # Returns the replacement order and its fills, or None if the existing order is not live
+        order = session.live_orders.pop(replace_request_dict["existing_order_token"], None)
+        if order is None:
+            return None, []
+
+        order_book = self.order_books[order.orderbook_id]
+        quantity = replace_request_dict["quantity"]
+        price = replace_request_dict["price"]
+        order.order_token = replace_request_dict["replacement_order_token"]
+        order.order_number = order_number
+
+        if price == order.price and quantity <= order.quantity:
+            # Quantity decrease at the same price keeps time priority
+            order.quantity = quantity
+            fills = []
+            if quantity == 0:
+                order_book.remove(order)
+        else:
+            order_book.remove(order)
+            order.quantity = quantity
+            order.price = price
+            fills = self.match(order_book, order)
+            if order.quantity > 0:
+                order_book.add(order)
+
+        if order.quantity > 0:
+            session.live_orders[order.order_token] = order
+        else:
+            self.release_order(order)
+        return order, fills
+
+    def cancel_order(self, session, order_token, quantity):
+        # Reduce the order to quantity (0 cancels it), returns the decrement
+        order = session.live_orders.get(order_token)
+        if order is None or quantity >= order.quantity:
+            return 0
+
+        decrement_quantity = order.quantity - quantity
+        order.quantity = quantity
+        if quantity == 0:
+            self.order_books[order.orderbook_id].remove(order)
+            del session.live_orders[order_token]
+            self.release_order(order)
+        return decrement_quantity
+
+    def cancel_session(self, session):
+        # Remove every live order of a session, e.g. when it disconnects, returns the removed orders
+        orders = list(session.live_orders.values())
+        for order in orders:
+            self.order_books[order.orderbook_id].remove(order)
+            self.release_order(order)
+        session.live_orders.clear()
+        return orders
@@ -1,5 +1,187 @@
 #!/usr/bin/env python3
 
+import struct
+
+from OUCHTrade.OUCHSchema import message_dicts, unsequenced_message_dicts, sequenced_message_dicts, \
+    empty_packet_types, message_packet_types
+
+
+class OUCHMessageDecoder:
+    __slots__ = ("packet_type", "message_list", "base_offset", "struct", "names", "alpha_indexes", "fields")
+
+    def __init__(self, packet_type, message_list, base_offset):
+        self.packet_type = packet_type
+        self.message_list = message_list
+        self.base_offset = base_offset
+
+        # Build a single big-endian struct for the whole message, padding over any unused bytes
+        struct_format = ">"
+        position = 0
+        names = []
+        alpha_indexes = []
+        # Per field accessors used by OUCHMessageView: name -> (absolute offset, length, struct or None for alpha)
+        fields = {}
+        for message_item in sorted(message_list, key=lambda item: item[1]):
+            if message_item[1] > position:
+                struct_format += f"{message_item[1] - position}x"
+            if message_item[3] == "integer":
+                field_format = {1: "B", 2: "H", 4: "I", 8: "Q"}[message_item[2]]
+                fields[message_item[0]] = (base_offset + message_item[1], message_item[2], struct.Struct(">" + field_format))
+            else:
+                field_format = f"{message_item[2]}s"
+                fields[message_item[0]] = (base_offset + message_item[1], message_item[2], None)
+                alpha_indexes.append(len(names))
+            struct_format += field_format
+            names.append(message_item[0])
+            position = message_item[1] + message_item[2]
+
+        self.struct = struct.Struct(struct_format)
+        self.names = tuple(names)
+        self.alpha_indexes = tuple(alpha_indexes)
+        self.fields = fields
+
+    def decode(self, ouch_bytes):
+        ouch_dict = {"packet_type": self.packet_type}
+
+        if len(ouch_bytes) - self.base_offset < self.struct.size:
+            # Truncated message, only decode the fields that are present
+            return OUCHParser.parse_message(ouch_bytes[self.base_offset:], self.message_list, ouch_dict)
+
+        values = list(self.struct.unpack_from(ouch_bytes, self.base_offset))
+        for alpha_index in self.alpha_indexes:
+            values[alpha_index] = values[alpha_index].decode(encoding='utf-8')
+        ouch_dict.update(zip(self.names, values))
+
+        return ouch_dict
+
+    def decode_into(self, ouch_bytes, ouch_dict):
+        # Same as decode, into a dict the caller reuses for every message of this type
+        if len(ouch_bytes) - self.base_offset < self.struct.size:
+            ouch_dict.clear()
+            ouch_dict["packet_type"] = self.packet_type
+            return OUCHParser.parse_message(ouch_bytes[self.base_offset:], self.message_list, ouch_dict)
+
+        ouch_dict["packet_type"] = self.packet_type
+        ouch_dict.update(zip(self.names, self.struct.unpack_from(ouch_bytes, self.base_offset)))
+        for alpha_index in self.alpha_indexes:
+            name = self.names[alpha_index]
+            ouch_dict[name] = ouch_dict[name].decode(encoding='utf-8')
+
+        return ouch_dict
+
+
+def compile_decoders():
+    decoders = {}
+    for packet_type, message_list in message_dicts.items():
+        decoders[(packet_type, None)] = OUCHMessageDecoder(packet_type, message_list, 0)
+    for message_type, message_list in unsequenced_message_dicts.items():
+        decoders[('U', message_type)] = OUCHMessageDecoder('U', message_list, 3)
+    for message_type, message_list in sequenced_message_dicts.items():
+        decoders[('S', message_type)] = OUCHMessageDecoder('S', message_list, 3)
+    return decoders
+
+
+# Compiled once at import, keyed by (packet_type, message_type)
+decoders = compile_decoders()
+
+
+class OUCHMessageView:
+    # Read-only view over a received frame, fields are decoded from the buffer only when accessed
+    __slots__ = ("buffer", "_decoder")
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self._decoder = None
+
+    @property
+    def packet_type(self):
+        return chr(self.buffer[2])
+
+    @property
+    def decoder(self):
+        if self._decoder is None:
+            packet_type_chr = chr(self.buffer[2])
+            if packet_type_chr in message_packet_types:
+                self._decoder = decoders.get((packet_type_chr, chr(self.buffer[3])))
+            else:
+                self._decoder = decoders.get((packet_type_chr, None))
+        return self._decoder
+
+    def __getitem__(self, name):
+        if name == "packet_type":
+            return chr(self.buffer[2])
+        elif name == "text" and self.buffer[2] == ord('+'):
+            return str(self.buffer[3:], encoding='utf-8')
+
+        decoder = self.decoder
+        if decoder is None or name not in decoder.fields:
+            raise KeyError(name)
+        offset, length, field_struct = decoder.fields[name]
+        if len(self.buffer) < offset + length:
+            # Field is beyond the end of a truncated message
+            raise KeyError(name)
+        if field_struct is None:
+            return str(self.buffer[offset:offset + length], encoding='utf-8')
+        return field_struct.unpack_from(self.buffer, offset)[0]
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __contains__(self, name):
+        try:
+            self[name]
+            return True
+        except (KeyError, IndexError):
+            return False
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def to_dict(self):
+        return OUCHParser.parse_ouch_bytes(self.buffer)
+
+    def __repr__(self):
+        return f"OUCHMessageView({self.to_dict()})"
+
+
+class OUCHMessagePool:
+    # parse_ouch_bytes without a new dict per message: each message type is decoded into the same dict every time,
+    # so a message is only valid until the next message of its type is parsed
+    __slots__ = ("dicts",)
+
+    def __init__(self):
+        # decoder -> (dict, number of keys the decoder fills)
+        self.dicts = {}
+
+    def parse(self, ouch_bytes):
+        packet_type_chr = chr(ouch_bytes[2])
+        if packet_type_chr in message_packet_types:
+            decoder = decoders.get((packet_type_chr, chr(ouch_bytes[3])))
+        else:
+            decoder = decoders.get((packet_type_chr, None))
+        if decoder is None:
+            # Empty and debug packets are small and rare
+            return OUCHParser.parse_ouch_bytes(ouch_bytes)
+
+        pooled = self.dicts.get(decoder)
+        if pooled is None:
+            ouch_dict = decoder.decode_into(ouch_bytes, {})
+            self.dicts[decoder] = (ouch_dict, 1 + len(decoder.names))
+            return ouch_dict
+
+        ouch_dict, size = pooled
+        while len(ouch_dict) > size:
+            # Keys added by whoever handled the last message must not leak into this one, they are the newest keys
+            ouch_dict.popitem()
+        return decoder.decode_into(ouch_bytes, ouch_dict)
+
+
 class OUCHParser:
 
     @staticmethod
@@ -7,7 +189,7 @@ class OUCHParser:
         for message_item in message_list:
             if len(ouch_bytes) >= (message_item[1]+message_item[2]):
                 if message_item[3] == "alpha":
-                    ouch_dict[message_item[0]] = ouch_bytes[message_item[1]:message_item[1]+message_item[2]].decode(encoding='utf-8')
+                    ouch_dict[message_item[0]] = str(ouch_bytes[message_item[1]:message_item[1]+message_item[2]], encoding='utf-8')
                 elif message_item[3] == "integer":
                     ouch_dict[message_item[0]] = int.from_bytes(ouch_bytes[message_item[1]:message_item[1]+message_item[2]], byteorder='big')
 
@@ -15,185 +197,20 @@ class OUCHParser:
 
     @staticmethod
     def parse_ouch_bytes(ouch_bytes: bytes):
-        ouch_dict = {}
-        chunks = b''
-        packet_length = 2
-
-        message_dicts = {
-            'A':  # Login Accepted Packet
-            [
-                ["session", 3, 10, "alpha"],
-                ["sequence_number", 13, 20, "alpha"]
-            ],
-            'J':  # Login Reject Packet
-            [
-                ["reject_reason_code", 3, 1, "alpha"]
-            ],
-            'L':  # Login Request Packet
-            [
-                ["username", 3, 6, "alpha"],
-                ["password", 9, 10, "alpha"],
-                ["requested_session", 19, 10, "alpha"],
-                ["requested_sequence_number", 29, 20, "alpha"]
-            ]
-        }
-
-        unsequenced_message_dicts = {
-            'O':  # Enter Order Message
-            [
-                ["message_type", 0, 1, "alpha"],
-                ["order_token", 1, 4, "integer"],
-                ["client_reference", 5, 10, "alpha"],
-                ["buy_sell_indicator", 15, 1, "alpha"],
-                ["quantity", 16, 4, "integer"],
-                ["orderbook_id", 20, 4, "integer"],
-                ["group", 24, 4, "alpha"],
-                ["price", 28, 4, "integer"],
-                ["time_in_force", 32, 4, "integer"],
-                ["firm_id", 36, 4, "integer"],
-                ["display", 40, 1, "alpha"],
-                ["capacity", 41, 1, "alpha"],
-                ["minimum_quantity", 42, 4, "integer"],
-                ["order_classification", 46, 1, "alpha"],
-                ["cash_margin_type", 47, 1, "alpha"]
-            ],
-            'U':  # Replace Order Message
-            [
-                ["message_type", 0, 1, "alpha"],
-                ["existing_order_token", 1, 4, "integer"],
-                ["replacement_order_token", 5, 4, "integer"],
-                ["quantity", 9, 4, "integer"],
-                ["price", 13, 4, "integer"],
-                ["time_in_force", 17, 4, "integer"],
-                ["display", 21, 1, "alpha"],
-                ["minimum_quantity", 22, 4, "integer"]
-            ],
-            'X':  # Cancel Order Message
-            [
-                ["message_type", 0, 1, "alpha"],
-                ["order_token", 1, 4, "integer"],
-                ["quantity", 5, 4, "integer"]
-            ]
-        }
-
-        sequenced_message_dicts = {
-            'S':  # System Event Message
-            [
-                ["message_type", 0, 1, "alpha"],
-                ["timestamp", 1, 8, "integer"],
-                ["system_event", 9, 1, "alpha"]
-            ],
-            'A':  # Order Accepted Message
-            [
-                ["message_type", 0, 1, "alpha"],
-                ["timestamp", 1, 8, "integer"],
-                ["order_token", 9, 4, "integer"],
-                ["client_reference", 13, 10, "alpha"],
-                ["buy_sell_indicator", 23, 1, "alpha"],
-                ["quantity", 24, 4, "integer"],
-                ["orderbook_id", 28, 4, "integer"],
-                ["group", 32, 4, "alpha"],
-                ["price", 36, 4, "integer"],
-                ["time_in_force", 40, 4, "integer"],
-                ["firm_id", 44, 4, "integer"],
-                ["display", 48, 1, "alpha"],
-                ["order_number", 50, 8, "integer"],
-                ["minimum_quantity", 58, 4, "integer"],
-                ["order_state", 62, 1, "alpha"],
-                ["order_classification", 63, 1, "alpha"],
-                ["cash_margin_type", 64, 1, "alpha"]
-            ],
-            'U':  # Order Replaced Message
-            [
-                ["message_type", 0, 1, "alpha"],
-                ["timestamp", 1, 8, "integer"],
-                ["replacement_order_token", 9, 4, "integer"],
-                ["buy_sell_indicator", 13, 1, "alpha"],
-                ["quantity", 14, 4, "integer"],
-                ["orderbook_id", 18, 4, "integer"],
-                ["group", 22, 4, "alpha"],
-                ["price", 26, 4, "integer"],
-                ["time_in_force", 30, 4, "integer"],
-                ["display", 34, 1, "alpha"],
-                ["order_number", 35, 8, "integer"],
-                ["minimum_quantity", 43, 4, "integer"],
-                ["order_state", 47, 1, "alpha"],
-                ["previous_order_token", 48, 4, "integer"]
-            ],
-            'C':  # Order Canceled Message
-            [
-                ["message_type", 0, 1, "alpha"],
-                ["timestamp", 1, 8, "integer"],
-                ["order_token", 9, 4, "integer"],
-                ["decrement_quantity", 13, 4, "integer"],
-                ["order_canceled_reason", 17, 1, "alpha"]
-            ],
-            'D':  # Order AIQ Canceled Message
-            [
-                ["message_type", 0, 1, "alpha"],
-                ["timestamp", 1, 8, "integer"],
-                ["order_token", 9, 4, "integer"],
-                ["decrement_quantity", 13, 4, "integer"],
-                ["order_canceled_reason", 17, 1, "alpha"],
-                ["quantity_prevented_from_trading", 18, 4, "integer"],
-                ["execution_price", 22, 4, "integer"],
-                ["liquidity_indicator", 26, 1, "alpha"]
-            ],
-            'E':  # Order Executed Message
-            [
-                ["message_type", 0, 1, "alpha"],
-                ["timestamp", 1, 8, "integer"],
-                ["order_token", 9, 4, "integer"],
-                ["executed_quantity", 13, 4, "integer"],
-                ["execution_price", 17, 4, "integer"],
-                ["liquidity_indicator", 21, 1, "alpha"],
-                ["match_number", 22, 8, "integer"]
-            ],
-            'J':  # Order Rejected Message
-            [
-                ["message_type", 0, 1, "alpha"],
-                ["timestamp", 1, 8, "integer"],
-                ["order_token", 9, 4, "integer"],
-                ["order_rejected_reason", 13, 1, "alpha"]
-            ]
-        }
-
-        packet_length_bytes = ouch_bytes[:packet_length]
-        packet_length_int = int.from_bytes(packet_length_bytes, byteorder='big')
-        packet_type_byte = ouch_bytes[packet_length]
-        packet_type_chr = chr(packet_type_byte)
-        ouch_dict["packet_type"] = packet_type_chr
-
-        if packet_type_chr == 'H':  # Server Heartbeat
-            ouch_dict["packet_type"] = 'H'
-        elif packet_type_chr == 'R':  # Client Heartbeat
-            ouch_dict["packet_type"] = 'R'
-        elif packet_type_chr == 'Z':  # End of Session Packet
-            ouch_dict["packet_type"] = 'Z'
-        elif packet_type_chr == 'O':  # Logout Request Packet
-            ouch_dict["packet_type"] = 'O'
+        packet_type_chr = chr(ouch_bytes[2])
+
+        if packet_type_chr in empty_packet_types:
+            return {"packet_type": packet_type_chr}
         elif packet_type_chr == '+':  # Debug Packet
-            ouch_dict["packet_type"] = '+'
-            text = ouch_bytes[3:].decode(encoding='utf-8')
-            ouch_dict["text"] = text
-        elif packet_type_chr == 'S':  # Sequenced Data Packet
-            ouch_dict["packet_type"] = 'S'
-            message_type_byte = ouch_bytes[packet_length+1]
-            message_type_chr = chr(message_type_byte)
-            message_list = sequenced_message_dicts[message_type_chr]
-            if message_list:
-                ouch_dict = OUCHParser.parse_message(ouch_bytes[packet_length+1:], message_list, ouch_dict)
-        elif packet_type_chr == 'U':  # Unsequenced Data Packet
-            ouch_dict["packet_type"] = 'U'
-            message_type_byte = ouch_bytes[packet_length+1]
-            message_type_chr = chr(message_type_byte)
-            message_list = unsequenced_message_dicts[message_type_chr]
-            if message_list:
-                ouch_dict = OUCHParser.parse_message(ouch_bytes[packet_length+1:], message_list, ouch_dict)
+            return {"packet_type": '+', "text": str(ouch_bytes[3:], encoding='utf-8')}
+        elif packet_type_chr in message_packet_types:
+            return decoders[(packet_type_chr, chr(ouch_bytes[3]))].decode(ouch_bytes)
         else:
-            message_list = message_dicts[packet_type_chr]
-            ouch_dict["packet_type"] = packet_type_chr
-            if message_list:
-                ouch_dict = OUCHParser.parse_message(ouch_bytes, message_list, ouch_dict)
+            return decoders[(packet_type_chr, None)].decode(ouch_bytes)
 
-        return ouch_dict
+    @staticmethod
+    def parse_ouch_view(ouch_bytes):
+        # Lazy alternative to parse_ouch_bytes, nothing is decoded or copied until a field is read
+        if not isinstance(ouch_bytes, memoryview):
+            ouch_bytes = memoryview(ouch_bytes)
+        return OUCHMessageView(ouch_bytes)
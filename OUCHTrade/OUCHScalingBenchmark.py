@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import argparse
+import collections
+import json
+import multiprocessing
+import random
+import resource
+import selectors
+import time
+
+from OUCHTrade.OUCHAppServer import OUCHAppServer
+from OUCHTrade.OUCHAppClient import new_order_encoder, cancel_order_encoder
+from OUCHTrade.OUCHEncoder import encoders
+from OUCHTrade.OUCHSocketHandler import OUCHSocketHandler
+from OUCHTrade.OUCHParser import OUCHParser
+from OUCHTrade.OUCHLatencyHistogram import OUCHLatencyHistogram
+
+login_request_encoder = encoders[('L', None)]
+client_heartbeat_encoder = encoders[('R', None)]
+
+
+def raise_open_file_limit(required):
+    # A thousand sessions need more descriptors than the usual soft limit of 1024
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < required:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (required if hard == resource.RLIM_INFINITY else
+                                                    min(required, hard), hard))
+
+
+class OUCHScalingSession:
+    # One synthetic client session: keeps window requests in flight until it has sent its share of the workload.
+    # Requests are new orders that do not cross and cancels of the session's oldest live order.
+    __slots__ = ("ouch_client_sock", "random", "next_order_token", "remaining", "in_flight", "live_orders",
+                 "logged_in")
+
+    def __init__(self, ouch_client_sock, orders, seed):
+        self.ouch_client_sock = ouch_client_sock
+        self.random = random.Random(seed)
+        self.next_order_token = 1
+        self.remaining = orders
+        # order_token -> send time in ns
+        self.in_flight = {}
+        self.live_orders = collections.deque()
+        self.logged_in = False
+
+    def send_next_request(self):
+        if self.live_orders and self.random.random() < 0.4:
+            order_token = self.live_orders.popleft()
+            message = cancel_order_encoder.encode(order_token=order_token, quantity=0)
+        else:
+            order_token = self.next_order_token
+            self.next_order_token += 1
+            side = self.random.choice("BS")
+            price = (990 if side == "B" else 1001) + self.random.randint(0, 9)
+            message = new_order_encoder.encode(order_token=order_token, buy_sell_indicator=side, quantity=100,
+                                               orderbook_id=1, group="DAY ", price=price, time_in_force=99999,
+                                               capacity="A", order_classification="1", cash_margin_type="1")
+        self.remaining -= 1
+        self.in_flight[order_token] = time.perf_counter_ns()
+        self.ouch_client_sock.send(message)
+
+
+class OUCHScalingBenchmark:
+    # End to end throughput and ack latency of OUCHAppServer as the number of concurrent sessions grows.
+    # For each session count a fresh server runs in its own process and client processes open the sessions over
+    # loopback, then each session sends orders requests with window of them in flight and measures the round trip
+    # of each to its ack (Accepted, Canceled or Rejected). CPU is process time over the measured interval, 100% is
+    # one core. Per message console logging is turned off on the server so it does not dominate the measurement.
+
+    def __init__(self, session_counts, orders, window=1, client_processes=1, low_gc=False, timeout=300.0,
+                 seed=1):
+        self.session_counts = session_counts
+        self.orders = orders
+        self.window = window
+        self.client_processes = client_processes
+        self.low_gc = low_gc
+        self.timeout = timeout
+        self.seed = seed
+
+    @staticmethod
+    def run_server(low_gc, sessions, port_connection, stop_event, cpu_seconds):
+        raise_open_file_limit(sessions + 64)
+        sys.stdout = open(os.devnull, "w")
+
+        ouch_app_server = OUCHAppServer("127.0.0.1", 0, low_gc=low_gc)
+        ouch_app_server.log_received_message = ouch_app_server.log_sent_message = lambda *arguments: None
+        ouch_app_server.ouch_server_sock.sock.bind(("127.0.0.1", 0))
+        ouch_app_server.ouch_server_sock.sock.listen(1024)
+        ouch_app_server.ouch_server_sock.sock.setblocking(False)
+        ouch_app_server.selector.register(ouch_app_server.ouch_server_sock.sock, selectors.EVENT_READ, None)
+        if ouch_app_server.gc_scheduler is not None:
+            ouch_app_server.gc_scheduler.start()
+        port_connection.send(ouch_app_server.ouch_server_sock.sock.getsockname()[1])
+
+        while not stop_event.is_set():
+            ouch_app_server.process_events(0.05)
+            cpu_seconds.value = time.process_time()
+
+    @staticmethod
+    def log_in(port, session_ids, orders, seed, selector):
+        # Connect and log in a batch at a time, so the listen backlog never overflows
+        sessions = []
+        for batch_start in range(0, len(session_ids), 64):
+            batch = []
+            for session_id in session_ids[batch_start:batch_start + 64]:
+                ouch_client_sock = OUCHSocketHandler()
+                ouch_client_sock.connect("127.0.0.1", port)
+                ouch_client_sock.send(login_request_encoder.encode(username="bench", password="bench",
+                                                                   requested_sequence_number="1"))
+                session = OUCHScalingSession(ouch_client_sock, orders, seed + session_id)
+                selector.register(ouch_client_sock.sock, selectors.EVENT_READ, session)
+                batch.append(session)
+
+            deadline = time.monotonic() + 10.0
+            while not all(session.logged_in for session in batch) and time.monotonic() < deadline:
+                for key, _ in selector.select(0.1):
+                    for message in key.data.ouch_client_sock.receive_frames(readable=True):
+                        if chr(message[2]) == "A":
+                            key.data.logged_in = True
+            sessions.extend(batch)
+        return sessions
+
+    @staticmethod
+    def run_clients(port, session_ids, orders, window, seed, timeout, start_barrier, results_queue):
+        raise_open_file_limit(len(session_ids) + 64)
+        sys.stdout = open(os.devnull, "w")
+        selector = selectors.DefaultSelector()
+        sessions = OUCHScalingBenchmark.log_in(port, session_ids, orders, seed, selector)
+        histogram = OUCHLatencyHistogram()
+        completed = 0
+        start_barrier.wait()
+
+        start_time = time.monotonic()
+        start_cpu_seconds = time.process_time()
+        for session in sessions:
+            for _ in range(min(window, session.remaining)):
+                session.send_next_request()
+
+        deadline = start_time + timeout
+        next_heartbeat_time = start_time + 1.0
+        active = sum(1 for session in sessions if session.in_flight)
+        while active and time.monotonic() < deadline:
+            for key, _ in selector.select(0.1):
+                session = key.data
+                for message in session.ouch_client_sock.receive_frames(readable=True):
+                    if message[2] != ord("S") or message[3] not in b"ACJ":
+                        continue
+                    receive_time = time.perf_counter_ns()
+                    ouch_view = OUCHParser.parse_ouch_view(message)
+                    send_time = session.in_flight.pop(ouch_view.order_token, None)
+                    if send_time is None:
+                        continue
+                    histogram.record(receive_time - send_time)
+                    completed += 1
+                    if message[3] == ord("A"):
+                        session.live_orders.append(ouch_view.order_token)
+                    if session.remaining:
+                        session.send_next_request()
+                    elif not session.in_flight:
+                        active -= 1
+                if session.ouch_client_sock.has_pending_output:
+                    session.ouch_client_sock.flush()
+
+            if time.monotonic() >= next_heartbeat_time:
+                # The server closes sessions that stay silent, a session waiting on the server sends nothing
+                next_heartbeat_time += 1.0
+                for session in sessions:
+                    if time.monotonic() - session.ouch_client_sock.last_send_time >= 1.0:
+                        session.ouch_client_sock.send(client_heartbeat_encoder.template)
+        end_time = time.monotonic()
+
+        results_queue.put({
+            "start_time": start_time,
+            "end_time": end_time,
+            "cpu_seconds": time.process_time() - start_cpu_seconds,
+            "completed": completed,
+            "logged_in": sum(1 for session in sessions if session.logged_in),
+            "unacknowledged": sum(len(session.in_flight) + session.remaining for session in sessions),
+            "histogram": histogram
+        })
+        for session in sessions:
+            session.ouch_client_sock.close()
+        selector.close()
+
+    def run_step(self, sessions):
+        # Throughput, latency and CPU for one session count
+        context = multiprocessing.get_context("fork")
+        port_receiver, port_sender = context.Pipe(duplex=False)
+        stop_event = context.Event()
+        server_cpu_seconds = context.Value("d", 0.0, lock=False)
+        server_process = context.Process(target=self.run_server,
+                                         args=[self.low_gc, sessions, port_sender, stop_event, server_cpu_seconds])
+        server_process.start()
+        port = port_receiver.recv()
+
+        client_processes = min(self.client_processes, sessions)
+        start_barrier = context.Barrier(client_processes + 1)
+        results_queue = context.Queue()
+        client_process_list = []
+        for client_index in range(client_processes):
+            client_process = context.Process(target=self.run_clients,
+                                             args=[port, list(range(client_index, sessions, client_processes)),
+                                                   self.orders, self.window, self.seed, self.timeout,
+                                                   start_barrier, results_queue])
+            client_process.start()
+            client_process_list.append(client_process)
+
+        try:
+            start_barrier.wait(timeout=self.timeout)
+            start_server_cpu_seconds = server_cpu_seconds.value
+            client_results = [results_queue.get(timeout=self.timeout + 30) for _ in client_process_list]
+            end_server_cpu_seconds = server_cpu_seconds.value
+        finally:
+            stop_event.set()
+            for client_process in client_process_list:
+                client_process.join(5)
+            server_process.join(5)
+            if server_process.is_alive():
+                server_process.terminate()
+
+        histogram = OUCHLatencyHistogram()
+        for client_result in client_results:
+            histogram.merge(client_result["histogram"])
+        elapsed = max(result["end_time"] for result in client_results) - \
+            min(result["start_time"] for result in client_results)
+        completed = sum(result["completed"] for result in client_results)
+
+        return {
+            "sessions": sessions,
+            "logged_in": sum(result["logged_in"] for result in client_results),
+            "messages": completed,
+            "unacknowledged": sum(result["unacknowledged"] for result in client_results),
+            "elapsed_seconds": elapsed,
+            "messages_per_second": completed / elapsed if elapsed > 0 else 0.0,
+            "rtt_ns": histogram.summary(),
+            "server_cpu_percent": (end_server_cpu_seconds - start_server_cpu_seconds) / elapsed * 100
+            if elapsed > 0 else 0.0,
+            "client_cpu_percent": sum(result["cpu_seconds"] for result in client_results) / elapsed * 100
+            if elapsed > 0 else 0.0
+        }
+
+    def run(self):
+        results = []
+        for sessions in self.session_counts:
+            result = self.run_step(sessions)
+            self.print_result(result)
+            results.append(result)
+
+        return {
+            "config": {
+                "session_counts": self.session_counts,
+                "orders_per_session": self.orders,
+                "window": self.window,
+                "client_processes": self.client_processes,
+                "low_gc": self.low_gc,
+                "seed": self.seed,
+                "cpu_count": os.cpu_count(),
+                "python": sys.version.split()[0]
+            },
+            "results": results
+        }
+
+    @staticmethod
+    def print_header():
+        print(f"{'sessions':>8}{'msgs/s':>10}{'p50 us':>10}{'p99 us':>10}{'server cpu':>12}{'client cpu':>12}"
+              f"{'unacked':>9}")
+
+    @staticmethod
+    def print_result(result):
+        print(f"{result['sessions']:>8}{result['messages_per_second']:>10.0f}{result['rtt_ns']['p50'] / 1000:>10.0f}"
+              f"{result['rtt_ns']['p99'] / 1000:>10.0f}{result['server_cpu_percent']:>11.0f}%"
+              f"{result['client_cpu_percent']:>11.0f}%{result['unacknowledged']:>9}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="OUCH server scaling benchmark over loopback")
+    parser.add_argument("--sessions", default="1,10,100,1000", help="comma separated session counts")
+    parser.add_argument("--orders", type=int, default=200, help="requests per session")
+    parser.add_argument("--window", type=int, default=1, help="requests in flight per session")
+    parser.add_argument("--client-processes", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--low-gc", action="store_true", help="run the server in low GC mode")
+    parser.add_argument("--timeout", type=float, default=300.0, help="seconds allowed per session count")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    arguments = parser.parse_args()
+
+    ouch_scaling_benchmark = OUCHScalingBenchmark([int(count) for count in arguments.sessions.split(",")],
+                                                  arguments.orders, arguments.window, arguments.client_processes,
+                                                  arguments.low_gc, arguments.timeout, arguments.seed)
+
+    # Run every session count and report the scaling curve
+    ouch_scaling_benchmark.print_header()
+    main_report = ouch_scaling_benchmark.run()
+    if arguments.output:
+        with open(arguments.output, "w") as output_file:
+            json.dump(main_report, output_file, indent=2)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+# Field layouts for each packet / message type: [name, offset, length, type]
+# Shared by OUCHParser for decoding and OUCHEncoder for building messages.
+# Offsets of the packet level messages are from the start of the packet (including the 2 byte length),
+# offsets of the sequenced and unsequenced messages are from the message type byte.
+
+message_dicts = {
+    'A':  # Login Accepted Packet
+    [
+        ["session", 3, 10, "alpha"],
+        ["sequence_number", 13, 20, "alpha"]
+    ],
+    'J':  # Login Reject Packet
+    [
+        ["reject_reason_code", 3, 1, "alpha"]
+    ],
+    'L':  # Login Request Packet
+    [
+        ["username", 3, 6, "alpha"],
+        ["password", 9, 10, "alpha"],
+        ["requested_session", 19, 10, "alpha"],
+        ["requested_sequence_number", 29, 20, "alpha"]
+    ]
+}
+
+unsequenced_message_dicts = {
+    'O':  # Enter Order Message
+    [
+        ["message_type", 0, 1, "alpha"],
+        ["order_token", 1, 4, "integer"],
+        ["client_reference", 5, 10, "alpha"],
+        ["buy_sell_indicator", 15, 1, "alpha"],
+        ["quantity", 16, 4, "integer"],
+        ["orderbook_id", 20, 4, "integer"],
+        ["group", 24, 4, "alpha"],
+        ["price", 28, 4, "integer"],
+        ["time_in_force", 32, 4, "integer"],
+        ["firm_id", 36, 4, "integer"],
+        ["display", 40, 1, "alpha"],
+        ["capacity", 41, 1, "alpha"],
+        ["minimum_quantity", 42, 4, "integer"],
+        ["order_classification", 46, 1, "alpha"],
+        ["cash_margin_type", 47, 1, "alpha"]
+    ],
+    'U':  # Replace Order Message
+    [
+        ["message_type", 0, 1, "alpha"],
+        ["existing_order_token", 1, 4, "integer"],
+        ["replacement_order_token", 5, 4, "integer"],
+        ["quantity", 9, 4, "integer"],
+        ["price", 13, 4, "integer"],
+        ["time_in_force", 17, 4, "integer"],
+        ["display", 21, 1, "alpha"],
+        ["minimum_quantity", 22, 4, "integer"]
+    ],
+    'X':  # Cancel Order Message
+    [
+        ["message_type", 0, 1, "alpha"],
+        ["order_token", 1, 4, "integer"],
+        ["quantity", 5, 4, "integer"]
+    ]
+}
+
+sequenced_message_dicts = {
+    'S':  # System Event Message
+    [
+        ["message_type", 0, 1, "alpha"],
+        ["timestamp", 1, 8, "integer"],
+        ["system_event", 9, 1, "alpha"]
+    ],
+    'A':  # Order Accepted Message
+    [
+        ["message_type", 0, 1, "alpha"],
+        ["timestamp", 1, 8, "integer"],
+        ["order_token", 9, 4, "integer"],
+        ["client_reference", 13, 10, "alpha"],
+        ["buy_sell_indicator", 23, 1, "alpha"],
+        ["quantity", 24, 4, "integer"],
+        ["orderbook_id", 28, 4, "integer"],
+        ["group", 32, 4, "alpha"],
+        ["price", 36, 4, "integer"],
+        ["time_in_force", 40, 4, "integer"],
+        ["firm_id", 44, 4, "integer"],
+        ["display", 48, 1, "alpha"],
+        ["capacity", 49, 1, "alpha"],
+        ["order_number", 50, 8, "integer"],
+        ["minimum_quantity", 58, 4, "integer"],
+        ["order_state", 62, 1, "alpha"],
+        ["order_classification", 63, 1, "alpha"],
+        ["cash_margin_type", 64, 1, "alpha"]
+    ],
+    'U':  # Order Replaced Message
+    [
+        ["message_type", 0, 1, "alpha"],
+        ["timestamp", 1, 8, "integer"],
+        ["replacement_order_token", 9, 4, "integer"],
+        ["buy_sell_indicator", 13, 1, "alpha"],
+        ["quantity", 14, 4, "integer"],
+        ["orderbook_id", 18, 4, "integer"],
+        ["group", 22, 4, "alpha"],
+        ["price", 26, 4, "integer"],
+        ["time_in_force", 30, 4, "integer"],
+        ["display", 34, 1, "alpha"],
+        ["order_number", 35, 8, "integer"],
+        ["minimum_quantity", 43, 4, "integer"],
+        ["order_state", 47, 1, "alpha"],
+        ["previous_order_token", 48, 4, "integer"]
+    ],
+    'C':  # Order Canceled Message
+    [
+        ["message_type", 0, 1, "alpha"],
+        ["timestamp", 1, 8, "integer"],
+        ["order_token", 9, 4, "integer"],
+        ["decrement_quantity", 13, 4, "integer"],
+        ["order_canceled_reason", 17, 1, "alpha"]
+    ],
+    'D':  # Order AIQ Canceled Message
+    [
+        ["message_type", 0, 1, "alpha"],
+        ["timestamp", 1, 8, "integer"],
+        ["order_token", 9, 4, "integer"],
+        ["decrement_quantity", 13, 4, "integer"],
+        ["order_canceled_reason", 17, 1, "alpha"],
+        ["quantity_prevented_from_trading", 18, 4, "integer"],
+        ["execution_price", 22, 4, "integer"],
+        ["liquidity_indicator", 26, 1, "alpha"]
+    ],
+    'E':  # Order Executed Message
+    [
+        ["message_type", 0, 1, "alpha"],
+        ["timestamp", 1, 8, "integer"],
+        ["order_token", 9, 4, "integer"],
+        ["executed_quantity", 13, 4, "integer"],
+        ["execution_price", 17, 4, "integer"],
+        ["liquidity_indicator", 21, 1, "alpha"],
+        ["match_number", 22, 8, "integer"]
+    ],
+    'J':  # Order Rejected Message
+    [
+        ["message_type", 0, 1, "alpha"],
+        ["timestamp", 1, 8, "integer"],
+        ["order_token", 9, 4, "integer"],
+        ["order_rejected_reason", 13, 1, "alpha"]
+    ]
+}
+
+# Packet types that carry no fields besides the packet type
+# H: Server Heartbeat, R: Client Heartbeat, Z: End of Session Packet, O: Logout Request Packet
+empty_packet_types = ('H', 'R', 'Z', 'O')
+
+# Packet types that wrap a message, the message type byte follows the packet type
+message_packet_types = ('S', 'U')
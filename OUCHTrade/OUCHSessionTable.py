@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+
+class OUCHSession:
+    # Per login state kept by the server
+    __slots__ = ("session_name", "username", "fileno", "ouch_client_sock", "current_seq_num", "live_orders",
+                 "journal", "order_tokens")
+
+    def __init__(self, session_name, username, ouch_client_sock=None):
+        self.session_name = session_name
+        self.username = username
+        self.ouch_client_sock = ouch_client_sock
+        self.fileno = ouch_client_sock.sock.fileno() if ouch_client_sock is not None else -1
+        self.current_seq_num = 1
+        # order_token -> OUCHOrder of every order that is still live in the matching engine
+        self.live_orders = {}
+        # OUCHJournal of the sequenced messages sent on this session, None when journaling is off
+        self.journal = None
+        # OUCHTokenIndex of the order tokens the session has used, shared by every login to the session name
+        self.order_tokens = None
+
+
+class OUCHDropCopySubscriber:
+    # A drop copy login: receives the sequenced messages of every session, or only of the named sessions
+    __slots__ = ("username", "ouch_client_sock", "session_names", "last_session_name")
+
+    def __init__(self, username, ouch_client_sock, session_names=None):
+        self.username = username
+        self.ouch_client_sock = ouch_client_sock
+        # Stripped session names, None for all sessions
+        self.session_names = session_names
+        # Session of the last message sent, a session marker is sent whenever it changes
+        self.last_session_name = None
+
+
+class OUCHSessionTable:
+    # Sessions indexed by socket file descriptor and by session name
+
+    def __init__(self, session_prefix=""):
+        self.sessions_by_fileno = {}
+        self.sessions_by_name = {}
+        # Put in front of every generated session name, so several servers never hand out the same name
+        self.session_prefix = session_prefix
+        self._next_session_id = 1
+
+    def __len__(self):
+        return len(self.sessions_by_fileno)
+
+    def __iter__(self):
+        return iter(list(self.sessions_by_fileno.values()))
+
+    def new_session_name(self, taken=None):
+        # Session names are 10 character alpha fields. taken(session_name) tells whether a name not in the table is
+        # still in use elsewhere, e.g. by the journal of an earlier run
+        while True:
+            session_name = (self.session_prefix + str(self._next_session_id)).rjust(10)
+            self._next_session_id += 1
+            if session_name not in self.sessions_by_name and (taken is None or not taken(session_name)):
+                return session_name
+
+    def add(self, session):
+        self.sessions_by_fileno[session.fileno] = session
+        self.sessions_by_name[session.session_name] = session
+
+    def get_by_fileno(self, fileno):
+        return self.sessions_by_fileno.get(fileno)
+
+    def get_by_name(self, session_name):
+        return self.sessions_by_name.get(session_name)
+
+    def remove(self, session):
+        self.sessions_by_fileno.pop(session.fileno, None)
+        if self.sessions_by_name.get(session.session_name) is session:
+            del self.sessions_by_name[session.session_name]
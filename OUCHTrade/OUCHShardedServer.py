@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import multiprocessing
+import queue
+import time
+
+from OUCHTrade.OUCHAppServer import OUCHAppServer
+
+
+class OUCHShardedServer:
+    # Runs one OUCHAppServer per worker process, all listening on the same port with SO_REUSEPORT.
+    # server_options are passed on to every worker's OUCHAppServer (journal_directory, instrument, log_path, low_gc,
+    # monotonic_clock). Session names generated by a worker start with its index, e.g. "2-15", so the workers never
+    # hand out the same name and their journals in a shared journal directory never collide. Each worker logs to
+    # its own binary log file, log_path followed by the worker index.
+
+    def __init__(self, host, port, workers, stats_interval=5.0, **server_options):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.stats_interval = stats_interval
+        self.server_options = server_options
+        self.worker_processes = []
+        self.worker_stats = {}
+
+    @staticmethod
+    def run_worker(worker_index, host, port, stats_interval, stats_queue, server_options):
+
+        server_options = dict(server_options)
+        if server_options.get("log_path") is not None:
+            server_options["log_path"] = f"{server_options['log_path']}.{worker_index}"
+        ouch_app_server = OUCHAppServer(host, port, reuse_port=True, session_prefix=f"{worker_index}-",
+                                        **server_options)
+
+        def report_stats():
+            ouch_app_server.timer_wheel.schedule(stats_interval, report_stats)
+            stats = ouch_app_server.stats()
+            stats["pid"] = os.getpid()
+            stats_queue.put(stats)
+
+        ouch_app_server.timer_wheel.schedule(stats_interval, report_stats)
+        ouch_app_server.start()
+
+    def aggregate_stats(self):
+        totals = {"workers": len(self.worker_stats), "sessions": 0, "messages_received": 0, "messages_sent": 0}
+        for stats in self.worker_stats.values():
+            totals["sessions"] += stats["sessions"]
+            totals["messages_received"] += stats["messages_received"]
+            totals["messages_sent"] += stats["messages_sent"]
+        return totals
+
+    def start(self):
+
+        # Workers are forked so they inherit the imported modules
+        context = multiprocessing.get_context("fork")
+        stats_queue = context.Queue()
+
+        for worker_index in range(self.workers):
+            worker_process = context.Process(target=self.run_worker,
+                                             args=[worker_index, self.host, self.port, self.stats_interval,
+                                                   stats_queue, self.server_options])
+            worker_process.daemon = True
+            worker_process.start()
+            self.worker_processes.append(worker_process)
+
+        try:
+            next_report_time = time.monotonic() + self.stats_interval
+            while True:
+                try:
+                    stats = stats_queue.get(timeout=max(0.0, next_report_time - time.monotonic()))
+                    self.worker_stats[stats["pid"]] = stats
+                except queue.Empty:
+                    pass
+
+                if time.monotonic() >= next_report_time:
+                    next_report_time += self.stats_interval
+                    print(f"Server stats: {self.aggregate_stats()}")
+
+        except KeyboardInterrupt:
+            print("caught keyboard interrupt, exiting")
+        finally:
+            for worker_process in self.worker_processes:
+                worker_process.terminate()
+            for worker_process in self.worker_processes:
+                worker_process.join()
+
+
+if __name__ == "__main__":
+
+    main_low_gc = "--low-gc" in sys.argv
+    main_monotonic_clock = "--monotonic-clock" in sys.argv
+    main_arguments = [argument for argument in sys.argv if argument not in ("--low-gc", "--monotonic-clock")]
+    if len(main_arguments) not in (3, 4, 5, 6):
+        print("usage:", sys.argv[0],
+              "<host> <port> [workers] [journal directory|-] [binary log file] [--low-gc] [--monotonic-clock]")
+        sys.exit(1)
+
+    main_host, main_port = main_arguments[1], int(main_arguments[2])
+    main_workers = int(main_arguments[3]) if len(main_arguments) >= 4 else os.cpu_count()
+    main_journal_directory = main_arguments[4] if len(main_arguments) >= 5 and main_arguments[4] != "-" else None
+    main_log_path = main_arguments[5] if len(main_arguments) == 6 else None
+
+    ouch_sharded_server = OUCHShardedServer(main_host, main_port, main_workers,
+                                            journal_directory=main_journal_directory, log_path=main_log_path,
+                                            low_gc=main_low_gc, monotonic_clock=main_monotonic_clock)
+
+    # Start the OUCH Server workers
+    ouch_sharded_server.start()
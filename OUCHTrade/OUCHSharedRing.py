@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import struct
+from multiprocessing import shared_memory, resource_tracker
+
+
+class OUCHSharedRing:
+    # Single producer, single consumer ring of OUCH frames in a multiprocessing.shared_memory segment.
+    # No lock: the producer only writes the head counter and the consumer only writes the tail counter, each
+    # after copying the frame bytes, so a frame is visible to the other side once it is complete.
+    # Frames keep their 2 byte length prefix, so they are stored as is and can wrap around the end of the data.
+    #
+    # Layout: head (8 bytes) at 0, tail (8 bytes) at 64 on its own cache line, capacity (8 bytes) at 128,
+    # data from 192. Head and tail count bytes written / read since creation, the position is counter % capacity.
+
+    _head_offset = 0
+    _tail_offset = 64
+    _capacity_offset = 128
+    _data_offset = 192
+    _counter = struct.Struct("=Q")
+    _packet_length = 2
+
+    def __init__(self, shared_memory_segment):
+        self.shared_memory = shared_memory_segment
+        self.buffer = shared_memory_segment.buf
+        self.capacity = self._counter.unpack_from(self.buffer, self._capacity_offset)[0]
+        self.data = self.buffer[self._data_offset:self._data_offset + self.capacity]
+
+    @classmethod
+    def create(cls, name, capacity=1 << 20):
+        shared_memory_segment = shared_memory.SharedMemory(name, create=True, size=cls._data_offset + capacity)
+        cls._counter.pack_into(shared_memory_segment.buf, cls._head_offset, 0)
+        cls._counter.pack_into(shared_memory_segment.buf, cls._tail_offset, 0)
+        cls._counter.pack_into(shared_memory_segment.buf, cls._capacity_offset, capacity)
+        return cls(shared_memory_segment)
+
+    @classmethod
+    def attach(cls, name):
+        # The creating process owns the segment, this process's resource tracker must not unlink it on exit
+        try:
+            shared_memory_segment = shared_memory.SharedMemory(name, track=False)
+        except TypeError:
+            # Before Python 3.13 attaching always registers the segment
+            shared_memory_segment = shared_memory.SharedMemory(name)
+            resource_tracker.unregister(shared_memory_segment._name, "shared_memory")
+        return cls(shared_memory_segment)
+
+    def _read_counter(self, offset):
+        return self._counter.unpack_from(self.buffer, offset)[0]
+
+    def push(self, frame):
+        # Returns False if the ring does not have room for the frame
+        frame_length = len(frame)
+        head = self._read_counter(self._head_offset)
+        if head + frame_length - self._read_counter(self._tail_offset) > self.capacity:
+            return False
+
+        start = head % self.capacity
+        first_part = min(frame_length, self.capacity - start)
+        self.data[start:start + first_part] = frame[:first_part]
+        if first_part < frame_length:
+            self.data[:frame_length - first_part] = frame[first_part:]
+
+        self._counter.pack_into(self.buffer, self._head_offset, head + frame_length)
+        return True
+
+    def pop(self):
+        # Next frame as bytes, None if the ring is empty
+        tail = self._read_counter(self._tail_offset)
+        if tail == self._read_counter(self._head_offset):
+            return None
+
+        start = tail % self.capacity
+        frame_length = self._packet_length + \
+            (self.data[start] << 8 | self.data[(start + 1) % self.capacity])
+        first_part = min(frame_length, self.capacity - start)
+        frame = bytes(self.data[start:start + first_part])
+        if first_part < frame_length:
+            frame += bytes(self.data[:frame_length - first_part])
+
+        self._counter.pack_into(self.buffer, self._tail_offset, tail + frame_length)
+        return frame
+
+    def close(self):
+        self.data.release()
+        self.buffer = None
+        self.shared_memory.close()
+
+    def unlink(self):
+        # Remove the segment, called by the creating process once every side has closed it
+        self.shared_memory.unlink()
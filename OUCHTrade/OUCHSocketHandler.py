@@ -1,8 +1,27 @@
 #!/usr/bin/env python3
 
+import os
 import socket
 import select
-import sys
+import collections
+import itertools
+import threading
+import time
+
+from OUCHTrade.OUCHFrameDecoder import OUCHFrameDecoder
+
+
+class OUCHFileSegment:
+    # Part of a file queued for output, written with sendfile so it is never copied into memory
+    __slots__ = ("file_descriptor", "offset", "count")
+
+    def __init__(self, file_descriptor, offset, count):
+        self.file_descriptor = file_descriptor
+        self.offset = offset
+        self.count = count
+
+    def __len__(self):
+        return self.count
 
 
 class OUCHSocketHandler:
@@ -10,23 +29,54 @@ class OUCHSocketHandler:
     _packet_length: int
     _check_sum_length: int
     _max_potential_message: int
-
-    def __init__(self, sock=None):
+    _frame_decoder: OUCHFrameDecoder
+    connection_closed: bool
+    last_send_time: float
+    last_receive_time: float
+    auto_flush: bool
+    high_watermark: int
+    low_watermark: int
+    outbound_bytes: int
+    backpressure: bool
+
+    # sendmsg takes at most IOV_MAX (1024 on Linux) buffers
+    _max_buffers_per_send = 512
+
+    def __init__(self, sock=None, auto_flush=True, high_watermark=1 << 20, low_watermark=256 << 10):
         if sock is None:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         else:
             self.sock = sock
+            # Sends never block, unsent data waits in the outbound buffer
+            self.sock.setblocking(False)
         self._packet_length = 2
         self._check_sum_length = 7
         self._max_potential_message = 2048
+        self._frame_decoder = OUCHFrameDecoder()
+        self.connection_closed = False
+        # Monotonic times of the last outbound and inbound traffic, used for heartbeat suppression and idle detection
+        self.last_send_time = time.monotonic()
+        self.last_receive_time = self.last_send_time
+        self._send_lock = threading.Lock()
+        # Messages not yet written to the socket. With auto_flush every send writes immediately when nothing is
+        # queued; without it messages wait for flush(), so an event loop can coalesce one iteration's output
+        self.auto_flush = auto_flush
+        self._outbound = collections.deque()
+        self.outbound_bytes = 0
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.backpressure = False
 
     def connect(self, host, port):
         print("starting connection to", (host, port))
         self.sock.connect((host, port))
         self.sock.setblocking(False)
 
-    def listen(self, host, port):
+    def listen(self, host, port, reuse_port=False):
+        if reuse_port:
+            # Several processes listen on the same port and the kernel spreads connections across them
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.sock.bind((host, port))
         self.sock.listen()
         print(f'Listening for connection on {host}:{port}...')
@@ -34,66 +84,169 @@ class OUCHSocketHandler:
     def close(self):
         # print("Closing connection")
         # self.sock.shutdown(socket.SHUT_RDWR)
+        self.connection_closed = True
         self.sock.close()
 
     def send(self, message):
-
-        # Is the socket ready to send data?
-        _, write_sockets, exception_sockets = select.select([], [self.sock], [self.sock], 0)
-
-        if self.sock in exception_sockets:
-            # Check if socket in error state
-            raise RuntimeError("socket connection broken")
-        elif self.sock in write_sockets:
-            # Socket is ready to send data
-            total_sent = 0
-            while total_sent < len(message):
-                try:
-                    sent = self.sock.send(message[total_sent:])
-                    if sent == 0:
-                        raise RuntimeError("socket connection broken")
-                except Exception as e:
-                    print('Writing error: '.format(str(e)))
-                    sys.exit()
-                total_sent += sent
-            return True
-        else:
-            print("Unable to send data")
-            return False
+        # Queue a message and, with auto_flush, write as much as the socket takes now.
+        # Returns False once the outbound buffer is above the high watermark: the message is still queued, but
+        # the caller should hold back until backpressure clears (below the low watermark).
+        # Raises ConnectionError if the connection is closed or broken.
+        with self._send_lock:
+            if self.connection_closed:
+                raise ConnectionError("connection closed")
+            if self.auto_flush and not self._outbound:
+                # Nothing queued, send directly and only buffer what the socket does not take
+                sent = self._send_now(message)
+                if sent == len(message):
+                    return not self.backpressure
+                message = message[sent:]
+            if isinstance(message, memoryview):
+                # Queued beyond the caller's use of the underlying buffer
+                message = bytes(message)
+            self._outbound.append(message)
+            self.outbound_bytes += len(message)
+            if self.outbound_bytes >= self.high_watermark:
+                self.backpressure = True
+            return not self.backpressure
+
+    def send_file(self, file_descriptor, offset, count):
+        # Queue count bytes of a file from offset, e.g. a journal replay. The bytes are read when they are written,
+        # so that part of the file must not change until then. Same return value and errors as send().
+        with self._send_lock:
+            if self.connection_closed:
+                raise ConnectionError("connection closed")
+            self._outbound.append(OUCHFileSegment(file_descriptor, offset, count))
+            self.outbound_bytes += count
+            if self.outbound_bytes >= self.high_watermark:
+                self.backpressure = True
+            if self.auto_flush:
+                self._flush()
+            return not self.backpressure
+
+    def _send_now(self, message):
+        try:
+            sent = self.sock.send(message)
+        except BlockingIOError:
+            return 0
+        except OSError as e:
+            self.connection_closed = True
+            raise ConnectionError(f"writing error: {e}") from e
+        self.last_send_time = time.monotonic()
+        return sent
+
+    def flush(self):
+        # Write the queued messages with as few sendmsg (writev) calls as the socket allows.
+        # Returns True once everything is written.
+        with self._send_lock:
+            return self._flush()
+
+    def _flush(self):
+        outbound = self._outbound
+        while outbound:
+            if type(outbound[0]) is OUCHFileSegment:
+                if not self._send_file_segment(outbound[0]):
+                    break
+                outbound.popleft()
+                continue
+
+            # Messages up to the next file segment
+            buffers = list(itertools.takewhile(lambda message: type(message) is not OUCHFileSegment,
+                                               itertools.islice(outbound, self._max_buffers_per_send)))
+            try:
+                sent = self.sock.sendmsg(buffers)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                self.connection_closed = True
+                raise ConnectionError(f"writing error: {e}") from e
+            self.last_send_time = time.monotonic()
+            self.outbound_bytes -= sent
+            while sent:
+                message_length = len(outbound[0])
+                if message_length <= sent:
+                    outbound.popleft()
+                    sent -= message_length
+                else:
+                    outbound[0] = memoryview(outbound[0])[sent:]
+                    sent = 0
+
+        if self.backpressure and self.outbound_bytes <= self.low_watermark:
+            self.backpressure = False
+        return not outbound
+
+    def _send_file_segment(self, file_segment):
+        # Returns True once the whole segment is written
+        while file_segment.count:
+            try:
+                sent = os.sendfile(self.sock.fileno(), file_segment.file_descriptor, file_segment.offset,
+                                   file_segment.count)
+            except BlockingIOError:
+                return False
+            except OSError as e:
+                self.connection_closed = True
+                raise ConnectionError(f"writing error: {e}") from e
+            if sent == 0:
+                # The file is shorter than the segment
+                self.outbound_bytes -= file_segment.count
+                file_segment.count = 0
+                break
+            self.last_send_time = time.monotonic()
+            self.outbound_bytes -= sent
+            file_segment.offset += sent
+            file_segment.count -= sent
+        return True
+
+    @property
+    def has_pending_output(self):
+        return bool(self._outbound)
+
+    def receive_frames(self, readable=False):
+        # Yield every complete message as a memoryview of the receive buffer, valid until the next read
+        # readable=True skips the first select when the caller's event loop already reported the socket readable
+        frame_decoder = self._frame_decoder
+
+        try:
+            while True:
+                if not readable and self.sock.getblocking():
+                    # Check if the socket has any data to read. A non-blocking socket is read directly, recv raises
+                    # BlockingIOError when it is empty, and select cannot watch descriptors above FD_SETSIZE
+                    read_sockets, _, exception_sockets = select.select([self.sock], [], [self.sock], 0)
+
+                    if self.sock in exception_sockets:
+                        # Socket in error state
+                        self.connection_closed = True
+                        return
+                    elif not read_sockets:
+                        # Socket does not have any data left to read
+                        return
+                readable = False
+
+                # Read everything that is available in one call and split it into messages
+                space = frame_decoder.read_space()
+                received = frame_decoder.recv_into(self.sock)
+                if received == 0:
+                    self.connection_closed = True
+                    return
+                self.last_receive_time = time.monotonic()
+                yield from frame_decoder.frames()
+
+                if received < space:
+                    # Short read, the socket has been drained
+                    return
+                if self.backpressure:
+                    # Responses are piling up, leave the rest for when the outbound buffer has drained
+                    return
+
+        except BlockingIOError:
+            # Nothing to read after all
+            return
+        except ConnectionError:
+            # Peer reset the connection
+            self.connection_closed = True
+        except OSError as e:
+            print('Reading error: {}'.format(str(e)))
+            self.connection_closed = True
 
     def receive(self):
-        chunks = []
-        received_messages = []
-
-        # Check if the socket has any data to read
-        while True:
-
-            try:
-                read_sockets, _, exception_sockets = select.select([self.sock], [], [self.sock], 0)
-
-                if self.sock in exception_sockets:
-                    # Check if socket in error state
-                    raise RuntimeError("socket connection broken")
-                elif not read_sockets:
-                    # Socket does not have any data left to read
-                    return received_messages
-                elif self.sock in read_sockets:
-                    # Socket has data left to read
-
-                    packet_length_bytes = self.sock.recv(self._packet_length)
-                    if packet_length_bytes == b'':
-                        return received_messages
-                    # Determine the length of the OUCH message
-                    packet_length_int = int.from_bytes(packet_length_bytes, byteorder='big')
-                    chunks.append(packet_length_bytes)
-
-                    # Receive the packet type and remaining payload
-                    body_bytes = self.sock.recv(packet_length_int)
-                    chunks.append(body_bytes)
-
-                    received_messages.append(b''.join(chunks))
-                    chunks = []
-
-            except Exception as e:
-                print('Reading error: '.format(str(e)))
-                sys.exit()
+        return [bytes(frame) for frame in self.receive_frames()]
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import time
+
+
+class OUCHTimer:
+    __slots__ = ("deadline_tick", "callback", "args", "cancelled")
+
+    def __init__(self, deadline_tick, callback, args):
+        self.deadline_tick = deadline_tick
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class OUCHTimerWheel:
+    # Hashed timing wheel shared by all sessions: timers are hashed into wheel_size slots by their deadline tick,
+    # so scheduling is O(1) and each tick only looks at one slot.
+    # The owner drives it by calling advance() from its I/O loop, using time_until_next_tick() as the select timeout.
+    # It is not thread safe: timers are scheduled from the thread that runs the loop.
+
+    def __init__(self, tick_interval=0.05, wheel_size=512):
+        self.tick_interval = tick_interval
+        self.wheel_size = wheel_size
+        self.slots = [[] for _ in range(wheel_size)]
+        self.start_time = time.monotonic()
+        self.current_tick = 0
+        self.timer_count = 0
+
+    def _tick_of(self, now):
+        return int((now - self.start_time) / self.tick_interval)
+
+    def schedule(self, delay, callback, *args):
+        # Run callback(*args) once, delay seconds from now (rounded up to the next tick)
+        deadline_tick = max(self._tick_of(time.monotonic() + delay + self.tick_interval), self.current_tick + 1)
+        timer = OUCHTimer(deadline_tick, callback, args)
+        self.slots[deadline_tick % self.wheel_size].append(timer)
+        self.timer_count += 1
+        return timer
+
+    def time_until_next_tick(self):
+        # None when there is nothing scheduled, so the caller can block for its own timeout
+        if self.timer_count == 0:
+            return None
+        return max(0.0, (self.current_tick + 1) * self.tick_interval - (time.monotonic() - self.start_time))
+
+    def advance(self):
+        # Run every timer that is due, returns the number of callbacks run
+        target_tick = self._tick_of(time.monotonic())
+        callbacks_run = 0
+
+        while self.current_tick < target_tick:
+            self.current_tick += 1
+            slot_index = self.current_tick % self.wheel_size
+            slot = self.slots[slot_index]
+            if not slot:
+                continue
+            due_timers = [timer for timer in slot if timer.deadline_tick <= self.current_tick]
+            if len(due_timers) == len(slot):
+                self.slots[slot_index] = []
+            else:
+                # Timers more than one revolution away stay in the slot
+                self.slots[slot_index] = [timer for timer in slot if timer.deadline_tick > self.current_tick]
+            self.timer_count -= len(due_timers)
+
+            for timer in due_timers:
+                if not timer.cancelled:
+                    timer.callback(*timer.args)
+                    callbacks_run += 1
+
+        return callbacks_run
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+from array import array
+
+
+class OUCHTokenIndex:
+    # Order tokens a session has used, to reject duplicates.
+    # Holds at most window tokens: a hash set for O(1) lookups plus a ring of the tokens in arrival order, which
+    # grows as tokens arrive until it holds window tokens, after which the oldest token is evicted for each new one.
+    # Clients number their orders with increasing tokens, so any token at or below the highest evicted one is
+    # treated as already used.
+    __slots__ = ("window", "tokens", "arrival_order", "count", "highest_evicted")
+
+    def __init__(self, window=1 << 18):
+        self.window = window
+        self.tokens = set()
+        self.arrival_order = array("Q")
+        self.count = 0
+        self.highest_evicted = -1
+
+    def __contains__(self, token):
+        return token <= self.highest_evicted or token in self.tokens
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def add(self, token):
+        # Returns False if the token has already been used
+        if token <= self.highest_evicted or token in self.tokens:
+            return False
+
+        if self.count < self.window:
+            self.arrival_order.append(token)
+        else:
+            position = self.count % self.window
+            evicted = self.arrival_order[position]
+            self.tokens.discard(evicted)
+            if evicted > self.highest_evicted:
+                self.highest_evicted = evicted
+            self.arrival_order[position] = token
+        self.tokens.add(token)
+        self.count += 1
+        return True
@@ -2,6 +2,7 @@ from distutils.core import setup
 setup(
   name = 'OUCHTrade',
   packages = ['OUCHTrade'],
+  package_data = {'OUCHTrade': ['OUCHBenchmarkBaseline.json']},
   version = '0.1',
   license='MIT',
   description = 'OUCH Protocol Client and Server for Test Trading',
@@ -11,6 +12,7 @@ setup(
   download_url = 'https://github.com/raazgupta/OUCHTrade/archive/0.1.tar.gz',
   keywords = ['OUCH', 'TRADE', 'TEST', 'CLIENT', 'SERVER'],
   install_requires=[],
+  extras_require={"bulk": ["numpy"]},
   classifiers=[
     'Development Status :: 3 - Alpha',
     'Intended Audience :: Developers',